@@ -0,0 +1,147 @@
+from datetime import date, datetime, time, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import database
+import schemas, crud_async, availability, audit, tenancy
+from auth import current_user, require_admin
+from config import MAX_AVAILABILITY_DAYS
+
+# Async versions of the core endpoints in main.py, enabled with ASYNC_DB. main includes this
+# router before declaring its own routes, so these take precedence over the sync handlers,
+# and each one must behave as its sync counterpart (same checks, caches and indexes). Every
+# other endpoint is served by the sync handlers. Clinic databases (TENANTS) are not
+# supported in this mode; main refuses to start with both.
+router = APIRouter()
+
+async def get_async_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+# User endpoints
+@router.post("/users/", response_model=schemas.User, dependencies=[Depends(require_admin)])
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await crud_async.get_user_by_username(db, username=user.username)
+    if db_user:
+        raise HTTPException(status_code=400, detail="Username already registered")
+    return await crud_async.create_user(db=db, user=user)
+
+# Doctor endpoints
+@router.post("/doctors/", response_model=schemas.Doctor)
+async def create_doctor(doctor: schemas.DoctorCreate, db: AsyncSession = Depends(get_async_db)):
+    db_doctor = await crud_async.get_doctor_by_email(db, email=doctor.email)
+    if db_doctor:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return await crud_async.create_doctor(db=db, doctor=doctor)
+
+@router.get("/doctors/{doctor_id}", response_model=schemas.Doctor)
+async def read_doctor(doctor_id: int, db: AsyncSession = Depends(get_async_db)):
+    profiles = tenancy.doctor_profiles()
+    profile = profiles.get(doctor_id)
+    if profile is not None:
+        # Served without loading the row, so the read is recorded here
+        audit.log.read("doctors", doctor_id)
+    else:
+        db_doctor = await crud_async.get_doctor(db, doctor_id=doctor_id)
+        if db_doctor is None:
+            raise HTTPException(status_code=404, detail="Doctor not found")
+        profile = schemas.Doctor.model_validate(db_doctor).model_dump_json()
+        profiles.set(doctor_id, profile)
+    return Response(content=profile, media_type="application/json")
+
+@router.get("/doctors/{doctor_id}/availability", response_model=schemas.Availability)
+async def read_doctor_availability(
+    doctor_id: int, start_date: date, end_date: date, office_id: int, appointment_type_id: int,
+    db: AsyncSession = Depends(get_async_db)
+):
+    db_doctor = await crud_async.get_doctor(db, doctor_id=doctor_id)
+    if db_doctor is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    db_office = await crud_async.get_office(db, office_id=office_id)
+    if db_office is None or db_office.doctor_id != doctor_id:
+        raise HTTPException(status_code=404, detail="Office not found")
+    db_appointment_type = await crud_async.get_appointment_type(db, appointment_type_id=appointment_type_id)
+    if db_appointment_type is None or db_appointment_type.doctor_id != doctor_id:
+        raise HTTPException(status_code=404, detail="Appointment type not found")
+    if end_date < start_date or (end_date - start_date).days > MAX_AVAILABILITY_DAYS:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+
+    start = datetime.combine(start_date, time.min)
+    end = datetime.combine(end_date + timedelta(days=1), time.min)
+    free_slots = availability.find_free_slots(
+        await crud_async.get_doctor_schedules(db, doctor_id=doctor_id),
+        await crud_async.get_booked_intervals(db, doctor_id=doctor_id, start_time=start, end_time=end), start, end,
+        timedelta(minutes=db_appointment_type.duration_minutes)
+    )
+    return {
+        "doctor_id": doctor_id, "office_id": office_id, "appointment_type_id": appointment_type_id,
+        "slots": [{"start_time": s, "end_time": e} for s, e in free_slots],
+    }
+
+# Office endpoints
+@router.post("/doctors/{doctor_id}/offices/", response_model=schemas.Office)
+async def create_office_for_doctor(
+    doctor_id: int, office: schemas.OfficeCreate, db: AsyncSession = Depends(get_async_db)
+):
+    db_doctor = await crud_async.get_doctor(db, doctor_id=doctor_id)
+    if db_doctor is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    return await crud_async.create_doctor_office(db=db, office=office, doctor_id=doctor_id)
+
+# Schedule endpoints
+@router.post("/doctors/{doctor_id}/schedules/", response_model=schemas.Schedule)
+async def create_schedule_for_doctor(
+    doctor_id: int, schedule: schemas.ScheduleCreate, db: AsyncSession = Depends(get_async_db)
+):
+    db_doctor = await crud_async.get_doctor(db, doctor_id=doctor_id)
+    if db_doctor is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    return await crud_async.create_doctor_schedule(db=db, schedule=schedule, doctor_id=doctor_id)
+
+# AppointmentType endpoints
+@router.post("/doctors/{doctor_id}/appointment_types/", response_model=schemas.AppointmentType)
+async def create_appointment_type_for_doctor(
+    doctor_id: int, appointment_type: schemas.AppointmentTypeCreate, db: AsyncSession = Depends(get_async_db)
+):
+    db_doctor = await crud_async.get_doctor(db, doctor_id=doctor_id)
+    if db_doctor is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    return await crud_async.create_doctor_appointment_type(
+        db=db, appointment_type=appointment_type, doctor_id=doctor_id
+    )
+
+# Patient endpoints
+@router.post("/patients/", response_model=schemas.Patient)
+async def create_patient(patient: schemas.PatientCreate, db: AsyncSession = Depends(get_async_db)):
+    db_patient = await crud_async.get_patient_by_email(db, email=patient.email)
+    if db_patient:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return await crud_async.create_patient(db=db, patient=patient)
+
+# Declared before /patients/{patient_id}, which would take "search" for an id
+@router.get("/patients/search", response_model=schemas.PatientSearch, dependencies=[Depends(current_user)])
+async def search_patients(q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50),
+                          db: AsyncSession = Depends(get_async_db)):
+    return {"results": [
+        {**schemas.Patient.model_validate(patient).dict(), "match": kind, "score": score}
+        for patient, kind, score in await crud_async.search_patients(db, q, limit)
+    ]}
+
+@router.get("/patients/{patient_id}", response_model=schemas.Patient, dependencies=[Depends(current_user)])
+async def read_patient(patient_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_patient = await crud_async.get_patient(db, patient_id=patient_id)
+    if db_patient is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return db_patient
+
+# Appointment endpoints
+@router.post("/appointments/", response_model=schemas.Appointment)
+async def create_appointment(appointment: schemas.AppointmentCreate, db: AsyncSession = Depends(get_async_db)):
+    if await crud_async.has_conflicting_appointment(
+        db, doctor_id=appointment.doctor_id, start_time=appointment.start_time, end_time=appointment.end_time
+    ):
+        raise HTTPException(status_code=400, detail="Doctor is not available at this time")
+    db_appointment = await crud_async.create_appointment(db=db, appointment=appointment)
+    if db_appointment is None:
+        raise HTTPException(status_code=400, detail="Doctor is not available at this time")
+    return db_appointment
@@ -0,0 +1,197 @@
+import hmac
+import logging
+import threading
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+from database import database, models
+import tokens
+import tenancy
+from config import ADMIN_SECRET, AUDIT_ENABLED, AUDIT_BUFFER_SIZE, AUDIT_BATCH_SIZE, AUDIT_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Audit trail of who read or wrote which patient, appointment or doctor. Reads are seen by a
+# Session event as rows are loaded; writes are collected per session (ORM flushes, plus the
+# Core inserts that report their ids through `created`) and kept only if the session commits.
+# Entries go to an in-memory ring buffer that a background thread writes to audit_log in
+# batches, so a request never waits on an audit INSERT. The buffer is bounded: when the
+# writer falls behind by AUDIT_BUFFER_SIZE entries the oldest are dropped and counted.
+# The actor and request come from AuditMiddleware; work outside a request is "system".
+
+AUDITED = {models.Patient: "patients", models.Appointment: "appointments", models.Doctor: "doctors"}
+READ, CREATE, UPDATE, DELETE = "read", "create", "update", "delete"
+
+class RequestContext:
+    __slots__ = ("actor", "tenant", "method", "path", "client", "seen")
+
+    def __init__(self, actor, tenant=None, method=None, path=None, client=None, seen=None):
+        self.actor = actor
+        self.tenant = tenant
+        self.method = method
+        self.path = path
+        self.client = client
+        # (action, entity, record_id) already recorded in this request, so a row loaded twice is one entry
+        self.seen = seen
+
+SYSTEM = RequestContext("system")
+_context = ContextVar("audit_context", default=SYSTEM)
+
+class AuditLog:
+    def __init__(self, capacity: int, batch_size: int, interval: float):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self._buffer = deque(maxlen=capacity)
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def record(self, action, entity, record_id, context=None):
+        context = context or _context.get()
+        if context.seen is not None:
+            key = (action, entity, record_id)
+            if key in context.seen:
+                return
+            context.seen.add(key)
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(
+            (datetime.now(), context.actor, context.tenant, action, entity, record_id,
+             context.method, context.path, context.client)
+        )
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    def read(self, entity, record_id):
+        if self.running:
+            self.record(READ, entity, record_id)
+
+    def flush(self):
+        """Writes everything buffered so far; returns how many entries were written."""
+        written = 0
+        with self._flush_lock:
+            while self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                try:
+                    self._write(batch)
+                except Exception:
+                    # Back to the front of the buffer for the next flush
+                    logger.exception("audit batch write failed")
+                    self.failed_batches += 1
+                    self._buffer.extendleft(reversed(batch))
+                    break
+                written += len(batch)
+        self.written += written
+        return written
+
+    def _write(self, batch):
+        db = database.SessionLocal()
+        try:
+            db.execute(insert(models.AuditEntry), [
+                dict(zip(("at", "actor", "tenant", "action", "entity", "record_id", "method", "path", "client"), entry))
+                for entry in batch
+            ])
+            db.commit()
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the writer after writing whatever is still buffered."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def stats(self):
+        return {"buffered": len(self._buffer), "capacity": self._buffer.maxlen, "written": self.written,
+                "dropped": self.dropped, "failed_batches": self.failed_batches}
+
+log = AuditLog(AUDIT_BUFFER_SIZE, AUDIT_BATCH_SIZE, AUDIT_FLUSH_SECONDS)
+
+def created(db: Session, model, ids):
+    """Records rows inserted with Core statements; kept if `db` commits."""
+    if log.running:
+        db.info.setdefault("audit", []).extend((CREATE, AUDITED[model], record_id) for record_id in ids)
+
+# Session hooks, on every session (sync, and the sync side of AsyncSession)
+@event.listens_for(Session, "loaded_as_persistent")
+def _loaded(session, instance):
+    entity = AUDITED.get(type(instance))
+    if entity:
+        log.read(entity, instance.id)
+
+@event.listens_for(Session, "after_flush")
+def _flushed(session, flush_context):
+    if not log.running:
+        return
+    pending = session.info.setdefault("audit", [])
+    for action, instances in ((CREATE, session.new), (UPDATE, session.dirty), (DELETE, session.deleted)):
+        for instance in instances:
+            entity = AUDITED.get(type(instance))
+            if entity and (action != UPDATE or session.is_modified(instance)):
+                pending.append((action, entity, instance.id))
+
+@event.listens_for(Session, "after_commit")
+def _committed(session):
+    context = _context.get()
+    for action, entity, record_id in session.info.pop("audit", ()):
+        log.record(action, entity, record_id, context)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _rolled_back(session, previous_transaction):
+    session.info.pop("audit", None)
+
+def _actor(headers):
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if authorization[:7].lower() == "bearer ":
+        try:
+            return f"user:{tokens.authority.verify(authorization[7:]).username}"
+        except tokens.InvalidToken:
+            pass
+    secret = headers.get(b"admin-secret")
+    if secret and ADMIN_SECRET and hmac.compare_digest(secret, ADMIN_SECRET.encode()):
+        return "admin"
+    return "anonymous"
+
+class AuditMiddleware:
+    """Binds the caller and request to the audit entries written while serving it."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not AUDIT_ENABLED:
+            return await self.app(scope, receive, send)
+        client = scope.get("client")
+        token = _context.set(RequestContext(
+            _actor(dict(scope["headers"])), tenancy.name(), scope["method"], scope["path"],
+            client[0] if client else None, set()
+        ))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _context.reset(token)
@@ -0,0 +1,34 @@
+import hmac
+from typing import Optional
+from fastapi import Depends, HTTPException, Header
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import tokens
+import tenancy
+from config import ADMIN_SECRET
+
+# Request dependencies shared by the sync routes (main.py) and the async ones (async_routes.py).
+# Doctor panel authentication: bcrypt runs once at login, then requests carry a signed token
+# (tokens.py). The dependency is async so checking it never waits for a threadpool slot.
+# Operator endpoints, and creating panel accounts, take the admin secret header instead.
+
+bearer = HTTPBearer(auto_error=False)
+
+def unauthorized(detail):
+    return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+async def current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer)):
+    if credentials is None:
+        raise unauthorized("Not authenticated")
+    try:
+        claims = tokens.authority.verify(credentials.credentials)
+    except tokens.InvalidToken:
+        raise unauthorized("Invalid or expired token")
+    # Users are per clinic database, so a token only opens the clinic it was issued for
+    if claims.tenant != tenancy.name():
+        raise unauthorized("Token issued for another clinic")
+    return claims
+
+def require_admin(admin_secret: str = Header(None)):
+    # Closed when no secret is configured, rather than open to requests without the header
+    if not ADMIN_SECRET or not admin_secret or not hmac.compare_digest(admin_secret.encode(), ADMIN_SECRET.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
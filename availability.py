@@ -0,0 +1,99 @@
+import heapq
+from datetime import datetime, time, timedelta
+from itertools import islice
+from database.models import DayOfWeek
+
+DAYS = list(DayOfWeek)
+
+def weekly_windows(schedules):
+    # {weekday: [(start_time, end_time), ...]} sorted and with overlapping rows merged
+    windows = {}
+    for schedule in sorted(schedules, key=lambda s: (DAYS.index(s.day_of_week), s.start_time)):
+        day = DAYS.index(schedule.day_of_week)
+        day_windows = windows.setdefault(day, [])
+        if day_windows and schedule.start_time <= day_windows[-1][1]:
+            if schedule.end_time > day_windows[-1][1]:
+                day_windows[-1] = (day_windows[-1][0], schedule.end_time)
+        else:
+            day_windows.append((schedule.start_time, schedule.end_time))
+    return windows
+
+def working_windows(schedules, start, end):
+    """Yield the doctor's (start, end) working datetimes between start and end, in order."""
+    windows = weekly_windows(schedules)
+    day = start.date()
+    while day <= end.date():
+        for window_start, window_end in windows.get(day.weekday(), ()):
+            window_start = max(datetime.combine(day, window_start), start)
+            window_end = min(datetime.combine(day, window_end), end)
+            if window_start < window_end:
+                yield window_start, window_end
+        day += timedelta(days=1)
+
+def free_intervals(windows, booked):
+    """Subtract the booked intervals (sorted by start) from the windows in a single merge pass.
+
+    Yields (window_start, free_start, free_end) so slots can stay aligned to the window start.
+    """
+    i = 0
+    for window_start, window_end in windows:
+        while i < len(booked) and booked[i][1] <= window_start:
+            i += 1
+        cursor = window_start
+        j = i
+        while j < len(booked) and booked[j][0] < window_end:
+            booked_start, booked_end = booked[j]
+            if booked_start > cursor:
+                yield window_start, cursor, booked_start
+            cursor = max(cursor, booked_end)
+            j += 1
+        if cursor < window_end:
+            yield window_start, cursor, window_end
+
+def slots(intervals, duration, step=None):
+    step = step or duration
+    # Rows stored before durations were validated
+    if duration <= timedelta(0) or step <= timedelta(0):
+        return
+    for anchor, free_start, free_end in intervals:
+        offset = free_start - anchor
+        slot_start = anchor + -(-offset // step) * step
+        while slot_start + duration <= free_end:
+            yield slot_start, slot_start + duration
+            slot_start += step
+
+def find_free_slots(schedules, booked, start, end, duration, step=None):
+    """All free slots of `duration` between start and end given Schedule rows and booked (start, end) pairs."""
+    booked = sorted(booked)
+    return list(slots(free_intervals(working_windows(schedules, start, end), booked), duration, step))
+
+def doctor_slots(schedules, booked_between, start, end, duration, chunk=timedelta(days=7)):
+    """Lazily yield a doctor's free slots from start to end, one chunk of days at a time.
+
+    booked_between(chunk_start, chunk_end) returns the booked (start, end) pairs of a chunk,
+    so bookings are only fetched for the days actually reached.
+    """
+    if not schedules:
+        return
+    # Whole days, so slots stay aligned to the window start; slots before `start` are skipped
+    chunk_start = datetime.combine(start.date(), time.min)
+    while chunk_start < end:
+        chunk_end = min(chunk_start + chunk, end)
+        booked = sorted(booked_between(chunk_start, chunk_end))
+        for slot in slots(free_intervals(working_windows(schedules, chunk_start, chunk_end), booked), duration):
+            if slot[0] >= start:
+                yield slot
+        chunk_start = chunk_end
+
+def earliest_slots(candidates, limit):
+    """K earliest slots across doctors: a heap merge over each candidate's lazy slot generator.
+
+    candidates is a list of (key, slot generator); yields (start, end, key) in start order.
+    Generators are only advanced as far as needed to produce `limit` results.
+    """
+    streams = [_tagged(key, generator) for key, generator in candidates]
+    return list(islice(heapq.merge(*streams, key=lambda slot: (slot[0], slot[2])), limit))
+
+def _tagged(key, generator):
+    for start, end in generator:
+        yield start, end, key
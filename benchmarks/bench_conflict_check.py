@@ -0,0 +1,86 @@
+"""Conflict-check latency for one busy doctor at growing appointment counts.
+
+Compares the in-process BookingIndex with the SQL range query against an
+in-memory SQLite table, with and without the composite (doctor_id, start_time,
+end_time) index.
+
+    python -m benchmarks.bench_conflict_check --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import crud
+from booking_index import DoctorIntervalIndex, to_key
+from database import models
+
+SLOT = timedelta(minutes=30)
+BASE = datetime(2020, 1, 1, 8)
+
+def appointment_rows(n, doctor_id=1):
+    # Back-to-back 30 minute appointments with a free slot every third one
+    for i in range(n):
+        start = BASE + (i + i // 2) * SLOT
+        yield {"id": i + 1, "doctor_id": doctor_id, "start_time": start, "end_time": start + SLOT}
+
+def probes(n, count):
+    span = (n + n // 2) * SLOT
+    rng = random.Random(n)
+    for _ in range(count):
+        start = BASE + timedelta(minutes=rng.randrange(int(span.total_seconds() // 60)))
+        yield start, start + SLOT
+
+def time_calls(fn, cases):
+    started = time.perf_counter()
+    for start, end in cases:
+        fn(start, end)
+    return (time.perf_counter() - started) / len(cases) * 1e6
+
+def bench_index(n, cases):
+    doctor_index = DoctorIntervalIndex()
+    for row in appointment_rows(n):
+        doctor_index.append(row["id"], to_key(row["start_time"]), to_key(row["end_time"]))
+    return time_calls(lambda s, e: doctor_index.has_conflict(to_key(s), to_key(e)), cases)
+
+def bench_sql(n, cases, composite_index):
+    engine = create_engine("sqlite://")
+    if not composite_index:
+        models.Appointment.__table__.indexes.clear()
+    models.Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    rows = list(appointment_rows(n))
+    for i in range(0, n, 50000):
+        session.execute(insert(models.Appointment), rows[i:i + 50000])
+    session.commit()
+    try:
+        return time_calls(lambda s, e: crud.get_appointments_for_doctor(session, 1, s, e), cases)
+    finally:
+        session.close()
+        engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--probes", type=int, default=2000)
+    parser.add_argument("--skip-sql", action="store_true")
+    args = parser.parse_args()
+
+    indexes = set(models.Appointment.__table__.indexes)
+    print(f"{'appointments':>12} {'index us':>10} {'sql+composite us':>17} {'sql no index us':>16}")
+    for n in args.sizes:
+        cases = list(probes(n, args.probes))
+        index_us = bench_index(n, cases)
+        if args.skip_sql:
+            print(f"{n:>12} {index_us:>10.2f}")
+            continue
+        composite_us = bench_sql(n, cases[:200], composite_index=True)
+        plain_us = bench_sql(n, cases[:20], composite_index=False)
+        models.Appointment.__table__.indexes.update(indexes)
+        print(f"{n:>12} {index_us:>10.2f} {composite_us:>17.2f} {plain_us:>16.2f}")
+
+if __name__ == "__main__":
+    main()
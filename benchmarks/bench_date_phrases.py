@@ -0,0 +1,76 @@
+"""Throughput of the Spanish date phrase parser over a corpus of booking utterances.
+
+Builds utterances from day, time and filler templates, then times date_phrases.windows
+cold (every phrase new to the memo), warm (utterances repeating with a skewed distribution,
+as callers say the same few things) and for resolution alone.
+
+    python -m benchmarks.bench_date_phrases --phrases 20000 --calls 200000
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+
+import date_phrases
+
+DAYS = [
+    "", "hoy", "mañana", "pasado mañana", "el lunes", "el martes", "el miércoles", "el jueves", "el viernes",
+    "el sábado", "el próximo jueves", "el lunes que viene", "la próxima semana", "el fin de semana",
+    "el 15", "el día 3", "el 20 de noviembre", "el 2 de enero", "15/12", "el jueves o el viernes",
+]
+TIMES = [
+    "", "en la mañana", "en la tarde", "por la noche", "temprano", "a las 10", "a las 10:30", "a las 4",
+    "a las 5 de la tarde", "a la una y media", "4pm", "después de las 6", "antes de las 11",
+    "entre las 9 y las 11", "de 12 a 2", "a las 8 o a las 9",
+]
+OPENERS = ["", "¿puedo", "quisiera una cita", "me queda mejor", "¿tiene espacio", "necesito ver al doctor",
+           "buenas tardes, ¿habrá lugar", "para mi mamá"]
+
+def corpus(count, rng):
+    phrases = set()
+    while len(phrases) < count:
+        words = [rng.choice(OPENERS), rng.choice(DAYS), rng.choice(TIMES), "por favor" * (rng.random() < 0.2)]
+        phrase = " ".join(word for word in words if word).strip()
+        if phrase:
+            phrases.add(phrase + ("?" if phrase.startswith("¿") else ""))
+    return sorted(phrases)
+
+def rate(fn, items):
+    started = time.perf_counter()
+    for item in items:
+        fn(item)
+    elapsed = time.perf_counter() - started
+    return len(items) / elapsed, elapsed / len(items) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--phrases", type=int, default=20000)
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    now = datetime(2026, 10, 14, 9, 15)
+
+    phrases = corpus(args.phrases, rng)
+    # Zipf-like: a few phrasings account for most utterances
+    weights = [1 / (rank + 1) for rank in range(len(phrases))]
+    calls = rng.choices(phrases, weights, k=args.calls)
+    recognized = sum(bool(date_phrases.windows(phrase, now)) for phrase in phrases)
+    print(f"{len(phrases)} distinct phrases, {recognized} with windows")
+
+    print(f"{'run':<12} {'phrases/s':>12} {'us/phrase':>10}")
+    date_phrases.parse.cache_clear()
+    for name, fn, items in (
+        ("cold", lambda q: date_phrases.windows(q, now), phrases),
+        ("warm", lambda q: date_phrases.windows(q, now), calls),
+    ):
+        per_second, micros = rate(fn, items)
+        print(f"{name:<12} {per_second:>12.0f} {micros:>10.2f}")
+    parsed = [date_phrases.parse(date_phrases.normalize(q)) for q in calls]
+    per_second, micros = rate(lambda parts: date_phrases.resolve(parts, now), parsed)
+    print(f"{'resolve':<12} {per_second:>12.0f} {micros:>10.2f}")
+    info = date_phrases.parse.cache_info()
+    print(f"memo hits {info.hits}, misses {info.misses}, size {info.currsize}/{info.maxsize}")
+
+if __name__ == "__main__":
+    main()
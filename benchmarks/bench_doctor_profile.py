@@ -0,0 +1,106 @@
+"""Queries per request and latency of GET /doctors/{id}: lazy loading vs eager loading vs cache.
+
+    python -m benchmarks.bench_doctor_profile --doctors 50 --requests 2000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import time as clock
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import cache
+import crud
+from main import app, get_db
+from database import models
+
+def seed(SessionLocal, doctors):
+    db = SessionLocal()
+    for d in range(doctors):
+        doctor = models.Doctor(
+            full_name=f"Dr. {d}", title="MD", email=f"dr{d}@example.com", phone="1", whatsapp_number="1",
+            user=models.User(username=f"dr{d}", hashed_password="x")
+        )
+        doctor.offices = [models.Office(name=f"Office {i}", address=f"Street {i}") for i in range(3)]
+        doctor.schedule = [
+            models.Schedule(day_of_week=day, start_time=clock(9), end_time=clock(14))
+            for day in list(models.DayOfWeek)[:5]
+        ] + [
+            models.Schedule(day_of_week=day, start_time=clock(16), end_time=clock(19))
+            for day in list(models.DayOfWeek)[:5]
+        ]
+        doctor.appointment_types = [models.AppointmentType(name=f"Type {i}", duration_minutes=30) for i in range(7)]
+        db.add(doctor)
+    db.commit()
+    db.close()
+
+def lazy_get_doctor(db, doctor_id):
+    return db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
+
+def run(client, doctors, requests, counter):
+    rng = random.Random(0)
+    latencies = []
+    counter["queries"] = 0
+    for _ in range(requests):
+        doctor_id = rng.randint(1, doctors)
+        started = time.perf_counter()
+        response = client.get(f"/doctors/{doctor_id}")
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200
+    latencies.sort()
+    return {
+        "queries_per_request": counter["queries"] / requests,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--doctors", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "profile.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    seed(SessionLocal, args.doctors)
+
+    counter = {"queries": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(*_):
+        counter["queries"] += 1
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+    eager_get_doctor = crud.get_doctor
+    ttl = cache.doctor_profiles.ttl
+
+    results = {}
+    cache.doctor_profiles.ttl = 0
+    crud.get_doctor = lazy_get_doctor
+    results["lazy, no cache"] = run(client, args.doctors, args.requests, counter)
+    crud.get_doctor = eager_get_doctor
+    results["eager, no cache"] = run(client, args.doctors, args.requests, counter)
+    cache.doctor_profiles.ttl = ttl
+    cache.doctor_profiles.clear()
+    results["eager + cache"] = run(client, args.doctors, args.requests, counter)
+
+    print(f"{'mode':<16} {'queries/req':>12} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, result in results.items():
+        print(f"{mode:<16} {result['queries_per_request']:>12.2f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
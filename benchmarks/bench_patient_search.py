@@ -0,0 +1,102 @@
+"""Patient search latency (p50/p99) by query kind at a given number of patients.
+
+Seeds a temporary SQLite database with synthetic Spanish names and phone numbers, then
+times patient_search.search for phone, email, exact, partial, surname-first and misspelled
+name lookups.
+
+    python -m benchmarks.bench_patient_search --patients 1000000 --queries 500
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+import patient_search
+from database import models
+from database.bootstrap import init_schema
+from database.database import sqlite_engine
+
+FIRST_NAMES = [
+    "José", "María", "Juan", "Guadalupe", "Francisco", "Juana", "Antonio", "Margarita", "Jesús", "Verónica",
+    "Alejandro", "Leticia", "Miguel", "Rosa", "Pedro", "Elizabeth", "Roberto", "Patricia", "Ricardo", "Gabriela",
+    "Fernando", "Alejandra", "Daniel", "Adriana", "Carlos", "Mónica", "Jorge", "Sofía", "Raúl", "Ramón",
+]
+SURNAMES = [
+    "Hernández", "García", "Martínez", "López", "González", "Pérez", "Rodríguez", "Sánchez", "Ramírez", "Cruz",
+    "Flores", "Gómez", "Morales", "Vázquez", "Reyes", "Jiménez", "Torres", "Díaz", "Gutiérrez", "Ruiz",
+    "Mendoza", "Aguilar", "Ortiz", "Moreno", "Castillo", "Romero", "Álvarez", "Méndez", "Chávez", "Rivera",
+    "Juárez", "Ramos", "Domínguez", "Herrera", "Medina", "Castro", "Vargas", "Guzmán", "Velázquez", "Muñoz",
+]
+
+def patient(i, rng):
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)} {rng.choice(SURNAMES)}"
+    return {"full_name": name, "email": f"patient{i}@example.com", "phone": f"+52 55 {10000000 + i:08d}"}
+
+def seed(SessionLocal, count, rng, batch_size=20000):
+    db = SessionLocal()
+    for offset in range(0, count, batch_size):
+        inserted = db.execute(insert(models.Patient).returning(models.Patient.id, models.Patient.name_normalized), [
+            patient(i, rng) for i in range(offset, min(offset + batch_size, count))
+        ])
+        patient_search.index_names(db, inserted.all())
+        db.commit()
+    db.close()
+
+def typo(value, rng):
+    i = rng.randrange(1, len(value) - 1)
+    return value[:i] + value[i + 1] + value[i] + value[i + 2:]
+
+def queries(kind, count, total, rng):
+    for _ in range(count):
+        i = rng.randrange(total)
+        if kind == "phone":
+            yield f"55{10000000 + i:08d}"
+        elif kind == "email":
+            yield f"patient{i}@example.com"
+        elif kind == "exact name":
+            yield f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)} {rng.choice(SURNAMES)}"
+        elif kind == "partial name":
+            yield f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}".lower()
+        elif kind == "surname first":
+            yield f"{rng.choice(SURNAMES)} {rng.choice(SURNAMES)} {rng.choice(FIRST_NAMES)}"
+        else:
+            yield typo(f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)} {rng.choice(SURNAMES)}", rng)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    engine = sqlite_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'patients.db')}")
+    init_schema(engine)
+    SessionLocal = sessionmaker(bind=engine)
+    started = time.perf_counter()
+    seed(SessionLocal, args.patients, rng)
+    print(f"seeded {args.patients} patients in {time.perf_counter() - started:.1f}s")
+
+    db = SessionLocal()
+    patient_search.vocabulary.load(db)
+    print(f"{'query':<14} {'p50 ms':>8} {'p99 ms':>8} {'hits':>6}")
+    for kind in ("phone", "email", "exact name", "partial name", "surname first", "misspelled"):
+        timings, hits = [], 0
+        for query in queries(kind, args.queries, args.patients, rng):
+            started = time.perf_counter()
+            hits += bool(patient_search.search(db, query))
+            timings.append((time.perf_counter() - started) * 1000)
+            db.expunge_all()
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        print(f"{kind:<14} {statistics.median(timings):>8.2f} {p99:>8.2f} {hits:>6}")
+    db.close()
+    engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Weekly report generation: vectorized columns against a row-by-row ORM loop, and the batch job.
+
+Seeds a temporary SQLite database with doctors that each have months of appointments
+(random outcomes and booking times), then times one doctor-week report built from ORM
+objects in Python loops and with reports.generate, and finally the batch job
+(python -m reports) over every doctor with 1 and with --workers processes.
+
+    python -m benchmarks.bench_reports --doctors 40 --weeks 26 --per-day 24 --workers 4
+"""
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATUSES = ("ATTENDED",) * 8 + ("NO_SHOW",) + (None,)
+
+def seed(url, args, rng):
+    from sqlalchemy import create_engine, insert
+    from database import models
+    from database.bootstrap import init_schema
+    engine = create_engine(url)
+    init_schema(engine)
+    first = datetime.combine(date.today() - timedelta(weeks=args.weeks, days=date.today().weekday()), datetime.min.time())
+    with engine.begin() as connection:
+        connection.execute(insert(models.Doctor), [
+            {"id": d, "full_name": f"Dr. {d}", "email": f"d{d}@example.com"} for d in range(1, args.doctors + 1)
+        ])
+        connection.execute(insert(models.Schedule), [
+            {"doctor_id": d, "day_of_week": models.DayOfWeek[day], "start_time": datetime.min.time().replace(hour=8),
+             "end_time": datetime.min.time().replace(hour=20)}
+            for d in range(1, args.doctors + 1) for day in ("MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY")
+        ])
+        for d in range(1, args.doctors + 1):
+            rows = []
+            for day in range(args.weeks * 7):
+                if day % 7 >= 5:
+                    continue
+                for slot in range(args.per_day):
+                    start = first + timedelta(days=day, hours=8, minutes=30 * slot)
+                    rows.append({
+                        "doctor_id": d, "patient_id": rng.randrange(1, args.patients), "office_id": 1 + slot % 2,
+                        "appointment_type_id": 1 + slot % 3, "start_time": start, "end_time": start + timedelta(minutes=30),
+                        "status": STATUSES[rng.randrange(len(STATUSES))],
+                        "created_at": start - timedelta(hours=rng.expovariate(1 / 120)),
+                    })
+            connection.execute(insert(models.Appointment), rows)
+    engine.dispose()
+
+def orm_report(db, doctor_id, week_start, lookback_days):
+    """The same figures as reports.generate, from ORM objects in Python loops."""
+    from database import models
+    end = datetime.combine(week_start, datetime.min.time()) + timedelta(days=7)
+    start = datetime.combine(week_start, datetime.min.time())
+    appointments = db.query(models.Appointment).filter(
+        models.Appointment.doctor_id == doctor_id,
+        models.Appointment.start_time >= end - timedelta(days=lookback_days),
+        models.Appointment.start_time < end
+    ).all()
+    offices, types, leads = defaultdict(int), defaultdict(int), []
+    totals, misses = defaultdict(int), defaultdict(int)
+    for a in appointments:
+        if a.start_time >= start:
+            minutes = (a.end_time - a.start_time).total_seconds() / 60
+            offices[a.office_id] += minutes
+            types[a.appointment_type_id] += minutes
+            if a.created_at:
+                leads.append(max((a.start_time - a.created_at).total_seconds() / 3600, 0))
+        if a.status in (models.AppointmentStatus.ATTENDED, models.AppointmentStatus.NO_SHOW):
+            totals[a.patient_id] += 1
+            misses[a.patient_id] += a.status == models.AppointmentStatus.NO_SHOW
+    flagged = sorted((misses[p] / totals[p], p) for p in totals if totals[p] >= 3)
+    return offices, types, statistics.median(leads) if leads else None, flagged[-20:]
+
+def timed(fn, runs):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--doctors", type=int, default=40)
+    parser.add_argument("--weeks", type=int, default=26)
+    parser.add_argument("--per-day", type=int, default=24)
+    parser.add_argument("--patients", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'reports.db')}"
+    os.environ["DATABASE_URL"] = url
+    seed(url, args, random.Random(args.seed))
+    from sqlalchemy.orm import sessionmaker
+    from database.database import make_engine
+    import reports
+    from config import REPORT_NO_SHOW_LOOKBACK_DAYS
+
+    SessionLocal = sessionmaker(bind=make_engine(url))
+    week_start = reports.week_of(date.today() - timedelta(weeks=1))
+    db = SessionLocal()
+    print(f"{args.doctors} doctors, {args.weeks * 5 * args.per_day} appointments each")
+    print(f"{'one doctor-week':<22} {'ms':>8}")
+    orm_ms = timed(lambda: (orm_report(db, 1, week_start, REPORT_NO_SHOW_LOOKBACK_DAYS), db.expunge_all()), args.runs)
+    print(f"{'orm rows':<22} {orm_ms:>8.1f}")
+    vector_ms = timed(lambda: reports.generate(db, 1, week_start), args.runs)
+    print(f"{'vectorized':<22} {vector_ms:>8.1f}   {orm_ms / vector_ms:.1f}x")
+    reports.weekly(db, 1, week_start)
+    print(f"{'cached':<22} {timed(lambda: reports.weekly(db, 1, week_start), args.runs):>8.3f}")
+    db.close()
+
+    env = dict(os.environ, DATABASE_URL=url)
+    for workers in sorted({1, args.workers}):
+        with SessionLocal.begin() as session:
+            session.execute(reports.models.WeeklyReport.__table__.delete())
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, "-m", "reports", "--weeks", "4", "--workers", str(workers)],
+                                env=env, cwd=ROOT, capture_output=True, text=True, check=True)
+        print(f"batch job, {workers} worker(s): {time.perf_counter() - started:.1f}s  ({output.stdout.strip()})")
+
+if __name__ == "__main__":
+    main()
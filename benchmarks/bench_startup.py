@@ -0,0 +1,118 @@
+"""Startup time: `import main` and time until a fresh uvicorn replica serves and is ready.
+
+Seeds a temporary SQLite database with appointments and patients (so the startup warmup
+has real work), runs the migration step once, then starts uvicorn in the default mode and
+with FAST_START, timing the first 200 from /readyz (the first request served) and the
+first one reporting the warmup done.
+
+    python -m benchmarks.bench_startup --appointments 500000 --runs 5
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+IMPORT_MAIN = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def seed(url, appointments, patients, batch_size=50000):
+    from sqlalchemy import create_engine, insert
+    from database import models
+    from database.bootstrap import init_schema
+    engine = create_engine(url)
+    init_schema(engine)
+    # All in the past, so no reminders come due while the servers run
+    base = datetime.now() - timedelta(minutes=30 * appointments, days=1)
+    with engine.begin() as connection:
+        connection.execute(insert(models.Doctor), [{"id": 1, "full_name": "Benchmark", "email": "bench@example.com"}])
+        for offset in range(0, appointments, batch_size):
+            connection.execute(insert(models.Appointment), [
+                {"doctor_id": 1, "start_time": base + timedelta(minutes=30 * i),
+                 "end_time": base + timedelta(minutes=30 * i + 30)}
+                for i in range(offset, min(offset + batch_size, appointments))
+            ])
+        inserted = connection.execute(insert(models.Patient).returning(models.Patient.id, models.Patient.name_normalized), [
+            {"full_name": f"Paciente {i} García", "email": f"p{i}@example.com", "phone": f"55{i:08d}"}
+            for i in range(patients)
+        ])
+        connection.exec_driver_sql("INSERT INTO patients_fts(rowid, name_normalized) VALUES (?, ?)", [tuple(row) for row in inserted])
+    engine.dispose()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def readiness(port):
+    """(status, body) of /readyz, or None while the server is not accepting connections."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+    try:
+        connection.request("GET", "/readyz")
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    except OSError:
+        return None
+    finally:
+        connection.close()
+
+def import_time(env):
+    output = subprocess.run([sys.executable, "-c", IMPORT_MAIN], env=env, cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1]) * 1000
+
+def serve_times(env, timeout=120):
+    """(ms until /readyz answers 200, ms until it reports the warmup done) from spawning uvicorn."""
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, cwd=ROOT
+    )
+    ready = warm = None
+    try:
+        while warm is None and time.perf_counter() - started < timeout:
+            response = readiness(port)
+            if response and response[0] == 200:
+                elapsed = (time.perf_counter() - started) * 1000
+                ready = ready or elapsed
+                if response[1]["warm"]:
+                    warm = elapsed
+            time.sleep(0.005)
+    finally:
+        server.terminate()
+        server.wait()
+    return ready, warm
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--appointments", type=int, default=500000)
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}"
+    started = time.perf_counter()
+    seed(url, args.appointments, args.patients)
+    print(f"seeded {args.appointments} appointments, {args.patients} patients in {time.perf_counter() - started:.1f}s")
+    env = dict(os.environ, DATABASE_URL=url, ADMIN_USERNAME=os.environ.get("ADMIN_USERNAME", "admin"),
+               ADMIN_PASSWORD=os.environ.get("ADMIN_PASSWORD", "admin"), OUTBOX_ENABLED="false")
+    # The migration step, run once per deploy rather than by every replica
+    subprocess.run([sys.executable, "-m", "database.bootstrap"], env=env, cwd=ROOT, check=True, capture_output=True)
+
+    print(f"{'mode':<10} {'import ms':>10} {'ready ms':>10} {'warm ms':>10}")
+    for mode, extra in (("default", {"FAST_START": "false"}), ("fast", {"FAST_START": "true"})):
+        mode_env = dict(env, **extra)
+        imports = [import_time(mode_env) for _ in range(args.runs)]
+        served = [serve_times(mode_env) for _ in range(args.runs)]
+        print(f"{mode:<10} {statistics.median(imports):>10.0f} "
+              f"{statistics.median(ready for ready, _ in served):>10.0f} "
+              f"{statistics.median(warm for _, warm in served):>10.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Booking write throughput with the same writers spread over 1..N clinic databases.
+
+Every writer is its own process booking for its own doctor, as uvicorn workers would. With
+one clinic they all take turns on one SQLite write lock; with one database per clinic
+(tenancy.py) writers of different clinics commit side by side.
+
+    python -m benchmarks.bench_tenants --writers 8 --writes 4000 --tenants 1,2,4,8
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BASE = datetime(2030, 1, 7, 9)
+
+def registry(names, template):
+    import tenancy
+    return tenancy.TenantRegistry(names, template, len(names), 3600)
+
+def write(args):
+    """Books `count` back-to-back appointments for one doctor in one clinic; returns how many committed."""
+    names, template, name, doctor_id, count, start = args
+    import crud
+    import schemas
+    import tenancy
+    tenants = registry(names, template)
+    tenancy.current.set(tenants.get(name))
+    start.wait()
+    booked = 0
+    for i in range(count):
+        db = tenancy.session()
+        try:
+            booked += crud.create_appointment(db, schemas.AppointmentCreate(
+                doctor_id=doctor_id, patient_id=1, office_id=1, appointment_type_id=1,
+                start_time=BASE + timedelta(minutes=30 * i), end_time=BASE + timedelta(minutes=30 * (i + 1))
+            )) is not None
+        finally:
+            db.close()
+    tenants.close_all()
+    return booked
+
+def run(tenant_count, args):
+    names = [f"clinic{i}" for i in range(tenant_count)]
+    template = os.path.join(f"sqlite:///{tempfile.mkdtemp()}", "{tenant}.db")
+    # Schemas created up front, so the timed part is only bookings
+    tenants = registry(names, template)
+    for name in names:
+        tenants.get(name)
+    tenants.close_all()
+
+    with multiprocessing.Manager() as manager:
+        start = manager.Event()
+        jobs = [(names, template, names[w % tenant_count], w + 1, args.writes // args.writers, start)
+                for w in range(args.writers)]
+        with multiprocessing.Pool(args.writers) as pool:
+            result = pool.map_async(write, jobs)
+            # Let every worker import and open its engine before the clock starts
+            time.sleep(args.warmup)
+            started = time.perf_counter()
+            start.set()
+            booked = sum(result.get())
+            elapsed = time.perf_counter() - started
+    return booked, booked / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=4000, help="total bookings, split over the writers")
+    parser.add_argument("--tenants", default="1,2,4,8")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds for the workers to start")
+    args = parser.parse_args()
+    os.environ.setdefault("OUTBOX_ENABLED", "false")
+
+    print(f"{'clinics':>7} {'booked':>7} {'writes/s':>9} {'speedup':>8}")
+    baseline = None
+    for tenant_count in map(int, args.tenants.split(",")):
+        booked, per_second = run(tenant_count, args)
+        baseline = baseline or per_second
+        print(f"{tenant_count:>7} {booked:>7} {per_second:>9.0f} {per_second / baseline:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
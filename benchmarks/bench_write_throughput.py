@@ -0,0 +1,96 @@
+"""Booking write throughput per database profile, with concurrent readers.
+
+    python -m benchmarks.bench_write_throughput --writes 3000 --writers 8 --readers 4
+    python -m benchmarks.bench_write_throughput --postgresql-url postgresql://user:pw@localhost/bettyia_bench
+
+The PostgreSQL URL must point at a scratch database: its tables are dropped and recreated.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import schemas
+from database import models
+from database.bootstrap import init_schema
+from database.database import sqlite_engine, postgresql_engine
+
+BASE = datetime(2030, 1, 7, 9)
+
+def profiles(args):
+    directory = tempfile.mkdtemp()
+    yield "sqlite, rollback journal", sqlite_engine(f"sqlite:///{os.path.join(directory, 'journal.db')}", pragmas={})
+    yield "sqlite, WAL + NORMAL", sqlite_engine(f"sqlite:///{os.path.join(directory, 'wal.db')}")
+    if args.postgresql_url:
+        engine = postgresql_engine(args.postgresql_url)
+        models.Base.metadata.drop_all(bind=engine)
+        yield "postgresql, pooled", engine
+
+def run(engine, args):
+    init_schema(engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    # One doctor per writer and back-to-back slots, so every write commits
+    requests = [
+        schemas.AppointmentCreate(
+            doctor_id=i % args.writers + 1, patient_id=1, office_id=1, appointment_type_id=1,
+            start_time=BASE + timedelta(minutes=30 * (i // args.writers)),
+            end_time=BASE + timedelta(minutes=30 * (i // args.writers + 1))
+        )
+        for i in range(args.writes)
+    ]
+    stop = threading.Event()
+    reads = []
+
+    def book(appointment):
+        db = SessionLocal()
+        try:
+            return crud.create_appointment(db, appointment) is not None
+        finally:
+            db.close()
+
+    def read(doctor_id):
+        count = 0
+        db = SessionLocal()
+        try:
+            while not stop.is_set():
+                crud.get_appointments_for_doctor(db, doctor_id, BASE, BASE + timedelta(days=7))
+                db.rollback()
+                count += 1
+        finally:
+            db.close()
+        reads.append(count)
+
+    readers = [threading.Thread(target=read, args=(i % args.writers + 1,)) for i in range(args.readers)]
+    for reader in readers:
+        reader.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.writers) as pool:
+        booked = sum(pool.map(book, requests))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for reader in readers:
+        reader.join()
+    engine.dispose()
+    return {"booked": booked, "writes_per_s": booked / elapsed, "reads_per_s": sum(reads) / elapsed}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writes", type=int, default=3000)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--postgresql-url", help="scratch PostgreSQL database to include")
+    args = parser.parse_args()
+
+    print(f"{'profile':<26} {'booked':>7} {'writes/s':>9} {'reads/s':>9}")
+    for name, engine in profiles(args):
+        result = run(engine, args)
+        print(f"{name:<26} {result['booked']:>7} {result['writes_per_s']:>9.0f} {result['reads_per_s']:>9.0f}")
+
+if __name__ == "__main__":
+    main()
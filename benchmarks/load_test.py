@@ -0,0 +1,284 @@
+"""Load test for the booking API against a seeded synthetic clinic, with JSON results.
+
+Seeds N doctors (offices, weekly schedules, appointment types), M patients and K past
+appointments into a fresh SQLite file, then drives each scenario at the given concurrency,
+in-process (TestClient, queries per request counted on the engine) and/or over uvicorn.
+
+    python -m benchmarks.load_test --doctors 50 --patients 20000 --appointments 200000 \\
+        --requests 2000 --concurrency 16 --mode both --output results.json
+
+Background workers (outbox, reminders) are disabled unless --background is given, so the
+query count only covers the requests themselves.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as clock, timedelta
+
+import httpx
+
+SCENARIOS = ("create_appointment", "read_doctor", "availability", "create_user")
+TYPE_DURATIONS = (30, 45, 60)
+# Weekday shifts, the same for every synthetic doctor
+SHIFTS = ((clock(9), clock(14)), (clock(16), clock(19)))
+WEEKDAYS = ("MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY")
+
+def seed(url, args):
+    from sqlalchemy import insert
+    from database import models
+    from database.bootstrap import init_schema
+    from database.database import make_engine
+
+    engine = make_engine(url)
+    init_schema(engine)
+    rng = random.Random(args.seed)
+    doctors = range(1, args.doctors + 1)
+    with engine.begin() as connection:
+        connection.execute(insert(models.User), [
+            {"id": d, "username": f"doctor{d}", "hashed_password": "x"} for d in doctors
+        ])
+        connection.execute(insert(models.Doctor), [
+            {"id": d, "full_name": f"Dr. {d}", "title": "MD", "email": f"doctor{d}@example.com",
+             "phone": "5550000000", "whatsapp_number": "5550000000", "user_id": d}
+            for d in doctors
+        ])
+        connection.execute(insert(models.Office), [
+            {"id": d, "name": f"Consultorio {d}", "address": f"Calle {d}", "doctor_id": d} for d in doctors
+        ])
+        connection.execute(insert(models.Schedule), [
+            {"day_of_week": models.DayOfWeek[day], "start_time": start, "end_time": end, "doctor_id": d}
+            for d in doctors for day in WEEKDAYS for start, end in SHIFTS
+        ])
+        connection.execute(insert(models.AppointmentType), [
+            {"id": type_id(d, i), "name": f"Consulta {minutes} min", "duration_minutes": minutes, "doctor_id": d}
+            for d in doctors for i, minutes in enumerate(TYPE_DURATIONS)
+        ])
+        for first in range(0, args.patients, 10000):
+            connection.execute(insert(models.Patient), [
+                {"id": p, "full_name": f"Paciente {p}", "email": f"paciente{p}@example.com", "phone": f"55{p:08d}"}
+                for p in range(first + 1, min(first + 10000, args.patients) + 1)
+            ])
+        batch = []
+        for row in history(args, rng):
+            batch.append(row)
+            if len(batch) == 10000:
+                connection.execute(insert(models.Appointment), batch)
+                batch = []
+        if batch:
+            connection.execute(insert(models.Appointment), batch)
+    engine.dispose()
+
+def type_id(doctor_id, index=0):
+    return (doctor_id - 1) * len(TYPE_DURATIONS) + index + 1
+
+def history(args, rng):
+    # Back-to-back 30 minute appointments on past weekdays, spread evenly over the doctors
+    per_doctor = -(-args.appointments // args.doctors)
+    slots_per_day = sum((end.hour - start.hour) * 2 for start, end in SHIFTS)
+    today = datetime.combine(datetime.now().date(), clock.min)
+    count = 0
+    for d in range(1, args.doctors + 1):
+        day = today
+        for i in range(per_doctor):
+            if count == args.appointments:
+                return
+            if i % slots_per_day == 0:
+                day -= timedelta(days=1)
+                while day.weekday() > 4:
+                    day -= timedelta(days=1)
+            start = nth_slot(day, i % slots_per_day)
+            count += 1
+            yield {
+                "doctor_id": d, "patient_id": rng.randint(1, args.patients), "office_id": d,
+                "appointment_type_id": type_id(d), "start_time": start, "end_time": start + timedelta(minutes=30)
+            }
+
+def nth_slot(day, n):
+    for start, end in SHIFTS:
+        slots = (end.hour - start.hour) * 2
+        if n < slots:
+            return datetime.combine(day.date(), start) + timedelta(minutes=30 * n)
+        n -= slots
+    raise ValueError(n)
+
+def requests_for(scenario, args, rng, run_id):
+    """(method, path, json) tuples for one scenario."""
+    today = datetime.combine(datetime.now().date(), clock.min)
+    for i in range(args.requests):
+        doctor_id = rng.randint(1, args.doctors)
+        if scenario == "create_appointment":
+            # Random future weekday slots, so some requests collide and get a 400
+            day = today + timedelta(days=rng.randint(1, args.horizon_days))
+            while day.weekday() > 4:
+                day += timedelta(days=1)
+            start = nth_slot(day, rng.randrange(16))
+            yield "POST", "/appointments/", {
+                "doctor_id": doctor_id, "patient_id": rng.randint(1, args.patients), "office_id": doctor_id,
+                "appointment_type_id": type_id(doctor_id), "start_time": start.isoformat(),
+                "end_time": (start + timedelta(minutes=30)).isoformat()
+            }
+        elif scenario == "read_doctor":
+            yield "GET", f"/doctors/{doctor_id}", None
+        elif scenario == "availability":
+            start = today + timedelta(days=rng.randint(0, 30))
+            yield "GET", (
+                f"/doctors/{doctor_id}/availability?start_date={start.date()}"
+                f"&end_date={(start + timedelta(days=6)).date()}&office_id={doctor_id}"
+                f"&appointment_type_id={type_id(doctor_id, rng.randrange(len(TYPE_DURATIONS)))}"
+            ), None
+        elif scenario == "create_user":
+            yield "POST", "/users/", {"username": f"load-{run_id}-{i}", "password": "password"}
+
+def percentile(values, p):
+    return round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 3) if values else None
+
+def drive(send, scenario, args, run_id, query_counter=None):
+    calls = list(requests_for(scenario, args, random.Random(f"{args.seed}-{scenario}"), run_id))
+    statuses = {}
+    lock = threading.Lock()
+
+    def call(request):
+        method, path, body = request
+        started = time.perf_counter()
+        status = send(method, path, body)
+        elapsed = time.perf_counter() - started
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+        return elapsed
+
+    queries_before = query_counter["queries"] if query_counter else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = sorted(pool.map(call, calls))
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": scenario, "requests": len(calls), "concurrency": args.concurrency,
+        "throughput_rps": round(len(calls) / elapsed, 1),
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99), "max": percentile(latencies, 1),
+        },
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "queries_per_request": round((query_counter["queries"] - queries_before) / len(calls), 2)
+        if query_counter else None,
+    }
+
+def run_inprocess(args):
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from database import database
+    from main import app
+    from config import ADMIN_SECRET
+
+    counter = {"queries": 0}
+
+    @event.listens_for(database.engine, "before_cursor_execute")
+    def count(*_):
+        counter["queries"] += 1
+
+    def send(method, path, body):
+        return client.request(method, path, json=body).status_code
+
+    # The admin header is only needed by create_user, which provisions panel accounts
+    with TestClient(app, headers={"admin-secret": ADMIN_SECRET or ""}) as client:
+        results = [drive(send, scenario, args, "inprocess", counter) for scenario in args.scenarios]
+    database.engine.dispose()
+    return results
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def run_uvicorn(args, env):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                httpx.get(base_url + "/", timeout=1)
+                break
+            except httpx.TransportError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise SystemExit("uvicorn did not start")
+                time.sleep(0.2)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        headers = {"admin-secret": env.get("ADMIN_SECRET", "")}
+        with httpx.Client(base_url=base_url, limits=limits, timeout=60, headers=headers) as client:
+            def send(method, path, body):
+                return client.request(method, path, json=body).status_code
+
+            return [drive(send, scenario, args, "uvicorn") for scenario in args.scenarios]
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--doctors", type=int, default=20)
+    parser.add_argument("--patients", type=int, default=5000)
+    parser.add_argument("--appointments", type=int, default=50000, help="past appointments to seed")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn", "both"), default="inprocess")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--horizon-days", type=int, default=60, help="how far ahead bookings are spread")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--background", action="store_true", help="keep the outbox and reminder workers running")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    template = os.path.join(directory, "template.db")
+    path = os.path.join(directory, "load.db")
+    url = f"sqlite:///{path}"
+    # Read by config.py, so it has to be set before the app modules are imported
+    env = os.environ | {"DATABASE_URL": url}
+    if not args.background:
+        env |= {"OUTBOX_ENABLED": "false", "REMINDERS_ENABLED": "false"}
+    os.environ.update(env)
+
+    started = time.perf_counter()
+    seed(f"sqlite:///{template}", args)
+    seed_seconds = round(time.perf_counter() - started, 2)
+
+    results = []
+    for mode in (("inprocess", "uvicorn") if args.mode == "both" else (args.mode,)):
+        # Every mode starts from the same seeded data
+        shutil.copyfile(template, path)
+        mode_results = run_inprocess(args) if mode == "inprocess" else run_uvicorn(args, env)
+        results.extend({"mode": mode} | result for result in mode_results)
+
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "cpus": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "seed_seconds": seed_seconds,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
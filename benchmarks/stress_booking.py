@@ -0,0 +1,73 @@
+"""Fire thousands of parallel bookings at the same slots and check nothing overlaps.
+
+    python -m benchmarks.stress_booking --attempts 5000 --threads 32 --doctors 4
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import schemas
+from database import models
+
+BASE = datetime(2030, 1, 7, 9)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--attempts", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--doctors", type=int, default=4)
+    parser.add_argument("--slots", type=int, default=16, help="distinct contended start times per doctor")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "stress.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    requests = [
+        schemas.AppointmentCreate(
+            doctor_id=i % args.doctors + 1, patient_id=i, office_id=1, appointment_type_id=1,
+            start_time=BASE + timedelta(minutes=15 * (i % args.slots)),
+            end_time=BASE + timedelta(minutes=15 * (i % args.slots) + 30)
+        )
+        for i in range(args.attempts)
+    ]
+
+    def book(appointment):
+        db = SessionLocal()
+        try:
+            return crud.create_appointment(db, appointment) is not None
+        finally:
+            db.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        booked = sum(pool.map(book, requests))
+    elapsed = time.perf_counter() - started
+
+    db = SessionLocal()
+    rows = db.query(models.Appointment).order_by(
+        models.Appointment.doctor_id, models.Appointment.start_time
+    ).all()
+    db.close()
+    overlaps = sum(
+        1 for a, b in zip(rows, rows[1:]) if a.doctor_id == b.doctor_id and b.start_time < a.end_time
+    )
+
+    print(f"attempts:   {args.attempts} ({args.threads} threads, {args.doctors} doctors)")
+    print(f"booked:     {booked} (stored {len(rows)})")
+    print(f"overlaps:   {overlaps}")
+    print(f"throughput: {args.attempts / elapsed:.0f} attempts/s")
+    engine.dispose()
+    if overlaps or booked != len(rows):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
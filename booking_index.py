@@ -0,0 +1,124 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+import database.models as models
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+def to_key(value: datetime):
+    # Naive wall-clock microseconds, the same way the DateTime columns store them
+    return (value.replace(tzinfo=None) - EPOCH) // MICROSECOND
+
+def from_key(key: int):
+    return EPOCH + key * MICROSECOND
+
+class DoctorIntervalIndex:
+    """Sorted arrays of one doctor's appointments.
+
+    Rows are kept ordered by start; `max_ends[i]` is the largest end among rows 0..i, so the
+    first row that can reach past a given instant is found by bisection even if legacy rows overlap.
+    """
+
+    def __init__(self):
+        self.starts = array("q")
+        self.ends = array("q")
+        self.max_ends = array("q")
+        self.ids = array("q")
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, appointment_id, start, end):
+        # Rows must arrive ordered by start (bulk load)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.max_ends.append(max(end, self.max_ends[-1]) if self.max_ends else end)
+        self.ids.append(appointment_id)
+
+    def add(self, appointment_id, start, end):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.ids.insert(i, appointment_id)
+        self.max_ends.insert(i, max(end, self.max_ends[i - 1]) if i else end)
+        j = i + 1
+        while j < len(self.max_ends) and self.max_ends[j] < end:
+            self.max_ends[j] = end
+            j += 1
+
+    def _candidates(self, start, end):
+        return bisect_right(self.max_ends, start), bisect_left(self.starts, end)
+
+    def has_conflict(self, start, end):
+        lo, hi = self._candidates(start, end)
+        return any(self.ends[i] > start for i in range(lo, hi))
+
+    def overlapping(self, start, end):
+        lo, hi = self._candidates(start, end)
+        return [(self.starts[i], self.ends[i]) for i in range(lo, hi) if self.ends[i] > start]
+
+class BookingIndex:
+    """In-process per-doctor interval index, loaded at startup and updated on every appointment write."""
+
+    def __init__(self):
+        self._doctors = {}
+        self._lock = threading.Lock()
+        self.ready = False
+        # Intervals added while a load runs (FAST_START warms up while serving), replayed onto
+        # the loaded index in case its query did not see them
+        self._added = None
+
+    def load(self, db):
+        with self._lock:
+            self.ready = False
+            self._added = []
+        doctors = {}
+        rows = db.query(
+            models.Appointment.doctor_id, models.Appointment.id,
+            models.Appointment.start_time, models.Appointment.end_time
+        ).order_by(models.Appointment.doctor_id, models.Appointment.start_time).yield_per(10000)
+        for doctor_id, appointment_id, start_time, end_time in rows:
+            doctor_index = doctors.get(doctor_id)
+            if doctor_index is None:
+                doctor_index = doctors[doctor_id] = DoctorIntervalIndex()
+            doctor_index.append(appointment_id, to_key(start_time), to_key(end_time))
+        with self._lock:
+            for doctor_id, appointment_id, start, end in self._added:
+                doctor_index = doctors.setdefault(doctor_id, DoctorIntervalIndex())
+                if appointment_id not in doctor_index.ids:
+                    doctor_index.add(appointment_id, start, end)
+            self._doctors = doctors
+            self._added = None
+            self.ready = True
+
+    def add(self, appointment):
+        self.add_interval(appointment.doctor_id, appointment.id, appointment.start_time, appointment.end_time)
+
+    def add_interval(self, doctor_id, appointment_id, start_time, end_time):
+        start, end = to_key(start_time), to_key(end_time)
+        with self._lock:
+            if self._added is not None:
+                self._added.append((doctor_id, appointment_id, start, end))
+            doctor_index = self._doctors.setdefault(doctor_id, DoctorIntervalIndex())
+        with doctor_index.lock:
+            doctor_index.add(appointment_id, start, end)
+
+    def has_conflict(self, doctor_id, start_time, end_time):
+        doctor_index = self._doctors.get(doctor_id)
+        if doctor_index is None:
+            return False
+        with doctor_index.lock:
+            return doctor_index.has_conflict(to_key(start_time), to_key(end_time))
+
+    def booked(self, doctor_id, start_time, end_time):
+        doctor_index = self._doctors.get(doctor_id)
+        if doctor_index is None:
+            return []
+        with doctor_index.lock:
+            intervals = doctor_index.overlapping(to_key(start_time), to_key(end_time))
+        return [(from_key(start), from_key(end)) for start, end in intervals]
+
+index = BookingIndex()
@@ -0,0 +1,203 @@
+import csv
+import json
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+import database.models as models
+import schemas
+import booking_index
+import occupancy
+import audit
+import changes
+import reports
+import tenancy
+import crud
+import patient_search
+from config import BULK_IMPORT_CHUNK_SIZE, BULK_IMPORT_MAX_ERRORS
+
+# Streaming NDJSON/CSV imports. Rows are validated with the regular Create schemas and
+# inserted one chunk per executemany + commit; a bad row is reported and skipped, it
+# never aborts the rest of the import.
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, row: int, message: str):
+        self.failed += 1
+        if len(self.errors) < BULK_IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def result(self):
+        return {"inserted": self.inserted, "failed": self.failed, "errors": sorted(self.errors, key=lambda e: e["row"])}
+
+def _validation_message(exc: ValidationError):
+    return "; ".join(f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in exc.errors())
+
+def _validate(schema, rows, report):
+    valid = []
+    for row_number, row in rows:
+        if isinstance(row, str):
+            report.error(row_number, row)
+            continue
+        try:
+            valid.append((row_number, schema(**row)))
+        except ValidationError as exc:
+            report.error(row_number, _validation_message(exc))
+        except TypeError:
+            report.error(row_number, "Row must be an object")
+    return valid
+
+async def _lines(request):
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8").rstrip("\r")
+
+async def read_rows(request):
+    """Yield (row_number, dict) from an NDJSON or CSV (header + one record per line) body.
+
+    Rows that cannot be parsed are yielded as (row_number, error message).
+    """
+    is_csv = "csv" in request.headers.get("content-type", "")
+    header = None
+    row_number = 0
+    async for line in _lines(request):
+        if not line.strip():
+            continue
+        if is_csv:
+            values = next(csv.reader([line]))
+            if header is None:
+                header = values
+                continue
+            row_number += 1
+            if len(values) != len(header):
+                yield row_number, f"Expected {len(header)} columns, got {len(values)}"
+            else:
+                yield row_number, dict(zip(header, values))
+        else:
+            row_number += 1
+            try:
+                yield row_number, json.loads(line)
+            except ValueError:
+                yield row_number, "Invalid JSON"
+
+async def run_import(request, import_chunk):
+    report = ImportReport()
+    chunk = []
+    async for row in read_rows(request):
+        chunk.append(row)
+        if len(chunk) >= BULK_IMPORT_CHUNK_SIZE:
+            await run_in_threadpool(import_chunk, chunk, report)
+            chunk = []
+    if chunk:
+        await run_in_threadpool(import_chunk, chunk, report)
+    return report.result()
+
+# Patients: emails must be unique against the table and across the whole import
+def patient_importer(db: Session):
+    seen_emails = set()
+
+    def import_chunk(rows, report):
+        patients = _validate(schemas.PatientCreate, rows, report)
+        existing = {
+            email for (email,) in db.query(models.Patient.email).filter(
+                models.Patient.email.in_([p.email for _, p in patients])
+            )
+        }
+        values = []
+        for row_number, patient in patients:
+            if patient.email in existing or patient.email in seen_emails:
+                report.error(row_number, "Email already registered")
+                continue
+            seen_emails.add(patient.email)
+            values.append(patient.dict())
+        if values:
+            inserted = db.execute(
+                insert(models.Patient).returning(models.Patient.id, models.Patient.name_normalized), values
+            )
+            inserted = inserted.all()
+            patient_search.index_names(db, inserted)
+            audit.created(db, models.Patient, [patient_id for patient_id, _ in inserted])
+            db.commit()
+        report.inserted += len(values)
+
+    return import_chunk
+
+def schedule_importer(db: Session, doctor_id: int):
+    def import_chunk(rows, report):
+        values = [s.dict() | {"doctor_id": doctor_id} for _, s in _validate(schemas.ScheduleCreate, rows, report)]
+        if values:
+            db.execute(insert(models.Schedule), values)
+            db.commit()
+            tenancy.doctor_profiles().pop(doctor_id)
+        report.inserted += len(values)
+
+    return import_chunk
+
+# Appointments: each row is checked against the stored appointments (booking index or SQL)
+# and against every row accepted earlier in the same import
+def appointment_importer(db: Session):
+    accepted = {}
+
+    def import_chunk(rows, report):
+        appointments = _validate(schemas.AppointmentCreate, rows, report)
+        doctor_ids = {a.doctor_id for _, a in appointments}
+        with crud.doctor_locks.hold_many(map(crud.doctor_key, doctor_ids)):
+            row_numbers, values = [], []
+            for row_number, appointment in appointments:
+                if appointment.end_time <= appointment.start_time:
+                    report.error(row_number, "end_time must be after start_time")
+                    continue
+                start = booking_index.to_key(appointment.start_time)
+                end = booking_index.to_key(appointment.end_time)
+                doctor_accepted = accepted.setdefault(appointment.doctor_id, booking_index.DoctorIntervalIndex())
+                if doctor_accepted.has_conflict(start, end) or crud.has_conflicting_appointment(
+                    db, appointment.doctor_id, appointment.start_time, appointment.end_time
+                ):
+                    report.error(row_number, "Doctor is not available at this time")
+                    continue
+                doctor_accepted.add(row_number, start, end)
+                row_numbers.append(row_number)
+                values.append(appointment.dict())
+            if values:
+                crud.lock_doctors(db, {value["doctor_id"] for value in values})
+                ids = db.scalars(
+                    insert(models.Appointment).returning(models.Appointment.id, sort_by_parameter_order=True), values
+                ).all()
+                # Booked by another process since the check above: the same guard as crud's
+                # compare-and-insert, for the whole chunk in one query
+                conflicts = crud.get_overlapping_ids(db, ids)
+                if conflicts:
+                    crud.delete_appointments(db, conflicts)
+                    kept = []
+                    for row_number, appointment_id, value in zip(row_numbers, ids, values):
+                        if appointment_id in conflicts:
+                            report.error(row_number, "Doctor is not available at this time")
+                        else:
+                            kept.append((appointment_id, value))
+                    ids, values = [appointment_id for appointment_id, _ in kept], [value for _, value in kept]
+            if values:
+                occupancy.apply(db, occupancy.deltas(values))
+                # History imported into finished weeks changes their stored reports
+                reports.invalidate_many(db, [(value["doctor_id"], value["start_time"]) for value in values])
+                audit.created(db, models.Appointment, ids)
+                changes.record(db, zip((value["doctor_id"] for value in values), ids))
+                db.commit()
+                for appointment_id, value in zip(ids, values):
+                    tenancy.index().add_interval(
+                        value["doctor_id"], appointment_id, value["start_time"], value["end_time"]
+                    )
+                    crud.schedule_reminder(appointment_id, value["start_time"])
+            else:
+                db.rollback()
+        report.inserted += len(values)
+
+    return import_chunk
@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import OrderedDict
+from config import DOCTOR_CACHE_SIZE, DOCTOR_CACHE_TTL_SECONDS
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries also expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+# Serialized GET /doctors/{doctor_id} bodies, dropped whenever an office, schedule or
+# appointment type is added to the doctor
+doctor_profiles = TTLCache(DOCTOR_CACHE_SIZE, DOCTOR_CACHE_TTL_SECONDS)
@@ -0,0 +1,75 @@
+import hashlib
+from datetime import datetime
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+import database.models as models
+import pagination
+
+# Change feed of each doctor's appointments, for calendar and FHIR clients that sync. Every
+# appointment write adds a change_log row in its own transaction, so the feed never shows an
+# uncommitted write. A doctor's writers are serialized (crud.doctor_locks, and the advisory
+# lock on PostgreSQL), so within one doctor's feed the sequence numbers also commit in order
+# and "everything after seq N" never skips a late commit. A sync token is an opaque seq; an
+# export answers with the token it is current to, and the same token makes its ETag, so an
+# unchanged agenda is a 304 without reading a single appointment.
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+def record(db: Session, appointments, action: str = UPSERT):
+    """Adds a change for each (doctor_id, appointment_id); the caller commits."""
+    now = datetime.now()
+    rows = [{"doctor_id": doctor_id, "appointment_id": appointment_id, "action": action, "changed_at": now}
+            for doctor_id, appointment_id in appointments]
+    if rows:
+        db.execute(insert(models.ChangeLog), rows)
+
+def latest(db: Session, doctor_id: int):
+    """The doctor's last sequence number, 0 before any change."""
+    return db.query(func.max(models.ChangeLog.seq)).filter(models.ChangeLog.doctor_id == doctor_id).scalar() or 0
+
+def encode_token(seq: int):
+    return pagination.encode_cursor([seq])
+
+def decode_token(token: str):
+    """Raises ValueError if `token` is not a sync token."""
+    seq, = pagination.decode_cursor(token, [models.ChangeLog.seq])
+    if not isinstance(seq, int) or seq < 0:
+        raise ValueError("Invalid sync token")
+    return seq
+
+def since(db: Session, doctor_id: int, seq: int, limit: int):
+    """(changes, last seq, more) after `seq`, at most `limit` changes read.
+
+    An appointment changed several times in the range is listed once, at its last change,
+    with its current row (None once deleted).
+    """
+    rows = db.query(models.ChangeLog.seq, models.ChangeLog.appointment_id, models.ChangeLog.action).filter(
+        models.ChangeLog.doctor_id == doctor_id, models.ChangeLog.seq > seq
+    ).order_by(models.ChangeLog.seq).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    last = {appointment_id: (change_seq, action) for change_seq, appointment_id, action in rows}
+    appointments = {
+        appointment.id: appointment for appointment in db.query(models.Appointment).filter(
+            models.Appointment.id.in_(list(last)), models.Appointment.doctor_id == doctor_id
+        )
+    } if last else {}
+    changes = sorted(
+        ({"seq": change_seq, "action": action if appointment_id in appointments else DELETE,
+          "appointment_id": appointment_id, "appointment": appointments.get(appointment_id)}
+         for appointment_id, (change_seq, action) in last.items()),
+        key=lambda change: change["seq"]
+    )
+    return changes, rows[-1].seq if rows else seq, more
+
+def etag(kind: str, doctor_id: int, seq: int, *params):
+    key = "|".join(str(value) for value in (kind, doctor_id, seq, *params))
+    return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+def not_modified(if_none_match: str, current: str):
+    """True if an If-None-Match header value names the `current` ETag."""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or current in tags
@@ -6,3 +6,128 @@ load_dotenv()
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 ADMIN_SECRET = os.getenv("ADMIN_SECRET")
+
+# Doctor panel access tokens (tokens.py): HMAC key shared by all replicas, lifetime, and the
+# LRU of recently verified tokens
+TOKEN_SECRET = os.getenv("TOKEN_SECRET")
+TOKEN_TTL_SECONDS = float(os.getenv("TOKEN_TTL_SECONDS", "900"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "60"))
+
+# Fast start for autoscaled replicas: the schema and the admin user are left to the migration
+# step (python -m database.bootstrap), and the index warmup and bcrypt calibration run in the
+# background while /readyz reports 503
+FAST_START = os.getenv("FAST_START", "false").lower() in ("1", "true", "yes")
+# A bcrypt hash of ADMIN_PASSWORD, stored as is when the admin user is created so startup never hashes
+ADMIN_PASSWORD_HASH = os.getenv("ADMIN_PASSWORD_HASH")
+# Create ADMIN_USERNAME at startup when it is missing
+ADMIN_BOOTSTRAP = os.getenv("ADMIN_BOOTSTRAP", "false" if FAST_START else "true").lower() in ("1", "true", "yes")
+
+# Any SQLAlchemy URL; sqlite:// and postgresql:// get their own engine profile (database/database.py)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./bettyia.db")
+# PostgreSQL connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# SQLite pragmas, set on every new connection
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "wal")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "normal")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Per-clinic databases (tenancy.py), off unless TENANTS names the clinics. The URL template
+# gets the clinic's name as {tenant}; engines stay open for the most recently used clinics only
+TENANTS = [name.strip() for name in os.getenv("TENANTS", "").split(",") if name.strip()]
+TENANT_DATABASE_URL = os.getenv("TENANT_DATABASE_URL", "sqlite:///./tenants/{tenant}.db")
+TENANT_ENGINE_CACHE_SIZE = int(os.getenv("TENANT_ENGINE_CACHE_SIZE", "32"))
+TENANT_IDLE_SECONDS = float(os.getenv("TENANT_IDLE_SECONDS", "600"))
+
+MAX_AVAILABILITY_DAYS = int(os.getenv("MAX_AVAILABILITY_DAYS", "92"))
+EARLIEST_SLOTS_MAX = int(os.getenv("EARLIEST_SLOTS_MAX", "50"))
+SERIES_MAX_OCCURRENCES = int(os.getenv("SERIES_MAX_OCCURRENCES", "104"))
+
+# Patient search: rows fetched from the index before ranking, and the shortest number (in
+# digits) matched as a phone; callers' numbers are matched on their trailing digits
+PATIENT_SEARCH_CANDIDATES = int(os.getenv("PATIENT_SEARCH_CANDIDATES", "50"))
+PHONE_MATCH_MIN_DIGITS = int(os.getenv("PHONE_MATCH_MIN_DIGITS", "7"))
+# Spanish date phrases (date_phrases.py): memoized normalized phrases, and windows returned per phrase
+DATE_PHRASE_CACHE_SIZE = int(os.getenv("DATE_PHRASE_CACHE_SIZE", "4096"))
+DATE_PHRASE_MAX_WINDOWS = int(os.getenv("DATE_PHRASE_MAX_WINDOWS", "14"))
+BOOKING_LOCK_STRIPES = int(os.getenv("BOOKING_LOCK_STRIPES", "64"))
+
+# Serve the core endpoints from async handlers on an AsyncSession (aiosqlite / asyncpg)
+ASYNC_DB = os.getenv("ASYNC_DB", "false").lower() in ("1", "true", "yes")
+
+# bcrypt runs in a process pool; 0 workers hashes inline in the calling thread
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", str(os.cpu_count() or 1)))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "64"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Startup calibration picks the highest cost under this latency, never below BCRYPT_MIN_ROUNDS (0 disables)
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", "10"))
+
+DOCTOR_CACHE_SIZE = int(os.getenv("DOCTOR_CACHE_SIZE", "1024"))
+DOCTOR_CACHE_TTL_SECONDS = float(os.getenv("DOCTOR_CACHE_TTL_SECONDS", "300"))
+
+# Weekly doctor reports (reports.py): per-process LRU of report bodies, rows fetched per batch,
+# and the no-show history (days before the week's end) behind the flagged patients
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "4096"))
+REPORT_CACHE_TTL_SECONDS = float(os.getenv("REPORT_CACHE_TTL_SECONDS", "300"))
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "10000"))
+REPORT_NO_SHOW_LOOKBACK_DAYS = int(os.getenv("REPORT_NO_SHOW_LOOKBACK_DAYS", "182"))
+# Patients with at least this many attended or missed appointments and this no-show rate
+REPORT_NO_SHOW_MIN_APPOINTMENTS = int(os.getenv("REPORT_NO_SHOW_MIN_APPOINTMENTS", "3"))
+REPORT_NO_SHOW_RATE = float(os.getenv("REPORT_NO_SHOW_RATE", "0.3"))
+REPORT_NO_SHOW_LIMIT = int(os.getenv("REPORT_NO_SHOW_LIMIT", "20"))
+# Worker processes of the batch job (python -m reports)
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", str(os.cpu_count() or 1)))
+
+BULK_IMPORT_CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", "2000"))
+BULK_IMPORT_MAX_ERRORS = int(os.getenv("BULK_IMPORT_MAX_ERRORS", "1000"))
+
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "50"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "500"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Reminders due within this window are kept in memory; later ones are loaded as time advances
+REMINDER_LOOKAHEAD_HOURS = float(os.getenv("REMINDER_LOOKAHEAD_HOURS", "12"))
+# A reminder whose time passed less than this long ago (e.g. during a restart) is still sent
+REMINDER_GRACE_MINUTES = float(os.getenv("REMINDER_GRACE_MINUTES", "15"))
+
+# Outbound WhatsApp/SMS/email queue (outbox.py); disabling it only stops this process's workers
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "true").lower() in ("1", "true", "yes")
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+# A claimed batch that is not confirmed within the lease is sent again
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "2"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "900"))
+# Provider rate limits, messages per second
+OUTBOX_RATE_WHATSAPP = float(os.getenv("OUTBOX_RATE_WHATSAPP", "20"))
+OUTBOX_RATE_SMS = float(os.getenv("OUTBOX_RATE_SMS", "10"))
+OUTBOX_RATE_EMAIL = float(os.getenv("OUTBOX_RATE_EMAIL", "50"))
+
+# Sampling profiler: requests slower than this many ms are dumped as collapsed stacks to
+# PROFILE_DIR (0 disables sampling)
+PROFILE_SLOW_REQUESTS_MS = float(os.getenv("PROFILE_SLOW_REQUESTS_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+
+# Audit trail (audit.py): entries buffered in memory (the oldest are dropped past the buffer
+# size) and written by a background thread in batches of up to AUDIT_BATCH_SIZE
+AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "true").lower() in ("1", "true", "yes")
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", "100000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "1000"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "1"))
+
+# Idempotency-Key replay store for POST endpoints: "memory" (per process LRU) or "database"
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "memory")
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+# Larger responses are not stored (the request still runs)
+IDEMPOTENCY_MAX_BODY_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BODY_BYTES", str(1024 * 1024)))
+# How long a key stays claimed by a request that never finishes
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
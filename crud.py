@@ -1,16 +1,35 @@
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from datetime import datetime
+from sqlalchemy import select, insert, delete, literal, func
+from sqlalchemy.orm import Session, aliased, joinedload, selectinload
 import database.models as models
 import schemas
+import booking_index
+import reminders
+import outbox
+import occupancy
+import availability
+import series
+import patient_search
+import hashing
+import audit
+import tenancy
+import reports
+import changes
+from locks import StripedLock
+from config import BOOKING_LOCK_STRIPES, EXPORT_BATCH_SIZE
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+doctor_locks = StripedLock(BOOKING_LOCK_STRIPES)
+
+def doctor_key(doctor_id: int):
+    # Doctor ids repeat across clinic databases
+    return tenancy.name(), doctor_id
 
 # User CRUD
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
 def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = hashing.pool.hash(user.password)
     db_user = models.User(username=user.username, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
@@ -18,11 +37,17 @@ def create_user(db: Session, user: schemas.UserCreate):
     return db_user
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return hashing.pool.verify(plain_password, hashed_password)
 
 # Doctor CRUD
+# Loads the whole profile up front: offices are joined, schedule and appointment types come in one
+# IN query each (joining all three would return offices x schedules x types rows)
 def get_doctor(db: Session, doctor_id: int):
-    return db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
+    return db.query(models.Doctor).options(
+        joinedload(models.Doctor.offices),
+        selectinload(models.Doctor.schedule),
+        selectinload(models.Doctor.appointment_types)
+    ).filter(models.Doctor.id == doctor_id).first()
 
 def get_doctor_by_email(db: Session, email: str):
     return db.query(models.Doctor).filter(models.Doctor.email == email).first()
@@ -35,27 +60,39 @@ def create_doctor(db: Session, doctor: schemas.DoctorCreate):
     return db_doctor
 
 # Office CRUD
+def get_office(db: Session, office_id: int):
+    return db.query(models.Office).filter(models.Office.id == office_id).first()
+
 def create_doctor_office(db: Session, office: schemas.OfficeCreate, doctor_id: int):
     db_office = models.Office(**office.dict(), doctor_id=doctor_id)
     db.add(db_office)
     db.commit()
     db.refresh(db_office)
+    tenancy.doctor_profiles().pop(doctor_id)
     return db_office
 
 # Schedule CRUD
+def get_doctor_schedules(db: Session, doctor_id: int):
+    return db.query(models.Schedule).filter(models.Schedule.doctor_id == doctor_id).all()
+
 def create_doctor_schedule(db: Session, schedule: schemas.ScheduleCreate, doctor_id: int):
     db_schedule = models.Schedule(**schedule.dict(), doctor_id=doctor_id)
     db.add(db_schedule)
     db.commit()
     db.refresh(db_schedule)
+    tenancy.doctor_profiles().pop(doctor_id)
     return db_schedule
 
 # AppointmentType CRUD
+def get_appointment_type(db: Session, appointment_type_id: int):
+    return db.query(models.AppointmentType).filter(models.AppointmentType.id == appointment_type_id).first()
+
 def create_doctor_appointment_type(db: Session, appointment_type: schemas.AppointmentTypeCreate, doctor_id: int):
     db_appointment_type = models.AppointmentType(**appointment_type.dict(), doctor_id=doctor_id)
     db.add(db_appointment_type)
     db.commit()
     db.refresh(db_appointment_type)
+    tenancy.doctor_profiles().pop(doctor_id)
     return db_appointment_type
 
 # Patient CRUD
@@ -65,24 +102,271 @@ def get_patient(db: Session, patient_id: int):
 def get_patient_by_email(db: Session, email: str):
     return db.query(models.Patient).filter(models.Patient.email == email).first()
 
+# Unordered queries for the keyset-paginated list endpoints (see pagination.py)
+def get_patients_query(db: Session, name: str = None):
+    query = db.query(models.Patient)
+    if name:
+        query = query.filter(models.Patient.full_name.startswith(name, autoescape=True))
+    return query
+
+# Totals of one clinic database, the appointments from the daily occupancy summary
+def get_clinic_summary(db: Session, start_date, end_date):
+    minutes, count = db.query(
+        func.coalesce(func.sum(models.DailyOccupancy.booked_minutes), 0),
+        func.coalesce(func.sum(models.DailyOccupancy.appointment_count), 0)
+    ).filter(models.DailyOccupancy.day >= start_date, models.DailyOccupancy.day <= end_date).one()
+    return {
+        "doctors": db.query(func.count(models.Doctor.id)).scalar(),
+        "patients": db.query(func.count(models.Patient.id)).scalar(),
+        "appointment_count": count, "booked_minutes": minutes,
+    }
+
+def get_audit_entries_query(db: Session, entity: str = None, record_id: int = None, actor: str = None,
+                            since: datetime = None, until: datetime = None, tenant: str = None):
+    query = db.query(models.AuditEntry)
+    if tenant:
+        query = query.filter(models.AuditEntry.tenant == tenant)
+    if entity:
+        query = query.filter(models.AuditEntry.entity == entity)
+    if record_id is not None:
+        query = query.filter(models.AuditEntry.record_id == record_id)
+    if actor:
+        query = query.filter(models.AuditEntry.actor == actor)
+    if since:
+        query = query.filter(models.AuditEntry.at >= since)
+    if until:
+        query = query.filter(models.AuditEntry.at < until)
+    return query
+
 def create_patient(db: Session, patient: schemas.PatientCreate):
     db_patient = models.Patient(**patient.dict())
     db.add(db_patient)
+    db.flush()
+    patient_search.index_names(db, [(db_patient.id, db_patient.name_normalized)])
     db.commit()
     db.refresh(db_patient)
     return db_patient
 
 # Appointment CRUD
+def get_appointment(db: Session, appointment_id: int):
+    return db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
+
+def get_doctor_appointments_query(db: Session, doctor_id: int, start_time=None, end_time=None):
+    query = db.query(models.Appointment).filter(models.Appointment.doctor_id == doctor_id)
+    if start_time is not None:
+        query = query.filter(models.Appointment.start_time >= start_time)
+    if end_time is not None:
+        query = query.filter(models.Appointment.start_time < end_time)
+    return query
+
+def get_patient_appointments_query(db: Session, patient_id: int, start_time=None, end_time=None):
+    query = db.query(models.Appointment).filter(models.Appointment.patient_id == patient_id)
+    if start_time is not None:
+        query = query.filter(models.Appointment.start_time >= start_time)
+    if end_time is not None:
+        query = query.filter(models.Appointment.start_time < end_time)
+    return query
+
+# Outcome of an appointment; the reports counting it are recomputed, as after any booking
+def set_appointment_status(db: Session, db_appointment: models.Appointment, status: models.AppointmentStatus):
+    with doctor_locks(doctor_key(db_appointment.doctor_id)):
+        _lock_doctor(db, db_appointment.doctor_id)
+        db_appointment.status = status
+        reports.invalidate(db, db_appointment.doctor_id, db_appointment.start_time)
+        changes.record(db, [(db_appointment.doctor_id, db_appointment.id)])
+        db.commit()
+    db.refresh(db_appointment)
+    return db_appointment
+
+# An export's rows, joined and streamed from a server-side cursor (exports.py renders them)
+def get_export_rows(db: Session, doctor_id: int, start_time=None, end_time=None):
+    statement = select(
+        models.Appointment.id, models.Appointment.start_time, models.Appointment.end_time,
+        models.Appointment.status, models.Appointment.created_at,
+        models.Patient.id.label("patient_id"), models.Patient.full_name.label("patient_name"),
+        models.Office.id.label("office_id"), models.Office.name.label("office_name"),
+        models.Office.address.label("office_address"),
+        models.AppointmentType.name.label("appointment_type_name")
+    ).outerjoin(models.Patient, models.Patient.id == models.Appointment.patient_id).outerjoin(
+        models.Office, models.Office.id == models.Appointment.office_id
+    ).outerjoin(
+        models.AppointmentType, models.AppointmentType.id == models.Appointment.appointment_type_id
+    ).where(models.Appointment.doctor_id == doctor_id)
+    if start_time is not None:
+        statement = statement.where(models.Appointment.start_time >= start_time)
+    if end_time is not None:
+        statement = statement.where(models.Appointment.start_time < end_time)
+    statement = statement.order_by(models.Appointment.start_time, models.Appointment.id)
+    return db.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
 def get_appointments_for_doctor(db: Session, doctor_id: int, start_time: str, end_time: str):
     return db.query(models.Appointment).filter(
         models.Appointment.doctor_id == doctor_id,
         models.Appointment.start_time < end_time,
         models.Appointment.end_time > start_time
-    ).all()
+    ).order_by(models.Appointment.start_time).all()
+
+# Conflict checks and slot searches go through the in-process index once it is loaded
+def has_conflicting_appointment(db: Session, doctor_id: int, start_time, end_time):
+    index = tenancy.index()
+    if index.ready:
+        return index.has_conflict(doctor_id, start_time, end_time)
+    return bool(get_appointments_for_doctor(db, doctor_id, start_time, end_time))
 
+def get_booked_intervals(db: Session, doctor_id: int, start_time, end_time):
+    index = tenancy.index()
+    if index.ready:
+        return index.booked(doctor_id, start_time, end_time)
+    return [(a.start_time, a.end_time) for a in get_appointments_for_doctor(db, doctor_id, start_time, end_time)]
+
+# First-available search: one (doctor, office, appointment type) row per doctor offering the
+# type by name, at the given office or at any office whose address contains `address`
+def get_first_available_candidates(db: Session, appointment_type: str, office_id: int = None, address: str = None):
+    query = db.query(
+        models.Doctor.id.label("doctor_id"), models.Doctor.full_name.label("doctor_name"),
+        models.Office.id.label("office_id"), models.AppointmentType.id.label("appointment_type_id"),
+        models.AppointmentType.duration_minutes
+    ).join(models.Office, models.Office.doctor_id == models.Doctor.id).join(
+        models.AppointmentType, models.AppointmentType.doctor_id == models.Doctor.id
+    ).filter(
+        func.lower(models.AppointmentType.name) == appointment_type.lower(),
+        # Zero-minute types stored before durations were validated have no slots
+        models.AppointmentType.duration_minutes > 0
+    )
+    if office_id is not None:
+        query = query.filter(models.Office.id == office_id)
+    if address:
+        query = query.filter(func.lower(models.Office.address).contains(address.lower(), autoescape=True))
+    candidates = {}
+    for row in query.order_by(models.Doctor.id, models.Office.id, models.AppointmentType.id):
+        candidates.setdefault(row.doctor_id, row)
+    return list(candidates.values())
+
+def get_schedules_for_doctors(db: Session, doctor_ids):
+    schedules = {doctor_id: [] for doctor_id in doctor_ids}
+    for schedule in db.query(models.Schedule).filter(models.Schedule.doctor_id.in_(doctor_ids)):
+        schedules[schedule.doctor_id].append(schedule)
+    return schedules
+
+# Returns None if the doctor already has an overlapping appointment
 def create_appointment(db: Session, appointment: schemas.AppointmentCreate):
-    db_appointment = models.Appointment(**appointment.dict())
-    db.add(db_appointment)
+    with doctor_locks(doctor_key(appointment.doctor_id)):
+        return insert_appointment(db, appointment)
+
+# Serializes a doctor's writers across processes on PostgreSQL, until the transaction ends
+def _lock_doctor(db: Session, doctor_id: int):
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(select(func.pg_advisory_xact_lock(doctor_id)))
+
+# Several doctors, always in the same order so two writers cannot deadlock
+def lock_doctors(db: Session, doctor_ids):
+    for doctor_id in sorted(doctor_ids):
+        _lock_doctor(db, doctor_id)
+
+# Compare-and-insert: the overlap check and the INSERT are a single statement, so writers in
+# other processes cannot interleave between them. Callers serialize per doctor (doctor_locks).
+def _insert_if_free(db: Session, values: dict):
+    columns = models.Appointment.__table__.c
+    overlapping = select(models.Appointment.id).where(
+        models.Appointment.doctor_id == values["doctor_id"],
+        models.Appointment.start_time < values["end_time"],
+        models.Appointment.end_time > values["start_time"]
+    ).exists()
+    statement = insert(models.Appointment).from_select(
+        list(values),
+        select(*[literal(value, type_=columns[key].type) for key, value in values.items()]).where(~overlapping)
+    ).returning(models.Appointment.id)
+    return db.execute(statement).scalar()
+
+# Chunked inserts (bulk_import) check the index before the INSERT and this after it, in the
+# same transaction: the ids among `appointment_ids` overlapping an appointment outside them,
+# which another process committed in between. The caller removes them and commits.
+def get_overlapping_ids(db: Session, appointment_ids):
+    new, other = aliased(models.Appointment), aliased(models.Appointment)
+    return set(db.scalars(select(new.id).join(other, (other.doctor_id == new.doctor_id) & (
+        other.start_time < new.end_time) & (other.end_time > new.start_time)
+    ).where(new.id.in_(appointment_ids), other.id.not_in(appointment_ids)).distinct()))
+
+def delete_appointments(db: Session, appointment_ids):
+    db.execute(delete(models.Appointment).where(models.Appointment.id.in_(appointment_ids)))
+
+def _load_for_confirmation(db: Session, appointment_ids):
+    return db.query(models.Appointment).options(
+        joinedload(models.Appointment.doctor), joinedload(models.Appointment.patient),
+        joinedload(models.Appointment.office), joinedload(models.Appointment.appointment_type)
+    ).filter(models.Appointment.id.in_(appointment_ids)).order_by(models.Appointment.start_time).all()
+
+def schedule_reminder(appointment_id, start_time):
+    reminders.scheduler.schedule(appointment_id, start_time, tenant=tenancy.name())
+
+def insert_appointment(db: Session, appointment: schemas.AppointmentCreate):
+    values = appointment.dict()
+    _lock_doctor(db, appointment.doctor_id)
+    appointment_id = _insert_if_free(db, values)
+    if appointment_id is None:
+        db.rollback()
+        return None
+    # The confirmation is committed with the appointment and sent later by the outbox workers
+    db_appointment, = _load_for_confirmation(db, [appointment_id])
+    outbox.enqueue_confirmation(db, db_appointment)
+    occupancy.record(db, values)
+    reports.invalidate(db, appointment.doctor_id, appointment.start_time)
+    audit.created(db, models.Appointment, [appointment_id])
+    changes.record(db, [(appointment.doctor_id, appointment_id)])
     db.commit()
-    db.refresh(db_appointment)
+    outbox.dispatcher.notify(tenancy.name())
+    tenancy.index().add_interval(appointment.doctor_id, appointment_id, appointment.start_time, appointment.end_time)
+    schedule_reminder(appointment_id, appointment.start_time)
     return db_appointment
+
+# Books the occurrences of a series (key arrays from series.expand) in one transaction.
+# Returns one (status, appointment_id) per occurrence; with all_or_nothing nothing is booked
+# unless every occurrence is free.
+def create_appointment_series(db: Session, appointment: schemas.AppointmentCreate, starts, ends,
+                              all_or_nothing: bool = True):
+    first, last = booking_index.from_key(int(starts[0])), booking_index.from_key(int(ends[-1]))
+    with doctor_locks(doctor_key(appointment.doctor_id)):
+        _lock_doctor(db, appointment.doctor_id)
+        statuses = series.check(
+            starts, ends, get_booked_intervals(db, appointment.doctor_id, first, last),
+            availability.working_windows(get_doctor_schedules(db, appointment.doctor_id), first, last)
+        )
+        if all_or_nothing and any(status != series.BOOKED for status in statuses):
+            db.rollback()
+            return series.rejected(statuses)
+
+        # The vectorized check ran against the index or one range query; the compare-and-insert
+        # still guards each row against writers in other processes
+        outcomes, booked = [], []
+        for status, start, end in zip(statuses, starts.tolist(), ends.tolist()):
+            appointment_id = None
+            if status == series.BOOKED:
+                values = dict(appointment.dict(), start_time=booking_index.from_key(start),
+                              end_time=booking_index.from_key(end))
+                appointment_id = _insert_if_free(db, values)
+                if appointment_id is None and all_or_nothing:
+                    db.rollback()
+                    return series.rejected(statuses[:len(outcomes)] + [series.CONFLICT] + statuses[len(outcomes) + 1:])
+                if appointment_id is None:
+                    status = series.CONFLICT
+                else:
+                    booked.append(values)
+            outcomes.append((status, appointment_id))
+        if not booked:
+            db.rollback()
+            return outcomes
+
+        db_appointments = _load_for_confirmation(db, [appointment_id for _, appointment_id in outcomes if appointment_id])
+        outbox.enqueue_series_confirmation(db, db_appointments)
+        occupancy.apply(db, occupancy.deltas(booked))
+        reports.invalidate_many(db, [(values["doctor_id"], values["start_time"]) for values in booked])
+        audit.created(db, models.Appointment, [db_appointment.id for db_appointment in db_appointments])
+        changes.record(db, [(db_appointment.doctor_id, db_appointment.id) for db_appointment in db_appointments])
+        db.commit()
+        outbox.dispatcher.notify(tenancy.name())
+        for db_appointment in db_appointments:
+            tenancy.index().add_interval(
+                db_appointment.doctor_id, db_appointment.id, db_appointment.start_time, db_appointment.end_time
+            )
+            schedule_reminder(db_appointment.id, db_appointment.start_time)
+    return outcomes
@@ -0,0 +1,141 @@
+import asyncio
+from contextlib import asynccontextmanager
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from starlette.concurrency import run_in_threadpool
+import database.models as models
+import schemas
+import hashing
+import tenancy
+import crud
+import patient_search
+
+# Async counterparts of crud.py for AsyncSession. Relationships are never lazy-loaded
+# under asyncio, so anything a response model serializes is loaded up front.
+
+# The sync path's per-doctor locks (crud.doctor_locks), so async bookings also serialize with
+# the writers only served by sync handlers (series, imports, status changes). The stripe is a
+# threading lock, so it is waited for in a worker thread rather than on the event loop.
+@asynccontextmanager
+async def doctor_lock(doctor_id: int):
+    lock = crud.doctor_locks(crud.doctor_key(doctor_id))
+    acquiring = asyncio.ensure_future(run_in_threadpool(lock.acquire))
+    try:
+        await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # The thread still takes the lock; it is given back as soon as it does
+        acquiring.add_done_callback(lambda task: task.cancelled() or task.exception() or lock.release())
+        raise
+    try:
+        yield
+    finally:
+        lock.release()
+
+async def _first(db: AsyncSession, statement):
+    return (await db.execute(statement)).scalars().first()
+
+async def _save(db: AsyncSession, instance):
+    db.add(instance)
+    await db.commit()
+    await db.refresh(instance)
+    return instance
+
+# User CRUD
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await _first(db, select(models.User).where(models.User.username == username))
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    hashed_password = await hashing.pool.hash_async(user.password)
+    return await _save(db, models.User(username=user.username, hashed_password=hashed_password))
+
+async def verify_password(plain_password, hashed_password):
+    return await hashing.pool.verify_async(plain_password, hashed_password)
+
+# Doctor CRUD
+async def get_doctor(db: AsyncSession, doctor_id: int):
+    return (await db.execute(select(models.Doctor).where(models.Doctor.id == doctor_id).options(
+        joinedload(models.Doctor.offices),
+        selectinload(models.Doctor.schedule),
+        selectinload(models.Doctor.appointment_types)
+    ))).unique().scalars().first()
+
+async def get_doctor_by_email(db: AsyncSession, email: str):
+    return await _first(db, select(models.Doctor).where(models.Doctor.email == email))
+
+async def create_doctor(db: AsyncSession, doctor: schemas.DoctorCreate):
+    db_doctor = await _save(db, models.Doctor(**doctor.dict()))
+    return await get_doctor(db, db_doctor.id)
+
+# Office CRUD
+async def get_office(db: AsyncSession, office_id: int):
+    return await _first(db, select(models.Office).where(models.Office.id == office_id))
+
+async def create_doctor_office(db: AsyncSession, office: schemas.OfficeCreate, doctor_id: int):
+    db_office = await _save(db, models.Office(**office.dict(), doctor_id=doctor_id))
+    tenancy.doctor_profiles().pop(doctor_id)
+    return db_office
+
+# Schedule CRUD
+async def get_doctor_schedules(db: AsyncSession, doctor_id: int):
+    return (await db.execute(select(models.Schedule).where(models.Schedule.doctor_id == doctor_id))).scalars().all()
+
+async def create_doctor_schedule(db: AsyncSession, schedule: schemas.ScheduleCreate, doctor_id: int):
+    db_schedule = await _save(db, models.Schedule(**schedule.dict(), doctor_id=doctor_id))
+    tenancy.doctor_profiles().pop(doctor_id)
+    return db_schedule
+
+# AppointmentType CRUD
+async def get_appointment_type(db: AsyncSession, appointment_type_id: int):
+    return await _first(db, select(models.AppointmentType).where(models.AppointmentType.id == appointment_type_id))
+
+async def create_doctor_appointment_type(db: AsyncSession, appointment_type: schemas.AppointmentTypeCreate, doctor_id: int):
+    db_appointment_type = await _save(db, models.AppointmentType(**appointment_type.dict(), doctor_id=doctor_id))
+    tenancy.doctor_profiles().pop(doctor_id)
+    return db_appointment_type
+
+# Patient CRUD
+async def get_patient(db: AsyncSession, patient_id: int):
+    return await _first(db, select(models.Patient).where(models.Patient.id == patient_id))
+
+async def get_patient_by_email(db: AsyncSession, email: str):
+    return await _first(db, select(models.Patient).where(models.Patient.email == email))
+
+# The sync path, so the patient is added to the name index in the same transaction
+async def create_patient(db: AsyncSession, patient: schemas.PatientCreate):
+    return await db.run_sync(crud.create_patient, patient)
+
+async def search_patients(db: AsyncSession, query: str, limit: int):
+    return await db.run_sync(patient_search.search, query, limit)
+
+# Appointment CRUD
+async def get_appointment(db: AsyncSession, appointment_id: int):
+    return await _first(db, select(models.Appointment).where(models.Appointment.id == appointment_id))
+
+async def get_appointments_for_doctor(db: AsyncSession, doctor_id: int, start_time, end_time):
+    return (await db.execute(select(models.Appointment).where(
+        models.Appointment.doctor_id == doctor_id,
+        models.Appointment.start_time < end_time,
+        models.Appointment.end_time > start_time
+    ).order_by(models.Appointment.start_time))).scalars().all()
+
+async def has_conflicting_appointment(db: AsyncSession, doctor_id: int, start_time, end_time):
+    index = tenancy.index()
+    if index.ready:
+        return index.has_conflict(doctor_id, start_time, end_time)
+    return bool(await get_appointments_for_doctor(db, doctor_id, start_time, end_time))
+
+async def get_booked_intervals(db: AsyncSession, doctor_id: int, start_time, end_time):
+    index = tenancy.index()
+    if index.ready:
+        return index.booked(doctor_id, start_time, end_time)
+    return [(a.start_time, a.end_time) for a in await get_appointments_for_doctor(db, doctor_id, start_time, end_time)]
+
+# Returns None if the doctor already has an overlapping appointment
+async def create_appointment(db: AsyncSession, appointment: schemas.AppointmentCreate):
+    async with doctor_lock(appointment.doctor_id):
+        return await insert_appointment(db, appointment)
+
+# Same compare-and-insert statement as the sync path
+async def insert_appointment(db: AsyncSession, appointment: schemas.AppointmentCreate):
+    return await db.run_sync(crud.insert_appointment, appointment)
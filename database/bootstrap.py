@@ -0,0 +1,88 @@
+import argparse
+from sqlalchemy import inspect
+from database.database import Base
+import database.models  # noqa: F401  registers the tables on Base.metadata
+import patient_search
+
+# Schema bootstrap without migrations: creates missing tables, adds columns declared in
+# models.py that an older database does not have yet (nullable, backfilled by their owners),
+# then any missing index. Every step is idempotent. Run it as a deploy step with
+# python -m database.bootstrap, which also creates the admin user, in the default database
+# and in every clinic's (TENANTS); replicas started with FAST_START then skip both.
+
+def missing_columns(bind):
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing.extend(column for column in table.columns if column.name not in existing)
+    return missing
+
+def add_column(connection, column):
+    quote = connection.dialect.identifier_preparer.quote
+    connection.exec_driver_sql(
+        f"ALTER TABLE {quote(column.table.name)} ADD COLUMN {quote(column.name)} "
+        f"{column.type.compile(dialect=connection.dialect)}"
+    )
+
+def missing_indexes(bind):
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing.extend(index for index in table.indexes if index.name not in existing)
+    return missing
+
+def init_schema(bind):
+    with bind.begin() as connection:
+        Base.metadata.create_all(bind=connection)
+        for column in missing_columns(connection):
+            add_column(connection, column)
+        for index in missing_indexes(connection):
+            index.create(bind=connection)
+        patient_search.ensure_index(connection)
+
+def ensure_admin(db, username, password, password_hash=None):
+    """Creates the admin user when it is missing; True if it was created.
+
+    A precomputed bcrypt `password_hash` is stored as is, so no hashing happens at startup.
+    """
+    import crud, schemas
+    if crud.get_user_by_username(db, username=username) is not None:
+        return False
+    if password_hash:
+        db.add(database.models.User(username=username, hashed_password=password_hash))
+        db.commit()
+    else:
+        crud.create_user(db, schemas.UserCreate(username=username, password=password))
+    return True
+
+def main():
+    import hashing
+    import tenancy
+    from sqlalchemy.orm import Session
+    from database.database import engine
+    from config import ADMIN_USERNAME, ADMIN_PASSWORD, ADMIN_PASSWORD_HASH
+    argparse.ArgumentParser(description="Create or upgrade the schema and the admin user, in every clinic database too.").parse_args()
+    if ADMIN_USERNAME and not ADMIN_PASSWORD_HASH:
+        hashing.calibrate_pool()
+    databases = [("default", engine)] + [(name, tenancy.tenants.make_engine(name)) for name in sorted(tenancy.tenants.names)]
+    try:
+        for name, bind in databases:
+            init_schema(bind)
+            print(f"{name}: schema up to date")
+            if ADMIN_USERNAME:
+                with Session(bind=bind, autoflush=False) as db:
+                    created = ensure_admin(db, ADMIN_USERNAME, ADMIN_PASSWORD, ADMIN_PASSWORD_HASH)
+                print(f"{name}: admin user {ADMIN_USERNAME!r} {'created' if created else 'already present'}")
+    finally:
+        hashing.pool.shutdown()
+
+if __name__ == "__main__":
+    main()
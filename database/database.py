@@ -1,12 +1,72 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+import instrumentation
+from config import (
+    DATABASE_URL, ASYNC_DB, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_BUSY_TIMEOUT_MS
+)
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./bettyia.db"
+# Async driver for each backend's sync URL
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+def async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}")
+
+def sqlite_pragmas(journal_mode=SQLITE_JOURNAL_MODE, synchronous=SQLITE_SYNCHRONOUS,
+                   mmap_size=SQLITE_MMAP_SIZE, busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS):
+    # WAL lets readers run alongside the single writer; NORMAL only fsyncs at checkpoints in WAL mode
+    return {"journal_mode": journal_mode, "synchronous": synchronous,
+            "mmap_size": mmap_size, "busy_timeout": busy_timeout_ms}
+
+def _pool_class(create):
+    # Queue pools whose checkout wait is reported per request (instrumentation.py)
+    return instrumentation.TimedAsyncAdaptedQueuePool if create is create_async_engine else instrumentation.TimedQueuePool
+
+def sqlite_engine(url, pragmas=None, create=create_engine):
+    # In-memory databases keep SQLAlchemy's default single-connection pool
+    in_memory = make_url(url).database in (None, "", ":memory:")
+    engine = create(
+        url, connect_args={"check_same_thread": False}, **({} if in_memory else {"poolclass": _pool_class(create)})
+    )
+    pragmas = sqlite_pragmas() if pragmas is None else pragmas
+
+    @event.listens_for(getattr(engine, "sync_engine", engine), "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+def postgresql_engine(url, create=create_engine):
+    return create(
+        url, poolclass=_pool_class(create), pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True
+    )
+
+ENGINE_FACTORIES = {"sqlite": sqlite_engine, "postgresql": postgresql_engine}
+
+def make_engine(url, create=create_engine):
+    backend = make_url(url).get_backend_name()
+    if backend not in ENGINE_FACTORIES:
+        raise ValueError(f"Unsupported database backend: {backend}")
+    return instrumentation.instrument_engine(ENGINE_FACTORIES[backend](url, create=create))
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+SQLALCHEMY_ASYNC_DATABASE_URL = async_url(DATABASE_URL)
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Only built in async mode so the sync path does not need an async driver installed
+async_engine = make_engine(SQLALCHEMY_ASYNC_DATABASE_URL, create=create_async_engine) if ASYNC_DB else None
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+) if ASYNC_DB else None
+
 Base = declarative_base()
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Time, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, Time, Enum, Index, UniqueConstraint, event
 from sqlalchemy.orm import relationship
 from database.database import Base
 import enum
+import unicodedata
 
 class User(Base):
     __tablename__ = "users"
@@ -47,6 +48,12 @@ class DayOfWeek(enum.Enum):
     SATURDAY = "SATURDAY"
     SUNDAY = "SUNDAY"
 
+# Outcome of an appointment, recorded once it has started; NULL on rows from before it existed
+class AppointmentStatus(enum.Enum):
+    SCHEDULED = "SCHEDULED"
+    ATTENDED = "ATTENDED"
+    NO_SHOW = "NO_SHOW"
+
 class Schedule(Base):
     __tablename__ = "schedules"
 
@@ -68,6 +75,21 @@ class AppointmentType(Base):
 
     doctor = relationship("Doctor", back_populates="appointment_types")
 
+# Search keys for patient lookup (patient_search.py), filled in by the column defaults on
+# every insert, ORM or Core
+def normalize_name(value):
+    # Lowercase without accents or punctuation: "José Peña-Ruiz" -> "jose pena ruiz"
+    value = unicodedata.normalize("NFKD", value or "")
+    value = "".join(c if c.isalnum() else " " for c in value if not unicodedata.combining(c))
+    return " ".join(value.casefold().split())
+
+def phone_key(value):
+    # Digits in reverse, so numbers with and without a country code share a prefix
+    return "".join(c for c in value or "" if c.isdigit())[::-1]
+
+def _from(column, normalize):
+    return lambda context: normalize(context.get_current_parameters().get(column))
+
 class Patient(Base):
     __tablename__ = "patients"
 
@@ -75,17 +97,58 @@ class Patient(Base):
     full_name = Column(String, index=True)
     email = Column(String, unique=True, index=True)
     phone = Column(String)
+    name_normalized = Column(String, index=True, default=_from("full_name", normalize_name))
+    phone_key = Column(String, index=True, default=_from("phone", phone_key))
 
     appointments = relationship("Appointment", back_populates="patient")
 
-from sqlalchemy import DateTime
+# Name index over the normalized names. On SQLite an external-content FTS5 word index (with
+# a vocabulary view for typo correction) that the inserting transaction updates through
+# patient_search.index_names; with triggers on patients instead, a connection's first insert
+# fails with "database is locked" rather than waiting whenever another writer holds the lock.
+# On PostgreSQL a pg_trgm GIN index.
+PATIENT_NAME_INDEX_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5("
+        "name_normalized, content='patients', content_rowid='id', detail='none')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts_vocab USING fts5vocab(patients_fts, row)",
+    ],
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_patients_name_trgm ON patients USING gin (name_normalized gin_trgm_ops)",
+    ],
+}
+
+def create_patient_name_index(connection):
+    for statement in PATIENT_NAME_INDEX_DDL.get(connection.dialect.name, ()):
+        connection.exec_driver_sql(statement)
+
+@event.listens_for(Patient.__table__, "after_create")
+def _after_create_patients(target, connection, **kw):
+    create_patient_name_index(connection)
+
+@event.listens_for(Patient.__table__, "after_drop")
+def _after_drop_patients(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS patients_fts_vocab")
+        connection.exec_driver_sql("DROP TABLE IF EXISTS patients_fts")
+
+from datetime import datetime
+from sqlalchemy import Date, DateTime, LargeBinary, Text
 
 class Appointment(Base):
     __tablename__ = "appointments"
+    __table_args__ = (
+        Index("ix_appointments_doctor_id_start_time_end_time", "doctor_id", "start_time", "end_time"),
+        Index("ix_appointments_patient_id_start_time", "patient_id", "start_time"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     start_time = Column(DateTime)
     end_time = Column(DateTime)
+    status = Column(Enum(AppointmentStatus), default=AppointmentStatus.SCHEDULED)
+    # When it was booked, for the lead times in reports.py
+    created_at = Column(DateTime, default=datetime.now)
 
     doctor_id = Column(Integer, ForeignKey("doctors.id"))
     patient_id = Column(Integer, ForeignKey("patients.id"))
@@ -96,3 +159,103 @@ class Appointment(Base):
     patient = relationship("Patient", back_populates="appointments")
     office = relationship("Office")
     appointment_type = relationship("AppointmentType")
+
+class ReminderSent(Base):
+    __tablename__ = "reminders_sent"
+    __table_args__ = (UniqueConstraint("appointment_id", "kind"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    appointment_id = Column(Integer, ForeignKey("appointments.id"))
+    kind = Column(String)
+    sent_at = Column(DateTime)
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox_messages"
+    __table_args__ = (
+        Index("ix_outbox_messages_status_channel_next_attempt_at", "status", "channel", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    channel = Column(String)
+    recipient = Column(String)
+    body = Column(String)
+    appointment_id = Column(Integer, ForeignKey("appointments.id"), nullable=True)
+    status = Column(String)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime)
+    next_attempt_at = Column(DateTime)
+    sent_at = Column(DateTime, nullable=True)
+
+# Booked minutes per doctor/day/office/appointment type, kept up to date by occupancy.py
+class DailyOccupancy(Base):
+    __tablename__ = "daily_occupancy"
+    __table_args__ = (
+        UniqueConstraint("doctor_id", "day", "office_id", "appointment_type_id", name="uq_daily_occupancy"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    doctor_id = Column(Integer, ForeignKey("doctors.id"))
+    day = Column(Date)
+    office_id = Column(Integer, ForeignKey("offices.id"))
+    appointment_type_id = Column(Integer, ForeignKey("appointment_types.id"))
+    booked_minutes = Column(Integer, default=0)
+    appointment_count = Column(Integer, default=0)
+
+# Responses stored for Idempotency-Key replays when IDEMPOTENCY_STORE=database (idempotency.py)
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=True)
+    status_code = Column(Integer, nullable=True)
+    headers = Column(String, nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    locked_until = Column(DateTime)
+    expires_at = Column(DateTime, index=True)
+
+# Who read or wrote which patient, appointment or doctor (audit.py); rows are only ever inserted
+class AuditEntry(Base):
+    __tablename__ = "audit_log"
+    __table_args__ = (
+        Index("ix_audit_log_entity_record_id_at", "entity", "record_id", "at"),
+        Index("ix_audit_log_actor_at", "actor", "at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    at = Column(DateTime, index=True)
+    actor = Column(String)
+    # Clinic database of the record (tenancy.py), None for the default one
+    tenant = Column(String, nullable=True)
+    action = Column(String)
+    entity = Column(String)
+    record_id = Column(Integer)
+    method = Column(String, nullable=True)
+    path = Column(String, nullable=True)
+    client = Column(String, nullable=True)
+
+# Appointment change feed (changes.py): a row per appointment write, in the same transaction
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+    __table_args__ = (
+        Index("ix_change_log_doctor_id_seq", "doctor_id", "seq"),
+        # Sequence numbers are never reused, even if old rows are pruned
+        {"sqlite_autoincrement": True},
+    )
+
+    seq = Column(Integer, primary_key=True)
+    doctor_id = Column(Integer, ForeignKey("doctors.id"))
+    appointment_id = Column(Integer)
+    action = Column(String)
+    changed_at = Column(DateTime)
+
+# Weekly doctor reports (reports.py) of finished weeks, as served; week_start is a Monday
+class WeeklyReport(Base):
+    __tablename__ = "weekly_reports"
+    __table_args__ = (UniqueConstraint("doctor_id", "week_start"),)
+
+    id = Column(Integer, primary_key=True)
+    doctor_id = Column(Integer, ForeignKey("doctors.id"))
+    week_start = Column(Date)
+    generated_at = Column(DateTime)
+    body = Column(Text)
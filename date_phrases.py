@@ -0,0 +1,220 @@
+import re
+import unicodedata
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from config import DATE_PHRASE_CACHE_SIZE, DATE_PHRASE_MAX_WINDOWS
+
+# Spanish date and time phrases from the conversation ("¿puedo el jueves en la tarde?",
+# "mañana a las 10:30", "el 15 de marzo después de las 5") turned into candidate windows for
+# an availability lookup. Parsing is rule based on one precompiled pattern and does not
+# depend on the current date: a normalized phrase becomes a tuple of (days, times) parts that
+# is memoized, and only resolving those parts against `now` runs on every call.
+
+WEEKDAYS = {"lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3, "viernes": 4, "sabado": 5, "domingo": 6}
+MONTHS = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7, "agosto": 8,
+    "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+HOUR_WORDS = {
+    "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7, "ocho": 8, "nueve": 9,
+    "diez": 10, "once": 11, "doce": 12,
+}
+OFFSETS = {"hoy": 0, "manana": 1, "pasado manana": 2}
+FRACTIONS = {"y media": 30, "y cuarto": 15, "menos cuarto": -15}
+# Parts of the day as (start, end) minutes after midnight
+BUCKETS = {
+    "madrugada": (0, 7 * 60), "temprano": (7 * 60, 10 * 60), "manana": (7 * 60, 12 * 60),
+    "mediodia": (12 * 60, 14 * 60), "tarde": (14 * 60, 19 * 60), "noche": (19 * 60, 22 * 60),
+}
+WHOLE_DAY = (0, 24 * 60)
+# A clock time asks for appointments starting within this many minutes of it
+CLOCK_WINDOW_MINUTES = 60
+
+def _alternatives(words):
+    return "|".join(sorted(words, key=len, reverse=True))
+
+_MONTH = _alternatives(MONTHS)
+_MERIDIEM = r"a ?m|p ?m|hrs|hr|horas|de la manana|de la tarde|de la noche"
+_AT = r"(?:a )?(?:las? )?"
+
+def _clock_pattern(prefix):
+    return (
+        rf"(?:(?P<{prefix}_h>\d{{1,2}})(?:(?::|\.|h)(?P<{prefix}_m>\d{{2}}))?|(?P<{prefix}_w>{_alternatives(HOUR_WORDS)}))"
+        rf"(?: (?P<{prefix}_f>{_alternatives(FRACTIONS)}))?(?: ?(?P<{prefix}_mer>{_MERIDIEM}))?"
+    )
+
+# Clock times as (group prefix, prefix of the range end or None, kind)
+CLOCKS = (("from", "to", "range"), ("de", "a", "range"), ("after", None, "after"), ("before", None, "before"),
+          ("at", None, "at"), ("hm", None, "at"), ("mer", None, "at"))
+PATTERN = re.compile("|".join([
+    rf"\bentre {_AT}{_clock_pattern('from')} y {_AT}{_clock_pattern('to')}\b",
+    rf"\bde {_AT}{_clock_pattern('de')} a {_AT}{_clock_pattern('a')}\b",
+    rf"\bdespues de {_AT}{_clock_pattern('after')}\b",
+    rf"\bantes de {_AT}{_clock_pattern('before')}\b",
+    # Bare numbers are not clock times: they need "a las", minutes or a meridiem
+    rf"\b(?:a )?las? {_clock_pattern('at')}\b",
+    rf"\b(?P<hm_h>\d{{1,2}})(?::|\.|h)(?P<hm_m>\d{{2}})(?: ?(?P<hm_mer>{_MERIDIEM}))?\b",
+    r"\b(?P<mer_h>\d{1,2}) ?(?P<mer_mer>a ?m|p ?m|hrs|horas)\b",
+    r"\b(?P<numeric_day>\d{1,2})/(?P<numeric_month>\d{1,2})(?:/(?P<numeric_year>\d{2}|\d{4}))?\b",
+    # Not the start of a numeric date or clock time ("el 15/03", "el 10.30"), matched by the ones above
+    rf"\b(?:(?:el )?dia |el )(?P<day>\d{{1,2}})(?![/.:]?\d)(?: de (?P<month>{_MONTH}))?\b",
+    rf"\b(?P<month_day>\d{{1,2}}) de (?P<day_month>{_MONTH})\b",
+    rf"\b(?P<next>proximo |siguiente )?(?P<weekday>{_alternatives(WEEKDAYS)})"
+    r"(?P<next_after> que viene| proximo| de la (?:proxima|siguiente) semana)?\b",
+    r"\b(?P<next_week>(?:la )?(?:proxima|siguiente) semana|semana (?:que viene|proxima|entrante))\b",
+    r"\b(?P<this_week>esta semana)\b",
+    r"\b(?P<weekend>fin de semana|finde)\b",
+    rf"\b(?:(?:en|por|a|de) )?la (?P<bucket>manana|tarde|noche|madrugada)\b",
+    r"\b(?P<offset>pasado manana|hoy|manana)\b",
+    r"\b(?P<bare_bucket>tarde|noche|medio ?dia|temprano|madrugada)\b",
+]))
+# Alternatives ("el jueves o el viernes", "mañana, el lunes") are parts of their own; "y" only
+# separates them when it does not continue a clock time ("10 y media", "entre las 10 y las 12")
+SEPARATOR = re.compile(r",|;| o | u | y (?!media\b|cuarto\b|las? |\d)")
+
+ACCENTS = str.maketrans("áéíóúüñ", "aeiouun")
+PUNCTUATION = re.compile(r"[^a-z0-9:./\s]|(?<!\d)[:./]|[:./](?!\d)")
+
+def normalize(text: str):
+    """Lowercase without accents or punctuation, keeping the ':', '.' and '/' inside numbers."""
+    text = text.lower().translate(ACCENTS)
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return " ".join(PUNCTUATION.sub(" ", text).split())
+
+def _minutes(group, prefix, bucket):
+    """Minutes after midnight of the clock time captured with `prefix`, or None."""
+    word = group.get(f"{prefix}_w")
+    hour = HOUR_WORDS[word] if word else int(group[f"{prefix}_h"])
+    minute = int(group.get(f"{prefix}_m") or 0)
+    meridiem = (group.get(f"{prefix}_mer") or "").replace(" ", "")
+    if hour > 23 or minute > 59:
+        return None
+    if hour < 12 and (meridiem in ("pm", "delatarde", "delanoche") or (not meridiem and bucket in ("tarde", "noche"))):
+        hour += 12
+    elif hour == 12 and meridiem == "am":
+        hour = 0
+    elif not meridiem and bucket is None and 1 <= hour <= 6:
+        # Office hours: "a las 4" is in the afternoon
+        hour += 12
+    return hour * 60 + minute + FRACTIONS.get(group.get(f"{prefix}_f"), 0)
+
+def _times(group, bucket):
+    for prefix, end_prefix, kind in CLOCKS:
+        if group.get(f"{prefix}_h") or group.get(f"{prefix}_w"):
+            start = _minutes(group, prefix, bucket)
+            if kind == "range":
+                end = _minutes(group, end_prefix, bucket)
+            elif kind == "before":
+                start, end = BUCKETS["temprano"][0], start
+            elif kind == "after":
+                end = WHOLE_DAY[1]
+            else:
+                end = start + CLOCK_WINDOW_MINUTES if start is not None else None
+            if start is not None and end is not None and start < end:
+                return max(start, 0), min(end, WHOLE_DAY[1])
+            return None
+
+def _day(group):
+    if group["weekday"]:
+        return "weekday", WEEKDAYS[group["weekday"]], bool(group["next"] or group["next_after"])
+    if group["offset"]:
+        return "offset", OFFSETS[group["offset"]]
+    if group["next_week"]:
+        return "week", 1
+    if group["this_week"]:
+        return "week", 0
+    if group["weekend"]:
+        return "weekend",
+    if group["day"]:
+        return "date", int(group["day"]), MONTHS.get(group["month"]), None
+    if group["month_day"]:
+        return "date", int(group["month_day"]), MONTHS[group["day_month"]], None
+    if group["numeric_day"]:
+        year = int(group["numeric_year"]) if group["numeric_year"] else None
+        return "date", int(group["numeric_day"]), int(group["numeric_month"]), year + 2000 if year and year < 100 else year
+    return None
+
+def _part(segment: str):
+    matches = [match.groupdict() for match in PATTERN.finditer(segment)]
+    # The part of the day also decides "a las 5 de la tarde" and is only a window by itself
+    bucket = next(((g["bucket"] or g["bare_bucket"]).replace(" ", "") for g in matches
+                   if g["bucket"] or g["bare_bucket"]), None)
+    days = tuple(day for day in map(_day, matches) if day)
+    times = tuple(window for window in (_times(g, bucket) for g in matches) if window)
+    return days, times or ((BUCKETS[bucket],) if bucket else ())
+
+@lru_cache(maxsize=DATE_PHRASE_CACHE_SIZE)
+def parse(normalized: str):
+    """((days, times), ...) for each alternative in a normalize()d phrase.
+
+    A part without days takes those of the closest part before it (else after it), and a part
+    without times those of the closest part after it (else before it): "el jueves o el viernes
+    en la tarde", "mañana a las 10 o a las 12".
+    """
+    parts = [part for part in map(_part, SEPARATOR.split(normalized)) if part[0] or part[1]]
+
+    def closest(i, field, after_first):
+        before, after = range(i - 1, -1, -1), range(i + 1, len(parts))
+        order = [*after, *before] if after_first else [*before, *after]
+        return next((parts[j][field] for j in order if parts[j][field]), ())
+
+    return tuple(
+        (days or closest(i, 0, after_first=False), times or closest(i, 1, after_first=True))
+        for i, (days, times) in enumerate(parts)
+    )
+
+def _dates(day, today):
+    """[(date, days to move it forward if it is already past)] of one day spec."""
+    kind = day[0]
+    if kind == "offset":
+        return [(today + timedelta(days=day[1]), 0)]
+    if kind == "weekday":
+        ahead = (day[1] - today.weekday()) % 7
+        if ahead == 0 and day[2]:
+            ahead = 7
+        return [(today + timedelta(days=ahead), 7 if ahead == 0 else 0)]
+    if kind == "week":
+        first = today + timedelta(days=7 - today.weekday()) if day[1] else today
+        return [(first + timedelta(days=i), 0) for i in range(7 - first.weekday())]
+    if kind == "weekend":
+        if today.weekday() == 6:
+            return [(today, 0)]
+        saturday = today + timedelta(days=5 - today.weekday())
+        return [(saturday, 0), (saturday + timedelta(days=1), 0)]
+    _, number, month, year = day
+    candidates = [(year, month)] if year else (
+        [(today.year, month), (today.year + 1, month)] if month else
+        [(today.year + (today.month + i - 1) // 12, (today.month + i - 1) % 12 + 1) for i in range(3)]
+    )
+    for year, month in candidates:
+        try:
+            value = today.replace(year=year, month=month, day=number)
+        except ValueError:
+            continue
+        if value >= today or len(candidates) == 1:
+            return [(value, 0)]
+    return []
+
+def _window(day, start, end, now):
+    midnight = datetime.combine(day, time.min)
+    start, end = max(midnight + timedelta(minutes=start), now), midnight + timedelta(minutes=end)
+    return (start, end) if start < end else None
+
+def resolve(parts, now: datetime):
+    """Sorted (start, end) datetimes from now on for parse()d parts."""
+    windows = set()
+    for days, times in parts:
+        # Only a time of day: today, or tomorrow once it has passed
+        dates = [date for day in days for date in _dates(day, now.date())] if days else [(now.date(), 1)]
+        for day, roll in dates:
+            for start, end in times or (WHOLE_DAY,):
+                window = _window(day, start, end, now)
+                if window is None and roll:
+                    window = _window(day + timedelta(days=roll), start, end, now)
+                if window:
+                    windows.add(window)
+    return sorted(windows)[:DATE_PHRASE_MAX_WINDOWS]
+
+def windows(text: str, now: datetime = None):
+    return resolve(parse(normalize(text)), (now or datetime.now()).replace(tzinfo=None))
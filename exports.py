@@ -0,0 +1,111 @@
+import json
+from datetime import datetime
+from itertools import islice
+import database.models as models
+import audit
+from config import EXPORT_BATCH_SIZE
+
+# A doctor's agenda as an iCalendar feed (RFC 5545) or a FHIR R4 Appointment Bundle. Both
+# render rows of crud.get_export_rows, which streams them from a server-side cursor, and
+# yield the output one batch of EXPORT_BATCH_SIZE appointments at a time, so an export of
+# years of history never builds the whole document in memory; each batch's appointments and
+# patients are recorded as read in the audit log. Times are the API's local
+# times: floating in iCalendar, with the server's UTC offset in FHIR, which requires one.
+
+PRODID = "-//BettyIA//Agenda//ES"
+UID_DOMAIN = "bettyia"
+FHIR_STATUS = {models.AppointmentStatus.ATTENDED: "fulfilled", models.AppointmentStatus.NO_SHOW: "noshow"}
+# Appointments are never cancelled, only deleted, so a missed one is the only event that did not
+# take place; outcomes are only recorded once an appointment started, so it is never upcoming
+ICS_STATUS = {models.AppointmentStatus.NO_SHOW: ("CANCELLED", "No asistió")}
+
+def _batches(rows):
+    rows = iter(rows)
+    while batch := list(islice(rows, EXPORT_BATCH_SIZE)):
+        # Core rows never pass through audit's ORM load hook, so what is exported is recorded here
+        for row in batch:
+            audit.log.read("appointments", row.id)
+            if row.patient_id is not None:
+                audit.log.read("patients", row.patient_id)
+        yield batch
+
+def _ics_text(value):
+    text = str(value or "")
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+def _ics_line(name, value):
+    """A content line folded at 75 octets, as RFC 5545 asks."""
+    line = f"{name}:{value}".encode()
+    parts = []
+    while len(line) > 75:
+        cut = 75 if not parts else 74
+        # Never split a UTF-8 sequence
+        while line[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(line[:cut].decode())
+        line = line[cut:]
+    parts.append(line.decode())
+    return "\r\n ".join(parts) + "\r\n"
+
+def _ics_time(value: datetime):
+    return value.strftime("%Y%m%dT%H%M%S")
+
+def _event(row):
+    lines = [
+        "BEGIN:VEVENT\r\n",
+        _ics_line("UID", f"appointment-{row.id}@{UID_DOMAIN}"),
+        # Deterministic, so an unchanged agenda renders the same bytes
+        _ics_line("DTSTAMP", _ics_time(row.created_at or row.start_time)),
+        _ics_line("DTSTART", _ics_time(row.start_time)),
+        _ics_line("DTEND", _ics_time(row.end_time)),
+        _ics_line("SUMMARY", _ics_text(" - ".join(filter(None, (row.appointment_type_name, row.patient_name))))),
+    ]
+    status, comment = ICS_STATUS.get(row.status, ("CONFIRMED", None))
+    lines.append(_ics_line("STATUS", status))
+    if comment:
+        lines.append(_ics_line("COMMENT", _ics_text(comment)))
+    if row.office_name or row.office_address:
+        lines.append(_ics_line("LOCATION", _ics_text(", ".join(filter(None, (row.office_name, row.office_address))))))
+    lines.append("END:VEVENT\r\n")
+    return "".join(lines)
+
+def ics(doctor, rows):
+    yield (
+        "BEGIN:VCALENDAR\r\nVERSION:2.0\r\n" + _ics_line("PRODID", PRODID) + "CALSCALE:GREGORIAN\r\n"
+        + _ics_line("X-WR-CALNAME", _ics_text(doctor.full_name))
+    )
+    for batch in _batches(rows):
+        yield "".join(map(_event, batch))
+    yield "END:VCALENDAR\r\n"
+
+def _fhir_time(value: datetime):
+    return value.astimezone().isoformat()
+
+def _reference(kind, id, display):
+    return {"actor": {"reference": f"{kind}/{id}", "display": display}, "status": "accepted"}
+
+def _fhir_entry(doctor, row):
+    resource = {
+        "resourceType": "Appointment", "id": str(row.id),
+        "status": FHIR_STATUS.get(row.status, "booked"),
+        "start": _fhir_time(row.start_time), "end": _fhir_time(row.end_time),
+        "minutesDuration": int((row.end_time - row.start_time).total_seconds() // 60),
+        "participant": [_reference("Practitioner", doctor.id, doctor.full_name)],
+    }
+    if row.created_at:
+        resource["created"] = row.created_at.date().isoformat()
+    if row.appointment_type_name:
+        resource["appointmentType"] = {"text": row.appointment_type_name}
+    if row.patient_id is not None:
+        resource["participant"].append(_reference("Patient", row.patient_id, row.patient_name))
+    if row.office_id is not None:
+        resource["participant"].append(_reference("Location", row.office_id, row.office_name))
+    return json.dumps({"fullUrl": f"Appointment/{row.id}", "resource": resource}, separators=(",", ":"))
+
+def fhir_bundle(doctor, rows):
+    yield '{"resourceType":"Bundle","type":"searchset","entry":['
+    separator = ""
+    for batch in _batches(rows):
+        yield separator + ",".join(_fhir_entry(doctor, row) for row in batch)
+        separator = ","
+    yield "]}"
@@ -0,0 +1,124 @@
+import asyncio
+import math
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from config import HASH_POOL_SIZE, HASH_QUEUE_LIMIT, BCRYPT_ROUNDS, BCRYPT_TARGET_MS, BCRYPT_MIN_ROUNDS
+
+MIN_ROUNDS, MAX_ROUNDS = 4, 31
+
+class HashingPoolSaturated(Exception):
+    pass
+
+# Worker side: runs in the pool processes (or inline when the pool size is 0)
+@lru_cache(maxsize=None)
+def _context(rounds: int):
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+def _hash(password: str, rounds: int):
+    return _context(rounds).hash(password)
+
+def _verify(password: str, hashed_password: str):
+    # The cost factor is read from the hash itself
+    return _context(MIN_ROUNDS).verify(password, hashed_password)
+
+def calibrate(target_ms: float, min_rounds: int = MIN_ROUNDS, probe_rounds: int = 8):
+    """Largest bcrypt cost whose hash time stays within target_ms on this machine."""
+    elapsed = min(_timed_hash(probe_rounds) for _ in range(3))
+    # Each extra round doubles the work
+    rounds = probe_rounds + math.floor(math.log2(target_ms / 1000 / elapsed))
+    return max(min_rounds, min(MAX_ROUNDS, rounds))
+
+def _timed_hash(rounds):
+    started = time.perf_counter()
+    _hash("calibration", rounds)
+    return time.perf_counter() - started
+
+class HashingPool:
+    """Bounded process pool for bcrypt so hashing never holds the GIL or the event loop.
+
+    At most `queue_limit` hashes may be queued or running; past that, submissions raise
+    HashingPoolSaturated (turned into a 503 by main).
+    """
+
+    def __init__(self, size: int, queue_limit: int, rounds: int):
+        self.size = size
+        self.queue_limit = queue_limit
+        self.rounds = rounds
+        self.pending = 0
+        self.rejected = 0
+        self.completed = 0
+        self.latencies = deque(maxlen=1024)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._executor is None and self.size > 0:
+                self._executor = ProcessPoolExecutor(self.size, mp_context=multiprocessing.get_context("spawn"))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.queue_limit:
+                self.rejected += 1
+                raise HashingPoolSaturated()
+            self.pending += 1
+        submitted = time.perf_counter()
+        if self.size > 0:
+            self.start()
+            future = self._executor.submit(fn, *args)
+        else:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+        future.add_done_callback(lambda _: self._done(submitted))
+        return future
+
+    def _done(self, submitted):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+            self.latencies.append(time.perf_counter() - submitted)
+
+    def hash(self, password: str):
+        return self._submit(_hash, password, self.rounds).result()
+
+    def verify(self, password: str, hashed_password: str):
+        return self._submit(_verify, password, hashed_password).result()
+
+    async def hash_async(self, password: str):
+        return await asyncio.wrap_future(self._submit(_hash, password, self.rounds))
+
+    async def verify_async(self, password: str, hashed_password: str):
+        return await asyncio.wrap_future(self._submit(_verify, password, hashed_password))
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2) if latencies else None
+
+        return {
+            "workers": self.size, "rounds": self.rounds,
+            "queue_depth": self.pending, "queue_limit": self.queue_limit,
+            "completed": self.completed, "rejected": self.rejected,
+            "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99)},
+        }
+
+pool = HashingPool(HASH_POOL_SIZE, HASH_QUEUE_LIMIT, BCRYPT_ROUNDS)
+
+def calibrate_pool():
+    if BCRYPT_TARGET_MS:
+        pool.rounds = calibrate(BCRYPT_TARGET_MS, BCRYPT_MIN_ROUNDS)
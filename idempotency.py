@@ -0,0 +1,216 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from database import database, models
+from cache import TTLCache
+import tenancy
+from config import (
+    IDEMPOTENCY_STORE, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_MAX_BODY_BYTES,
+    IDEMPOTENCY_LOCK_SECONDS
+)
+
+# Idempotency-Key support for POST endpoints. The first request with a key runs normally and
+# its response (unless it is a 5xx) is stored under (method, path, key); a retry with the same
+# key and body gets the stored response back without reaching the handler. A retry that
+# arrives while the first request is still running gets a 409, and a different body a 422.
+
+PENDING = "pending"
+
+class StoredResponse:
+    __slots__ = ("fingerprint", "status", "headers", "body")
+
+    def __init__(self, fingerprint: str, status: int, headers: list, body: bytes):
+        self.fingerprint = fingerprint
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+class MemoryStore:
+    """Bounded LRU of stored responses with TTL eviction, plus the keys currently in flight."""
+
+    blocking = False
+
+    def __init__(self, maxsize: int, ttl: float, lock_seconds: float):
+        self.lock_seconds = lock_seconds
+        self._responses = TTLCache(maxsize, ttl)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """Returns the stored response, PENDING if the key is in flight, or None after claiming it."""
+        with self._lock:
+            stored = self._responses.get(key)
+            if stored is not None:
+                return stored
+            if self._pending.get(key, 0) > time.monotonic():
+                return PENDING
+            self._pending[key] = time.monotonic() + self.lock_seconds
+            return None
+
+    def complete(self, key, stored: StoredResponse):
+        with self._lock:
+            self._responses.set(key, stored)
+            self._pending.pop(key, None)
+
+    def release(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+class DatabaseStore:
+    """Same contract as MemoryStore on the idempotency_keys table, shared by every worker process.
+
+    A claim is a row without a status; expired rows are purged every `purge_every` claims.
+    """
+
+    blocking = True
+
+    def __init__(self, ttl: float, lock_seconds: float, purge_every: int = 500):
+        self.ttl = timedelta(seconds=ttl)
+        self.lock = timedelta(seconds=lock_seconds)
+        self.purge_every = purge_every
+        self._claims = 0
+
+    def begin(self, key):
+        now = datetime.now()
+        db = database.SessionLocal()
+        try:
+            self._claims += 1
+            if self._claims % self.purge_every == 0:
+                db.query(models.IdempotencyKey).filter(models.IdempotencyKey.expires_at < now).delete()
+            row = db.get(models.IdempotencyKey, key)
+            if row is not None and row.expires_at > now:
+                if row.status_code is not None:
+                    return StoredResponse(row.fingerprint, row.status_code, json.loads(row.headers), row.body)
+                if row.locked_until > now:
+                    return PENDING
+            if row is not None:
+                db.delete(row)
+                db.flush()
+            db.add(models.IdempotencyKey(key=key, locked_until=now + self.lock, expires_at=now + self.ttl))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another worker claimed it first
+                db.rollback()
+                return PENDING
+            return None
+        finally:
+            db.close()
+
+    def complete(self, key, stored: StoredResponse):
+        db = database.SessionLocal()
+        try:
+            db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == key).update({
+                "fingerprint": stored.fingerprint, "status_code": stored.status,
+                "headers": json.dumps(stored.headers), "body": stored.body,
+                "expires_at": datetime.now() + self.ttl,
+            })
+            db.commit()
+        finally:
+            db.close()
+
+    def release(self, key):
+        db = database.SessionLocal()
+        try:
+            db.query(models.IdempotencyKey).filter(
+                models.IdempotencyKey.key == key, models.IdempotencyKey.status_code.is_(None)
+            ).delete()
+            db.commit()
+        finally:
+            db.close()
+
+def make_store(kind: str):
+    if kind == "database":
+        return DatabaseStore(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LOCK_SECONDS)
+    return MemoryStore(IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LOCK_SECONDS)
+
+store = make_store(IDEMPOTENCY_STORE)
+
+async def _json_response(send, status, detail, headers=()):
+    body = json.dumps({"detail": detail}).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+class IdempotencyMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def _store(self, method, *args):
+        if store.blocking:
+            return await run_in_threadpool(method, *args)
+        return method(*args)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        idempotency_key = dict(scope["headers"]).get(b"idempotency-key")
+        if not idempotency_key:
+            return await self.app(scope, receive, send)
+        key = f"POST {scope['path']}?{scope['query_string'].decode()} {idempotency_key.decode('latin-1')}"
+        if tenancy.name():
+            key = f"{tenancy.name()} {key}"
+
+        digest = hashlib.sha256()
+        body_done = False
+
+        async def hashing_receive():
+            nonlocal body_done
+            message = await receive()
+            if message["type"] == "http.request":
+                digest.update(message.get("body", b""))
+                body_done = not message.get("more_body", False)
+            return message
+
+        async def drain():
+            # The fingerprint covers the whole body, even the part the handler did not read
+            while not body_done:
+                if (await hashing_receive())["type"] != "http.request":
+                    break
+
+        stored = await self._store(store.begin, key)
+        if stored is PENDING:
+            return await _json_response(send, 409, "A request with this Idempotency-Key is in progress",
+                                        [(b"retry-after", b"1")])
+        if stored is not None:
+            await drain()
+            if digest.hexdigest() != stored.fingerprint:
+                return await _json_response(send, 422, "Idempotency-Key was already used with a different body")
+            await send({"type": "http.response.start", "status": stored.status, "headers": [
+                (name.encode("latin-1"), value.encode("latin-1")) for name, value in stored.headers
+            ] + [(b"idempotent-replayed", b"true")]})
+            await send({"type": "http.response.body", "body": stored.body})
+            return
+
+        response = {"status": 500, "headers": [], "body": bytearray(), "cacheable": True}
+
+        async def capturing_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    (name.decode("latin-1"), value.decode("latin-1")) for name, value in message.get("headers", [])
+                ]
+            elif message["type"] == "http.response.body" and response["cacheable"]:
+                response["body"] += message.get("body", b"")
+                if len(response["body"]) > IDEMPOTENCY_MAX_BODY_BYTES:
+                    response["cacheable"] = False
+                    response["body"] = bytearray()
+            await send(message)
+
+        try:
+            await self.app(scope, hashing_receive, capturing_send)
+            await drain()
+        except BaseException:
+            await self._store(store.release, key)
+            raise
+        if response["status"] >= 500 or not response["cacheable"]:
+            await self._store(store.release, key)
+        else:
+            await self._store(store.complete, key, StoredResponse(
+                digest.hexdigest(), response["status"], response["headers"], bytes(response["body"])
+            ))
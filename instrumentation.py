@@ -0,0 +1,285 @@
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from config import PROFILE_SLOW_REQUESTS_MS, PROFILE_INTERVAL_MS, PROFILE_DIR
+
+# Per-request SQL and latency metrics. The ASGI middleware binds a RequestStats to the
+# request's context; engine events and the pool add to it from whichever thread runs the
+# handler (the context is copied into the threadpool). Totals are kept per route template
+# and rendered in the Prometheus text format by `render()`.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_MAX_LENGTH = 200
+
+class RequestStats:
+    __slots__ = ("queries", "db_time", "pool_wait", "slowest", "slowest_statement", "threads", "samples")
+
+    def __init__(self, profile: bool):
+        self.queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.threads = set()
+        self.samples = Counter() if profile else None
+
+class EndpointMetrics:
+    __slots__ = ("buckets", "count", "latency", "statuses", "queries", "db_time", "pool_wait",
+                 "slowest", "slowest_statement")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.latency = 0.0
+        self.statuses = Counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+_current = ContextVar("request_stats", default=None)
+_endpoints = {}
+_lock = threading.Lock()
+# Queries and pool waits from any source, request or background worker
+totals = {"queries": 0, "db_time": 0.0, "pool_wait": 0.0}
+
+def current():
+    return _current.get()
+
+def _normalize(statement):
+    statement = re.sub(r"\s+", " ", statement).strip()
+    return statement[:STATEMENT_MAX_LENGTH]
+
+# Engine and pool hooks
+def instrument_engine(engine):
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    # The start time is kept on the statement's execution context, not the pooled connection,
+    # so a statement that fails (and never reaches after_cursor_execute) leaves nothing behind
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_started
+        with _lock:
+            totals["queries"] += 1
+            totals["db_time"] += elapsed
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+            stats.threads.add(threading.get_ident())
+            if elapsed > stats.slowest:
+                stats.slowest = elapsed
+                stats.slowest_statement = statement
+
+    return engine
+
+def _record_pool_wait(elapsed):
+    with _lock:
+        totals["pool_wait"] += elapsed
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait += elapsed
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            _record_pool_wait(time.perf_counter() - started)
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            _record_pool_wait(time.perf_counter() - started)
+
+def _observe(method, route, status, elapsed, stats):
+    with _lock:
+        metrics = _endpoints.get((method, route))
+        if metrics is None:
+            metrics = _endpoints[(method, route)] = EndpointMetrics()
+        metrics.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        metrics.count += 1
+        metrics.latency += elapsed
+        metrics.statuses[status] += 1
+        metrics.queries += stats.queries
+        metrics.db_time += stats.db_time
+        metrics.pool_wait += stats.pool_wait
+        if stats.slowest > metrics.slowest:
+            metrics.slowest = stats.slowest
+            metrics.slowest_statement = _normalize(stats.slowest_statement)
+
+def reset():
+    with _lock:
+        _endpoints.clear()
+
+class InstrumentationMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(profiler.enabled)
+        token = _current.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        profiler.register(stats)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            profiler.unregister(stats)
+            _current.reset(token)
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            _observe(scope["method"], route, status, elapsed, stats)
+            if stats.samples is not None and elapsed * 1000 >= profiler.threshold_ms:
+                profiler.dump(scope["method"], route, elapsed, stats.samples)
+
+# Sampling profiler
+def _fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+class SlowRequestProfiler:
+    """Samples the stacks of the threads serving in-flight requests every `interval_ms`.
+
+    Requests slower than `threshold_ms` are written to `directory` in the collapsed-stack
+    format ("frame;frame;frame count" per line) read by flamegraph.pl and speedscope. A
+    sync handler's thread is known from its first query, so time before that is not sampled.
+    """
+
+    def __init__(self, threshold_ms: float, interval_ms: float, directory: str):
+        self.threshold_ms = threshold_ms
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self.enabled = False
+        self.dumped = deque(maxlen=100)
+        self._active = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, stats):
+        if stats.samples is not None:
+            self._active.add(stats)
+
+    def unregister(self, stats):
+        self._active.discard(stats)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for stats in list(self._active):
+                for thread_id in list(stats.threads):
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id != own:
+                        stats.samples[_fold(frame)] += 1
+
+    def dump(self, method, route, elapsed, samples):
+        if not samples:
+            return None
+        name = re.sub(r"[^A-Za-z0-9]+", "_", f"{method} {route}").strip("_")
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{elapsed * 1000:.0f}ms.folded")
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self.dumped.append(path)
+        return path
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self.enabled = True
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.enabled = False
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+profiler = SlowRequestProfiler(PROFILE_SLOW_REQUESTS_MS, PROFILE_INTERVAL_MS, PROFILE_DIR)
+
+# Prometheus text exposition
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def render():
+    with _lock:
+        endpoints = sorted(_endpoints.items())
+        lines = [
+            "# HELP bettyia_request_duration_seconds Request latency by route.",
+            "# TYPE bettyia_request_duration_seconds histogram",
+        ]
+        for (method, route), m in endpoints:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), m.buckets):
+                cumulative += count
+                lines.append(f"bettyia_request_duration_seconds_bucket{_labels(method=method, route=route, le=bound)} {cumulative}")
+            lines.append(f"bettyia_request_duration_seconds_sum{_labels(method=method, route=route)} {m.latency}")
+            lines.append(f"bettyia_request_duration_seconds_count{_labels(method=method, route=route)} {m.count}")
+        lines += ["# HELP bettyia_requests_total Requests by route and status.", "# TYPE bettyia_requests_total counter"]
+        for (method, route), m in endpoints:
+            for status, count in sorted(m.statuses.items()):
+                lines.append(f"bettyia_requests_total{_labels(method=method, route=route, status=status)} {count}")
+        for name, attribute, kind, help_text in (
+            ("bettyia_request_queries_total", "queries", "counter", "SQL statements executed by requests."),
+            ("bettyia_request_db_seconds_total", "db_time", "counter", "Time spent executing SQL by requests."),
+            ("bettyia_request_pool_wait_seconds_total", "pool_wait", "counter",
+             "Time requests waited to check out a pooled connection."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for (method, route), m in endpoints:
+                lines.append(f"{name}{_labels(method=method, route=route)} {getattr(m, attribute)}")
+        lines += [
+            "# HELP bettyia_request_slowest_query_seconds Slowest SQL statement seen per route.",
+            "# TYPE bettyia_request_slowest_query_seconds gauge",
+        ]
+        for (method, route), m in endpoints:
+            if m.slowest_statement is not None:
+                labels = _labels(method=method, route=route, statement=m.slowest_statement)
+                lines.append(f"bettyia_request_slowest_query_seconds{labels} {m.slowest}")
+        for name, key, help_text in (
+            ("bettyia_db_queries_total", "queries", "SQL statements executed, including background workers."),
+            ("bettyia_db_query_seconds_total", "db_time", "Time spent executing SQL, including background workers."),
+            ("bettyia_db_pool_wait_seconds_total", "pool_wait", "Time spent waiting for pooled connections."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {totals[key]}"]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,28 @@
+import threading
+from contextlib import contextmanager
+
+class StripedLock:
+    """A fixed pool of locks; keys that hash to the same stripe are serialized.
+
+    Works with any lock factory (threading.Lock, asyncio.Lock) since callers use the
+    returned lock directly as a (async) context manager.
+    """
+
+    def __init__(self, stripes: int, factory=threading.Lock):
+        self._locks = [factory() for _ in range(stripes)]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    @contextmanager
+    def hold_many(self, keys):
+        # Stripes are always taken in index order so two callers cannot deadlock (threading locks only)
+        held = []
+        try:
+            for stripe in sorted({hash(key) % len(self._locks) for key in keys}):
+                self._locks[stripe].acquire()
+                held.append(self._locks[stripe])
+            yield
+        finally:
+            for lock in reversed(held):
+                lock.release()
@@ -1,53 +1,217 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, HTTPException, Header
-from sqlalchemy.orm import Session
-from database import models, database
-import schemas, crud
-from config import ADMIN_USERNAME, ADMIN_PASSWORD, ADMIN_SECRET
+from functools import partial
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+from fastapi import FastAPI, Depends, HTTPException, Header, Request, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.orm import Session, configure_mappers
+from database import models, database, bootstrap
+import schemas, crud, availability, booking_index, hashing, cache, bulk_import, pagination
+import reminders, outbox, instrumentation, occupancy, idempotency, series, patient_search, startup, tokens
+import date_phrases, audit, tenancy, reports, changes, exports
+from auth import unauthorized, current_user, require_admin
+from config import (
+    ADMIN_USERNAME, ADMIN_PASSWORD, ADMIN_PASSWORD_HASH, ADMIN_BOOTSTRAP, FAST_START,
+    MAX_AVAILABILITY_DAYS, EARLIEST_SLOTS_MAX, ASYNC_DB, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, EXPORT_BATCH_SIZE,
+    REMINDERS_ENABLED, OUTBOX_ENABLED, PROFILE_SLOW_REQUESTS_MS, SERIES_MAX_OCCURRENCES, TOKEN_TTL_SECONDS,
+    AUDIT_ENABLED
+)
 
-models.Base.metadata.create_all(bind=database.engine)
+def load_index(loader):
+    def step():
+        db = database.SessionLocal()
+        try:
+            loader(db)
+        finally:
+            db.close()
+    return step
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # on startup
+    if tenancy.tenants.enabled and ASYNC_DB:
+        raise RuntimeError("TENANTS is not supported with ASYNC_DB")
+    if not FAST_START:
+        bootstrap.init_schema(database.engine)
+    warmup_steps = [("mappers", configure_mappers), ("booking_index", load_index(booking_index.index.load)),
+                    ("patient_vocabulary", load_index(patient_search.vocabulary.load))]
+    if FAST_START:
+        # Hashes use BCRYPT_ROUNDS until the calibration is done
+        warmup_steps.append(("bcrypt_calibration", hashing.calibrate_pool))
+    else:
+        hashing.calibrate_pool()
+    hashing.pool.start()
+    if AUDIT_ENABLED:
+        audit.log.start()
     db = database.SessionLocal()
-    admin_user = crud.get_user_by_username(db, username=ADMIN_USERNAME)
-    if not admin_user:
-        user_in = schemas.UserCreate(username=ADMIN_USERNAME, password=ADMIN_PASSWORD)
-        crud.create_user(db, user_in)
+    if ADMIN_BOOTSTRAP:
+        bootstrap.ensure_admin(db, ADMIN_USERNAME, ADMIN_PASSWORD, ADMIN_PASSWORD_HASH)
+    if REMINDERS_ENABLED:
+        # Only the next REMINDER_LOOKAHEAD_HOURS are loaded, so this stays in the foreground
+        reminders.scheduler.load(db)
+        reminders.scheduler.start()
     db.close()
+    cache.doctor_profiles.clear()
+    if FAST_START:
+        startup.warmup.start(warmup_steps)
+    else:
+        startup.warmup.run(warmup_steps)
+    if OUTBOX_ENABLED:
+        await outbox.dispatcher.start()
+    if PROFILE_SLOW_REQUESTS_MS:
+        instrumentation.profiler.start()
     yield
     # on shutdown
+    startup.warmup.join()
+    instrumentation.profiler.stop()
+    if OUTBOX_ENABLED:
+        await outbox.dispatcher.stop()
+    if REMINDERS_ENABLED:
+        reminders.scheduler.stop()
+    # Last, so what the workers above did is in the batch written on the way out
+    audit.log.stop()
+    tenancy.tenants.close_all()
+    hashing.pool.shutdown()
 
 app = FastAPI(lifespan=lifespan)
+# The last middleware added runs first, so replays are measured too, and every other
+# middleware sees the request's clinic
+app.add_middleware(audit.AuditMiddleware)
+app.add_middleware(idempotency.IdempotencyMiddleware)
+app.add_middleware(instrumentation.InstrumentationMiddleware)
+app.add_middleware(tenancy.TenantMiddleware)
+
+if ASYNC_DB:
+    # Registered first so the async handlers take precedence over the sync ones below; only
+    # imported in async mode, which keeps the async engine modules off the default startup
+    import async_routes
+    app.include_router(async_routes.router)
+
+@app.exception_handler(hashing.HashingPoolSaturated)
+def hashing_pool_saturated(request, exc):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, try again"}, headers={"Retry-After": "1"})
 
 def get_db():
+    db = tenancy.session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# The audit log and the outbox workers' view stay in the default database, whatever the clinic
+def get_default_db():
     db = database.SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+# Keyset page as JSON, or with format=ndjson every matching row streamed in batches
+def list_response(query, columns, schema, cursor, limit, format):
+    try:
+        if format == "ndjson":
+            rows = pagination.after(query, columns, cursor).yield_per(EXPORT_BATCH_SIZE)
+            return StreamingResponse(pagination.ndjson(rows, schema), media_type="application/x-ndjson")
+        return pagination.page(query, columns, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 # Root endpoint
 @app.get("/")
 def read_root():
     return {"message": "Welcome to BettyIA"}
 
-# User endpoints
-@app.post("/users/", response_model=schemas.User)
+# Probes: liveness only needs the event loop; readiness needs the database, and fails if the
+# startup warmup (startup.py) did, which with FAST_START may still be running when traffic starts
+@app.get("/healthz")
+async def read_liveness():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def read_readiness(db: Session = Depends(get_db)):
+    stats = startup.warmup.stats()
+    try:
+        db.execute(text("SELECT 1"))
+        stats["database"] = True
+    except Exception:
+        stats["database"] = False
+    ready = stats["database"] and stats["error"] is None
+    return JSONResponse(status_code=200 if ready else 503, content=dict(stats, status="ready" if ready else "unavailable"))
+
+# User endpoints: panel accounts are provisioned by an operator, never self-registered
+@app.post("/users/", response_model=schemas.User, dependencies=[Depends(require_admin)])
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     db_user = crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     return crud.create_user(db=db, user=user)
 
-# Admin endpoint
-@app.get("/admin/")
-def read_admin_secret(admin_secret: str = Header(None)):
-    if admin_secret != ADMIN_SECRET:
-        raise HTTPException(status_code=403, detail="Forbidden")
+# Doctor panel login: a signed token for the auth.current_user dependency
+@app.post("/token", response_model=schemas.Token)
+def login(credentials: schemas.Login, db: Session = Depends(get_db)):
+    db_user = crud.get_user_by_username(db, username=credentials.username)
+    if db_user is None or not crud.verify_password(credentials.password, db_user.hashed_password):
+        raise unauthorized("Incorrect username or password")
+    token, _ = tokens.authority.issue(db_user.id, db_user.username, tenant=tenancy.name())
+    return {"access_token": token, "expires_in": int(TOKEN_TTL_SECONDS)}
+
+@app.post("/token/revoke", status_code=204)
+def logout(claims: tokens.Claims = Depends(current_user)):
+    tokens.authority.revoke(claims)
+    return Response(status_code=204)
+
+# Admin endpoints
+@app.get("/admin/", dependencies=[Depends(require_admin)])
+def read_admin_secret():
     return {"message": "Welcome, admin!"}
 
+@app.get("/admin/metrics/hashing", dependencies=[Depends(require_admin)])
+def read_hashing_metrics():
+    return hashing.pool.stats()
+
+@app.get("/metrics", dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+def read_metrics():
+    return PlainTextResponse(instrumentation.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/metrics/outbox", dependencies=[Depends(require_admin)])
+def read_outbox_metrics(db: Session = Depends(get_default_db)):
+    return outbox.dispatcher.stats(db)
+
+@app.get("/admin/metrics/tenants", dependencies=[Depends(require_admin)])
+def read_tenant_metrics():
+    return tenancy.tenants.stats()
+
+# Cross-clinic totals: every clinic database is queried, a few at a time
+@app.get("/admin/tenants/summary", response_model=schemas.TenantSummary, dependencies=[Depends(require_admin)])
+def read_tenant_summary(start_date: date, end_date: date):
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    clinics = tenancy.tenants.map(partial(crud.get_clinic_summary, start_date=start_date, end_date=end_date))
+    total = {field: sum(clinic[field] for clinic in clinics.values()) for field in schemas.ClinicSummary.model_fields}
+    return {"start_date": start_date, "end_date": end_date, "clinics": clinics, "total": total}
+
+@app.get("/admin/metrics/audit", dependencies=[Depends(require_admin)])
+def read_audit_metrics():
+    return audit.log.stats()
+
+# Audit trail, newest entries last; what is still buffered is written first so it shows up
+@app.get("/admin/audit", response_model=schemas.AuditPage, dependencies=[Depends(require_admin)])
+def list_audit_entries(
+    entity: Optional[str] = Query(None, pattern="^(patients|appointments|doctors)$"), record_id: Optional[int] = None,
+    actor: Optional[str] = None, tenant: Optional[str] = None, since: Optional[datetime] = None,
+    until: Optional[datetime] = None, cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    format: str = Query("json", pattern="^(json|ndjson)$"), db: Session = Depends(get_default_db)
+):
+    audit.log.flush()
+    return list_response(
+        crud.get_audit_entries_query(db, entity, record_id, actor, since, until, tenant),
+        [models.AuditEntry.at, models.AuditEntry.id], schemas.AuditEntry, cursor, limit, format
+    )
+
 # Doctor endpoints
 @app.post("/doctors/", response_model=schemas.Doctor)
 def create_doctor(doctor: schemas.DoctorCreate, db: Session = Depends(get_db)):
@@ -58,10 +222,166 @@ def create_doctor(doctor: schemas.DoctorCreate, db: Session = Depends(get_db)):
 
 @app.get("/doctors/{doctor_id}", response_model=schemas.Doctor)
 def read_doctor(doctor_id: int, db: Session = Depends(get_db)):
+    profiles = tenancy.doctor_profiles()
+    profile = profiles.get(doctor_id)
+    if profile is not None:
+        # Served without loading the row, so the read is recorded here
+        audit.log.read("doctors", doctor_id)
+    else:
+        db_doctor = crud.get_doctor(db, doctor_id=doctor_id)
+        if db_doctor is None:
+            raise HTTPException(status_code=404, detail="Doctor not found")
+        profile = schemas.Doctor.model_validate(db_doctor).model_dump_json()
+        profiles.set(doctor_id, profile)
+    return Response(content=profile, media_type="application/json")
+
+@app.get("/doctors/{doctor_id}/availability", response_model=schemas.Availability)
+def read_doctor_availability(
+    doctor_id: int, start_date: date, end_date: date, office_id: int, appointment_type_id: int,
+    db: Session = Depends(get_db)
+):
+    db_doctor = crud.get_doctor(db, doctor_id=doctor_id)
+    if db_doctor is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    db_office = crud.get_office(db, office_id=office_id)
+    if db_office is None or db_office.doctor_id != doctor_id:
+        raise HTTPException(status_code=404, detail="Office not found")
+    db_appointment_type = crud.get_appointment_type(db, appointment_type_id=appointment_type_id)
+    if db_appointment_type is None or db_appointment_type.doctor_id != doctor_id:
+        raise HTTPException(status_code=404, detail="Appointment type not found")
+    if end_date < start_date or (end_date - start_date).days > MAX_AVAILABILITY_DAYS:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+
+    start = datetime.combine(start_date, time.min)
+    end = datetime.combine(end_date + timedelta(days=1), time.min)
+    free_slots = availability.find_free_slots(
+        crud.get_doctor_schedules(db, doctor_id=doctor_id),
+        crud.get_booked_intervals(db, doctor_id=doctor_id, start_time=start, end_time=end), start, end,
+        timedelta(minutes=db_appointment_type.duration_minutes)
+    )
+    return {
+        "doctor_id": doctor_id, "office_id": office_id, "appointment_type_id": appointment_type_id,
+        "slots": [{"start_time": s, "end_time": e} for s, e in free_slots],
+    }
+
+@app.get("/availability/earliest", response_model=schemas.EarliestAvailability)
+def read_earliest_availability(
+    appointment_type: str, office_id: Optional[int] = None, address: Optional[str] = None,
+    start_time: Optional[datetime] = None, limit: int = Query(5, ge=1, le=EARLIEST_SLOTS_MAX),
+    days: int = Query(14, ge=1, le=MAX_AVAILABILITY_DAYS), db: Session = Depends(get_db)
+):
+    start = (start_time or datetime.now()).replace(tzinfo=None)
+    end = datetime.combine(start.date() + timedelta(days=days), time.min)
+    candidates = {
+        c.doctor_id: c for c in crud.get_first_available_candidates(db, appointment_type, office_id, address)
+    }
+    schedules = crud.get_schedules_for_doctors(db, list(candidates))
+    earliest = availability.earliest_slots([
+        (doctor_id, availability.doctor_slots(
+            schedules[doctor_id], partial(crud.get_booked_intervals, db, doctor_id), start, end,
+            timedelta(minutes=c.duration_minutes)
+        ))
+        for doctor_id, c in candidates.items()
+    ], limit)
+    return {"slots": [
+        {
+            "start_time": slot_start, "end_time": slot_end, "doctor_id": doctor_id,
+            "doctor_name": candidates[doctor_id].doctor_name, "office_id": candidates[doctor_id].office_id,
+            "appointment_type_id": candidates[doctor_id].appointment_type_id,
+        }
+        for slot_start, slot_end, doctor_id in earliest
+    ]}
+
+# What a patient said ("el jueves en la tarde", "mañana a las 10:30") as windows to look for slots in
+@app.get("/availability/windows", response_model=schemas.DateWindows)
+def read_date_windows(q: str = Query(..., min_length=1, max_length=200), now: Optional[datetime] = None):
+    return {"q": q, "windows": [
+        {"start_time": start, "end_time": end} for start, end in date_phrases.windows(q, now)
+    ]}
+
+@app.get("/doctors/{doctor_id}/occupancy", response_model=schemas.Occupancy, dependencies=[Depends(current_user)])
+def read_doctor_occupancy(doctor_id: int, start_date: date, end_date: date, db: Session = Depends(get_db)):
+    db_doctor = crud.get_doctor(db, doctor_id=doctor_id)
+    if db_doctor is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    if end_date < start_date or (end_date - start_date).days > MAX_AVAILABILITY_DAYS:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+    return {
+        "doctor_id": doctor_id,
+        "days": occupancy.calendar(db, db_doctor.schedule, doctor_id, start_date, end_date),
+    }
+
+@app.get("/doctors/{doctor_id}/appointments", response_model=schemas.AppointmentPage, dependencies=[Depends(current_user)])
+def list_doctor_appointments(
+    doctor_id: int, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+    cursor: Optional[str] = None, limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    format: str = Query("json", pattern="^(json|ndjson)$"), db: Session = Depends(get_db)
+):
+    db_doctor = crud.get_doctor(db, doctor_id=doctor_id)
+    if db_doctor is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    return list_response(
+        crud.get_doctor_appointments_query(db, doctor_id, start_time, end_time),
+        [models.Appointment.start_time, models.Appointment.id], schemas.Appointment, cursor, limit, format
+    )
+
+# Agenda exports for calendar and FHIR clients, streamed; the ETag and X-Sync-Token are the
+# doctor's last change (changes.py), so a poll of an unchanged agenda is a 304 without a scan
+EXPORT_FORMATS = {
+    "ics": (exports.ics, "text/calendar; charset=utf-8"),
+    "fhir": (exports.fhir_bundle, "application/fhir+json"),
+}
+
+def export_response(kind, doctor_id, start_time, end_time, if_none_match, db):
     db_doctor = crud.get_doctor(db, doctor_id=doctor_id)
     if db_doctor is None:
         raise HTTPException(status_code=404, detail="Doctor not found")
-    return db_doctor
+    seq = changes.latest(db, doctor_id)
+    etag = changes.etag(kind, tenancy.name(), doctor_id, seq, start_time, end_time)
+    headers = {"ETag": etag, "X-Sync-Token": changes.encode_token(seq), "Cache-Control": "private, no-cache"}
+    if changes.not_modified(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    render, media_type = EXPORT_FORMATS[kind]
+    rows = crud.get_export_rows(db, doctor_id, start_time, end_time)
+    return StreamingResponse(render(db_doctor, rows), media_type=media_type, headers=headers)
+
+@app.get("/doctors/{doctor_id}/calendar.ics", dependencies=[Depends(current_user)])
+def export_doctor_calendar(
+    doctor_id: int, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+    if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)
+):
+    return export_response("ics", doctor_id, start_time, end_time, if_none_match, db)
+
+@app.get("/doctors/{doctor_id}/appointments/fhir", dependencies=[Depends(current_user)])
+def export_doctor_fhir_bundle(
+    doctor_id: int, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+    if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)
+):
+    return export_response("fhir", doctor_id, start_time, end_time, if_none_match, db)
+
+# Delta sync: the changes after a sync token (from an export or a previous page of changes)
+@app.get("/doctors/{doctor_id}/appointments/changes", response_model=schemas.AppointmentChanges,
+         dependencies=[Depends(current_user)])
+def list_doctor_appointment_changes(
+    doctor_id: int, since: Optional[str] = None, limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    db: Session = Depends(get_db)
+):
+    if crud.get_doctor(db, doctor_id=doctor_id) is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    try:
+        seq = changes.decode_token(since) if since else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    items, last, more = changes.since(db, doctor_id, seq, limit)
+    return {"changes": items, "sync_token": changes.encode_token(last), "more": more}
+
+# Weekly report: served from the stored report of a finished week, else computed (reports.py)
+@app.get("/doctors/{doctor_id}/reports/weekly", response_model=schemas.WeeklyReport, dependencies=[Depends(current_user)])
+def read_weekly_report(doctor_id: int, week: Optional[date] = None, db: Session = Depends(get_db)):
+    if crud.get_doctor(db, doctor_id=doctor_id) is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    body = reports.weekly(db, doctor_id, reports.week_of(week or date.today()))
+    return Response(content=body, media_type="application/json")
 
 # Office endpoints
 @app.post("/doctors/{doctor_id}/offices/", response_model=schemas.Office)
@@ -83,6 +403,14 @@ def create_schedule_for_doctor(
         raise HTTPException(status_code=404, detail="Doctor not found")
     return crud.create_doctor_schedule(db=db, schedule=schedule, doctor_id=doctor_id)
 
+# Bulk imports are operator jobs, like provisioning panel users
+@app.post("/doctors/{doctor_id}/schedules/import/", response_model=schemas.ImportResult, dependencies=[Depends(require_admin)])
+async def import_schedules_for_doctor(doctor_id: int, request: Request, db: Session = Depends(get_db)):
+    db_doctor = await run_in_threadpool(crud.get_doctor, db, doctor_id)
+    if db_doctor is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    return await bulk_import.run_import(request, bulk_import.schedule_importer(db, doctor_id))
+
 # AppointmentType endpoints
 @app.post("/doctors/{doctor_id}/appointment_types/", response_model=schemas.AppointmentType)
 def create_appointment_type_for_doctor(
@@ -101,20 +429,103 @@ def create_patient(patient: schemas.PatientCreate, db: Session = Depends(get_db)
         raise HTTPException(status_code=400, detail="Email already registered")
     return crud.create_patient(db=db, patient=patient)
 
-@app.get("/patients/{patient_id}", response_model=schemas.Patient)
+@app.get("/patients", response_model=schemas.PatientPage, dependencies=[Depends(current_user)])
+def list_patients(
+    name: Optional[str] = None, cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    format: str = Query("json", pattern="^(json|ndjson)$"), db: Session = Depends(get_db)
+):
+    return list_response(
+        crud.get_patients_query(db, name), [models.Patient.full_name, models.Patient.id],
+        schemas.Patient, cursor, limit, format
+    )
+
+@app.post("/import/patients/", response_model=schemas.ImportResult, dependencies=[Depends(require_admin)])
+async def import_patients(request: Request, db: Session = Depends(get_db)):
+    return await bulk_import.run_import(request, bulk_import.patient_importer(db))
+
+# Caller recognition: q is a phone number in any format, an email or a (partial, misspelled) name
+@app.get("/patients/search", response_model=schemas.PatientSearch, dependencies=[Depends(current_user)])
+def search_patients(q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db)):
+    return {"results": [
+        {**schemas.Patient.model_validate(patient).dict(), "match": kind, "score": score}
+        for patient, kind, score in patient_search.search(db, q, limit)
+    ]}
+
+@app.get("/patients/{patient_id}", response_model=schemas.Patient, dependencies=[Depends(current_user)])
 def read_patient(patient_id: int, db: Session = Depends(get_db)):
     db_patient = crud.get_patient(db, patient_id=patient_id)
     if db_patient is None:
         raise HTTPException(status_code=404, detail="Patient not found")
     return db_patient
 
+@app.get("/patients/{patient_id}/appointments", response_model=schemas.AppointmentPage, dependencies=[Depends(current_user)])
+def list_patient_appointments(
+    patient_id: int, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+    cursor: Optional[str] = None, limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    format: str = Query("json", pattern="^(json|ndjson)$"), db: Session = Depends(get_db)
+):
+    db_patient = crud.get_patient(db, patient_id=patient_id)
+    if db_patient is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return list_response(
+        crud.get_patient_appointments_query(db, patient_id, start_time, end_time),
+        [models.Appointment.start_time, models.Appointment.id], schemas.Appointment, cursor, limit, format
+    )
+
 # Appointment endpoints
 @app.post("/appointments/", response_model=schemas.Appointment)
 def create_appointment(appointment: schemas.AppointmentCreate, db: Session = Depends(get_db)):
     # Check if doctor is available
-    appointments = crud.get_appointments_for_doctor(
+    if crud.has_conflicting_appointment(
         db, doctor_id=appointment.doctor_id, start_time=appointment.start_time, end_time=appointment.end_time
-    )
-    if appointments:
+    ):
         raise HTTPException(status_code=400, detail="Doctor is not available at this time")
-    return crud.create_appointment(db=db, appointment=appointment)
+    db_appointment = crud.create_appointment(db=db, appointment=appointment)
+    if db_appointment is None:
+        raise HTTPException(status_code=400, detail="Doctor is not available at this time")
+    return db_appointment
+
+@app.put("/appointments/{appointment_id}/status", response_model=schemas.Appointment, dependencies=[Depends(current_user)])
+def update_appointment_status(appointment_id: int, update: schemas.AppointmentStatusUpdate, db: Session = Depends(get_db)):
+    db_appointment = crud.get_appointment(db, appointment_id)
+    if db_appointment is None:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    if update.status != models.AppointmentStatus.SCHEDULED and db_appointment.start_time > datetime.now():
+        raise HTTPException(status_code=400, detail="Only appointments that have started can be attended or missed")
+    return crud.set_appointment_status(db, db_appointment, update.status)
+
+@app.post("/appointments/series/", response_model=schemas.AppointmentSeries)
+def create_appointment_series(appointment_series: schemas.AppointmentSeriesCreate, db: Session = Depends(get_db)):
+    recurrence = appointment_series.recurrence
+    if recurrence.frequency not in series.STEPS or recurrence.interval < 1:
+        raise HTTPException(status_code=400, detail="Unsupported recurrence")
+    if (recurrence.count is None) == (recurrence.until is None):
+        raise HTTPException(status_code=400, detail="Recurrence needs either count or until")
+    if appointment_series.end_time <= appointment_series.start_time:
+        raise HTTPException(status_code=400, detail="end_time must be after start_time")
+    count = series.occurrence_count(
+        appointment_series.start_time, recurrence.frequency, recurrence.interval, recurrence.count, recurrence.until
+    )
+    if not 1 <= count <= SERIES_MAX_OCCURRENCES:
+        raise HTTPException(status_code=400, detail=f"A series must have between 1 and {SERIES_MAX_OCCURRENCES} occurrences")
+    starts, ends = series.expand(
+        appointment_series.start_time, appointment_series.end_time, recurrence.frequency, recurrence.interval, count
+    )
+    appointment = schemas.AppointmentCreate(**appointment_series.dict(exclude={"recurrence", "all_or_nothing"}))
+    outcomes = crud.create_appointment_series(db, appointment, starts, ends, appointment_series.all_or_nothing)
+    occurrences = [
+        {"start_time": booking_index.from_key(start), "end_time": booking_index.from_key(end),
+         "status": status, "appointment_id": appointment_id}
+        for (status, appointment_id), start, end in zip(outcomes, starts.tolist(), ends.tolist())
+    ]
+    booked = sum(1 for _, appointment_id in outcomes if appointment_id is not None)
+    if appointment_series.all_or_nothing and not booked:
+        raise HTTPException(status_code=400, detail=jsonable_encoder({
+            "message": "Doctor is not available for every occurrence", "occurrences": occurrences
+        }))
+    return {"booked": booked, "occurrences": occurrences}
+
+@app.post("/import/appointments/", response_model=schemas.ImportResult, dependencies=[Depends(require_admin)])
+async def import_appointments(request: Request, db: Session = Depends(get_db)):
+    return await bulk_import.run_import(request, bulk_import.appointment_importer(db))
@@ -0,0 +1,121 @@
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta, time
+import database.models as models
+import availability
+
+# Daily occupancy summary for the doctor calendar. Every appointment insert adds its minutes
+# to one daily_occupancy row (doctor, day, office, appointment type) in the same transaction,
+# as an upsert so writers in other processes add up instead of overwriting each other.
+# Backfill or repair with: python -m occupancy [--doctor ID]
+
+KEY_COLUMNS = ("doctor_id", "day", "office_id", "appointment_type_id")
+
+def _minutes(start_time, end_time):
+    return int((end_time - start_time).total_seconds() // 60)
+
+def deltas(appointments):
+    """{(doctor_id, day, office_id, appointment_type_id): [minutes, count]} for appointment mappings.
+
+    An appointment counts towards the day it starts on.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for a in appointments:
+        total = totals[(a["doctor_id"], a["start_time"].date(), a["office_id"], a["appointment_type_id"])]
+        total[0] += _minutes(a["start_time"], a["end_time"])
+        total[1] += 1
+    return totals
+
+def apply(db, changes):
+    """Adds the deltas to the summary rows; the caller commits."""
+    if not changes:
+        return
+    table = models.DailyOccupancy.__table__
+    # The PostgreSQL dialect is only imported by deployments that use it
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    statement = dialect_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(KEY_COLUMNS),
+        set_={
+            "booked_minutes": table.c.booked_minutes + statement.excluded.booked_minutes,
+            "appointment_count": table.c.appointment_count + statement.excluded.appointment_count,
+        }
+    )
+    db.execute(statement, [
+        dict(zip(KEY_COLUMNS, key), booked_minutes=minutes, appointment_count=count)
+        for key, (minutes, count) in changes.items()
+    ])
+
+def record(db, appointment: dict):
+    apply(db, deltas([appointment]))
+
+def rebuild(db, doctor_id: int = None, batch_size: int = 10000):
+    """Recomputes the summary from the appointments table; returns the number of rows written."""
+    query = db.query(models.DailyOccupancy)
+    appointments = db.query(
+        models.Appointment.doctor_id, models.Appointment.office_id, models.Appointment.appointment_type_id,
+        models.Appointment.start_time, models.Appointment.end_time
+    )
+    if doctor_id is not None:
+        query = query.filter(models.DailyOccupancy.doctor_id == doctor_id)
+        appointments = appointments.filter(models.Appointment.doctor_id == doctor_id)
+    query.delete(synchronize_session=False)
+    changes = deltas(row._mapping for row in appointments.yield_per(batch_size))
+    apply(db, changes)
+    db.commit()
+    return len(changes)
+
+def calendar(db, schedules, doctor_id: int, start_date, end_date):
+    """Per-day scheduled, booked and free minutes with a per-office breakdown, one range lookup."""
+    rows = db.query(models.DailyOccupancy).filter(
+        models.DailyOccupancy.doctor_id == doctor_id,
+        models.DailyOccupancy.day >= start_date,
+        models.DailyOccupancy.day <= end_date
+    ).all()
+    days = {}
+    for row in rows:
+        office = days.setdefault(row.day, {}).setdefault(
+            row.office_id, {"office_id": row.office_id, "booked_minutes": 0, "appointment_count": 0, "by_type": {}}
+        )
+        office["booked_minutes"] += row.booked_minutes
+        office["appointment_count"] += row.appointment_count
+        office["by_type"][row.appointment_type_id] = row.appointment_count
+
+    scheduled = defaultdict(int)
+    for window_start, window_end in availability.working_windows(
+        schedules, datetime.combine(start_date, time.min), datetime.combine(end_date + timedelta(days=1), time.min)
+    ):
+        scheduled[window_start.date()] += _minutes(window_start, window_end)
+
+    result = []
+    day = start_date
+    while day <= end_date:
+        offices = sorted(days.get(day, {}).values(), key=lambda o: o["office_id"])
+        booked = sum(o["booked_minutes"] for o in offices)
+        result.append({
+            "day": day, "scheduled_minutes": scheduled[day], "booked_minutes": booked,
+            "free_minutes": max(0, scheduled[day] - booked),
+            "appointment_count": sum(o["appointment_count"] for o in offices), "offices": offices,
+        })
+        day += timedelta(days=1)
+    return result
+
+def main():
+    from database import database
+    from database.bootstrap import init_schema
+
+    parser = argparse.ArgumentParser(description="Rebuild the daily occupancy summary from the appointments table.")
+    parser.add_argument("--doctor", type=int, help="only rebuild this doctor's rows")
+    args = parser.parse_args()
+    init_schema(database.engine)
+    db = database.SessionLocal()
+    try:
+        print(f"daily_occupancy rows written: {rebuild(db, args.doctor)}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
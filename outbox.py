@@ -0,0 +1,335 @@
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func
+from starlette.concurrency import run_in_threadpool
+from database import models
+import tenancy
+from config import (
+    OUTBOX_WORKERS, OUTBOX_BATCH_SIZE, OUTBOX_POLL_SECONDS, OUTBOX_LEASE_SECONDS, OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BACKOFF_SECONDS, OUTBOX_BACKOFF_MAX_SECONDS, OUTBOX_RATE_WHATSAPP, OUTBOX_RATE_SMS, OUTBOX_RATE_EMAIL
+)
+
+logger = logging.getLogger(__name__)
+
+# Durable outbox for WhatsApp/SMS/email. Request handlers only insert outbox_messages rows
+# (in the same transaction as the change they announce, so in the clinic's database with
+# TENANTS); the dispatcher's asyncio workers claim due rows in batches per channel and hand
+# them to the channel's provider. The default database is always polled, a clinic's only
+# once something may be due there: after a notify() for it, when its earliest pending retry
+# comes up, and on every lease-long sweep of the open clinics, which also picks up what other
+# processes left behind. Clinic databases are read through tenancy.background_session, so the
+# workers never keep a clinic's engine open or reopen a closed one.
+
+CHANNELS = ("whatsapp", "sms", "email")
+CONFIRMATION_CHANNELS = ("whatsapp", "email")
+
+PENDING, SENT, FAILED = "pending", "sent", "failed"
+
+def enqueue(db, channel: str, recipient: str, body: str, appointment_id: int = None, now=None):
+    """Adds the message to the session; it is delivered once the caller commits."""
+    now = now or datetime.now()
+    db.add(models.OutboxMessage(
+        channel=channel, recipient=recipient, body=body, appointment_id=appointment_id,
+        status=PENDING, attempts=0, created_at=now, next_attempt_at=now
+    ))
+
+def confirmation_message(appointment):
+    return (
+        f"Hola {appointment.patient.full_name}, su cita de {appointment.appointment_type.name} con "
+        f"{appointment.doctor.title} {appointment.doctor.full_name} quedó agendada para el "
+        f"{appointment.start_time:%d/%m/%Y} a las {appointment.start_time:%H:%M} en "
+        f"{appointment.office.name} ({appointment.office.address})."
+    )
+
+def series_confirmation_message(appointments):
+    first = appointments[0]
+    dates = ", ".join(f"{a.start_time:%d/%m/%Y %H:%M}" for a in appointments)
+    return (
+        f"Hola {first.patient.full_name}, sus {len(appointments)} citas de {first.appointment_type.name} con "
+        f"{first.doctor.title} {first.doctor.full_name} quedaron agendadas en {first.office.name} "
+        f"({first.office.address}): {dates}."
+    )
+
+def has_references(appointment):
+    # Foreign keys are not enforced on SQLite, so the referenced rows may be missing
+    return None not in (appointment.patient, appointment.doctor, appointment.office, appointment.appointment_type)
+
+def _enqueue_to_patient(db, appointment, body):
+    if not has_references(appointment):
+        return
+    recipients = {"whatsapp": appointment.patient.phone, "email": appointment.patient.email}
+    for channel in CONFIRMATION_CHANNELS:
+        if recipients[channel]:
+            enqueue(db, channel, recipients[channel], body(), appointment.id)
+
+def enqueue_confirmation(db, appointment):
+    _enqueue_to_patient(db, appointment, lambda: confirmation_message(appointment))
+
+def enqueue_series_confirmation(db, appointments):
+    # One message for the whole series, attached to its first appointment
+    _enqueue_to_patient(db, appointments[0], lambda: series_confirmation_message(appointments))
+
+# Providers
+class Provider:
+    async def send_batch(self, messages):
+        """Sends (id, recipient, body) messages; returns one error string or None per message."""
+        raise NotImplementedError
+
+class LogProvider(Provider):
+    def __init__(self, channel: str):
+        self.channel = channel
+
+    async def send_batch(self, messages):
+        for message_id, recipient, body in messages:
+            logger.info("%s to %s (outbox %s): %s", self.channel, recipient, message_id, body)
+        return [None] * len(messages)
+
+class FakeProvider(Provider):
+    """In-memory provider for tests: records what it sends and fails the first `failures` messages."""
+
+    def __init__(self, latency: float = 0, failures: int = 0):
+        self.latency = latency
+        self.failures = failures
+        self.sent = []
+        self.batches = []
+
+    async def send_batch(self, messages):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.batches.append(len(messages))
+        errors = []
+        for message in messages:
+            if self.failures > 0:
+                self.failures -= 1
+                errors.append("Provider unavailable")
+            else:
+                self.sent.append(message)
+                errors.append(None)
+        return errors
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `capacity`; one token per message."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Only called from the event loop, so reserve/refund need no lock
+    def reserve(self, n: int):
+        self._refill()
+        taken = min(n, int(self.tokens))
+        self.tokens -= taken
+        return taken
+
+    def refund(self, n: int):
+        self.tokens = min(self.capacity, self.tokens + n)
+
+    def wait_time(self):
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+class OutboxDispatcher:
+    """Pool of asyncio workers draining the outbox.
+
+    A worker reserves tokens from the channel's bucket, claims at most that many due rows
+    (pushing their next_attempt_at one lease ahead, so a crashed worker's batch is picked up
+    again later) and sends them as one batch. Failures are retried with exponential backoff
+    until OUTBOX_MAX_ATTEMPTS, then marked failed.
+    """
+
+    def __init__(self, workers: int, batch_size: int, rates: dict):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = OUTBOX_POLL_SECONDS
+        self.lease = timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        self.max_attempts = OUTBOX_MAX_ATTEMPTS
+        self.backoff = OUTBOX_BACKOFF_SECONDS
+        self.backoff_max = OUTBOX_BACKOFF_MAX_SECONDS
+        self.providers = {channel: LogProvider(channel) for channel in CHANNELS}
+        self.buckets = {channel: TokenBucket(rate) for channel, rate in rates.items()}
+        self.counters = {key: Counter() for key in ("sent", "retried", "failed")}
+        # Clinics that may have pending messages, with when to look next
+        self._tenants = {}
+        self._sweep_at = 0.0
+        self._tasks = []
+        self._loop = None
+        self._wake = None
+
+    def _claim(self, tenant, channel, limit, now):
+        with tenancy.background_session(tenant) as db:
+            if db is None:
+                return []
+            due = select(models.OutboxMessage.id).where(
+                models.OutboxMessage.channel == channel,
+                models.OutboxMessage.status == PENDING,
+                models.OutboxMessage.next_attempt_at <= now
+            ).order_by(models.OutboxMessage.next_attempt_at).limit(limit).with_for_update(skip_locked=True)
+            rows = db.execute(
+                update(models.OutboxMessage).where(
+                    models.OutboxMessage.id.in_(due),
+                    models.OutboxMessage.status == PENDING,
+                    models.OutboxMessage.next_attempt_at <= now
+                ).values(
+                    next_attempt_at=now + self.lease, attempts=models.OutboxMessage.attempts + 1
+                ).returning(
+                    models.OutboxMessage.id, models.OutboxMessage.recipient,
+                    models.OutboxMessage.body, models.OutboxMessage.attempts
+                ).execution_options(synchronize_session=False)
+            ).all()
+            db.commit()
+            return rows
+
+    def _retry_delay(self, attempts):
+        delay = min(self.backoff_max, self.backoff * 2 ** (attempts - 1))
+        return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+    def _record(self, tenant, channel, rows, errors, now):
+        changes = []
+        for (message_id, _, _, attempts), error in zip(rows, errors):
+            if error is None:
+                changes.append({"id": message_id, "status": SENT, "sent_at": now, "last_error": None})
+                self.counters["sent"][channel] += 1
+            elif attempts >= self.max_attempts:
+                changes.append({"id": message_id, "status": FAILED, "last_error": error})
+                self.counters["failed"][channel] += 1
+            else:
+                changes.append({
+                    "id": message_id, "last_error": error, "next_attempt_at": now + self._retry_delay(attempts)
+                })
+                self.counters["retried"][channel] += 1
+        with tenancy.background_session(tenant) as db:
+            # Grouped by key set: executemany needs the same columns in every row
+            for keys in {tuple(change) for change in changes}:
+                db.execute(update(models.OutboxMessage), [c for c in changes if tuple(c) == keys])
+            db.commit()
+
+    def _next_attempt(self, tenant):
+        with tenancy.background_session(tenant) as db:
+            if db is None:
+                return None
+            return db.query(func.min(models.OutboxMessage.next_attempt_at)).filter(
+                models.OutboxMessage.status == PENDING
+            ).scalar()
+
+    async def _idle(self, tenant):
+        # Dropped first and re-added for its next retry if anything is pending, so a notify() in
+        # between is kept; a clinic is only visited again once something is due
+        self._tenants.pop(tenant, None)
+        next_attempt = await run_in_threadpool(self._next_attempt, tenant)
+        if next_attempt is not None:
+            self._tenants.setdefault(tenant, next_attempt)
+
+    async def process(self, channel: str, now=None):
+        """Claims and sends one batch for `channel` from each database; returns the number of messages handled."""
+        now = now or datetime.now()
+        if time.monotonic() >= self._sweep_at:
+            self._sweep_at = time.monotonic() + self.lease.total_seconds()
+            for tenant in tenancy.tenants.open_names():
+                self._tenants.setdefault(tenant, now)
+        handled = 0
+        for tenant in [None, *sorted(t for t, at in self._tenants.items() if at <= now)]:
+            claimed = await self._process(tenant, channel, now)
+            if claimed is None:
+                break
+            if not claimed and tenant is not None:
+                await self._idle(tenant)
+            handled += claimed
+        return handled
+
+    async def _process(self, tenant, channel, now):
+        # None once the channel's rate is used up
+        bucket = self.buckets[channel]
+        reserved = bucket.reserve(self.batch_size)
+        if not reserved:
+            return None
+        rows = await run_in_threadpool(self._claim, tenant, channel, reserved, now)
+        bucket.refund(reserved - len(rows))
+        if not rows:
+            return 0
+        messages = [(message_id, recipient, body) for message_id, recipient, body, _ in rows]
+        try:
+            errors = await self.providers[channel].send_batch(messages)
+        except Exception as exc:
+            logger.exception("%s provider failed a batch of %d", channel, len(rows))
+            errors = [str(exc) or type(exc).__name__] * len(rows)
+        await run_in_threadpool(self._record, tenant, channel, rows, errors, datetime.now())
+        return len(rows)
+
+    async def _worker(self, offset):
+        channels = list(self.buckets)
+        while True:
+            self._wake.clear()
+            handled = 0
+            try:
+                # Workers start on different channels so one busy channel cannot starve the others
+                for i in range(len(channels)):
+                    handled += await self.process(channels[(offset + i) % len(channels)])
+            except Exception:
+                logger.exception("Outbox worker iteration failed")
+            if handled:
+                continue
+            waits = [bucket.wait_time() for bucket in self.buckets.values()]
+            timeout = min([self.poll_interval] + [w for w in waits if w > 0])
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+    def notify(self, tenant: str = None):
+        """Wakes idle workers after new messages were committed in `tenant`'s database (safe from any thread)."""
+        if tenant is not None:
+            self._tenants[tenant] = datetime.min
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def stats(self, db, now=None):
+        now = now or datetime.now()
+        pending = {
+            channel: (depth, oldest) for channel, depth, oldest in db.query(
+                models.OutboxMessage.channel, func.count(), func.min(models.OutboxMessage.created_at)
+            ).filter(models.OutboxMessage.status == PENDING).group_by(models.OutboxMessage.channel)
+        }
+        return {
+            "workers": self.workers,
+            # Depths below are the default database's
+            "tenants_pending": sorted(self._tenants),
+            "channels": {
+                channel: {
+                    "depth": pending.get(channel, (0, None))[0],
+                    "lag_seconds": round((now - pending[channel][1]).total_seconds(), 3) if channel in pending else 0,
+                    "sent": self.counters["sent"][channel],
+                    "retried": self.counters["retried"][channel],
+                    "failed": self.counters["failed"][channel],
+                    "rate_per_second": self.buckets[channel].rate,
+                }
+                for channel in self.buckets
+            },
+        }
+
+dispatcher = OutboxDispatcher(
+    OUTBOX_WORKERS, OUTBOX_BATCH_SIZE,
+    {"whatsapp": OUTBOX_RATE_WHATSAPP, "sms": OUTBOX_RATE_SMS, "email": OUTBOX_RATE_EMAIL}
+)
@@ -0,0 +1,48 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import DateTime, tuple_
+
+# Keyset (cursor) pagination: a page is "rows after the last (sort key..., id) seen", which
+# stays an index range scan however deep the client pages, unlike OFFSET.
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, columns):
+    """Raises ValueError if the cursor was not produced by encode_cursor for these columns."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("Invalid cursor")
+    return [_value(column, value) for column, value in zip(columns, values)]
+
+def _value(column, value):
+    # JSON only round-trips str and int keys, and datetimes as ISO strings
+    if value is None:
+        return None
+    expected = str if isinstance(column.type, DateTime) else column.type.python_type
+    if not isinstance(value, expected) or isinstance(value, bool):
+        raise ValueError("Invalid cursor")
+    return datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+
+def after(query, columns, cursor):
+    query = query.order_by(*columns)
+    if cursor:
+        query = query.filter(tuple_(*columns) > tuple_(*decode_cursor(cursor, columns)))
+    return query
+
+def page(query, columns, cursor, limit: int):
+    rows = after(query, columns, cursor).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in columns])
+    return {"items": rows, "next_cursor": next_cursor}
+
+def ndjson(rows, schema):
+    for row in rows:
+        yield schema.model_validate(row).model_dump_json() + "\n"
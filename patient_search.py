@@ -0,0 +1,235 @@
+import re
+import threading
+from collections import Counter, defaultdict
+from sqlalchemy import select, update, bindparam, and_, or_, text
+import database.models as models
+from database.models import normalize_name, phone_key
+from config import PATIENT_SEARCH_CANDIDATES, PHONE_MATCH_MIN_DIGITS
+
+# Patient lookup for recognizing callers: by phone (any format, with or without country code),
+# exact email, or an accent-insensitive name with typos. Every lookup is an index probe on the
+# search keys that models.Patient fills in on insert, and the candidates are ranked here.
+# Names are tried as a prefix of the normalized name (btree), then as words in any order
+# (FTS5 on SQLite, pg_trgm on PostgreSQL), then with misspelled words corrected against the
+# vocabulary of name words.
+
+PHONE_PATTERN = re.compile(r"[\d\s()+.-]+")
+# Matches of a kind always rank above the ones after it
+KINDS = ("phone", "email", "name")
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+def classify(query: str):
+    if "@" in query:
+        return "email"
+    if PHONE_PATTERN.fullmatch(query) and len(phone_key(query)) >= PHONE_MATCH_MIN_DIGITS:
+        return "phone"
+    return "name"
+
+def trigrams(value: str):
+    # Padded like pg_trgm, so word starts and ends weigh in
+    grams = set()
+    for word in value.split():
+        word = f"  {word} "
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+def similarity(a: str, b: str):
+    a, b = trigrams(a), trigrams(b)
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def name_score(query: str, name: str):
+    if name == query:
+        return 1.0
+    score = similarity(query, name)
+    # Callers often give only the first name or first surname
+    if name.startswith(query):
+        score = max(score, 0.9)
+    return round(min(score, 0.99), 3)
+
+def edits(word: str):
+    """Words one deletion, transposition, substitution or insertion away."""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    return set(
+        [a + b[1:] for a, b in splits if b]
+        + [a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1]
+        + [a + c + b[1:] for a, b in splits if b for c in LETTERS]
+        + [a + c + b for a, b in splits for c in LETTERS]
+    )
+
+class NameVocabulary:
+    """Name words with how many patients use them, for correcting misspelled query words.
+
+    Loaded from the FTS5 vocabulary at startup and extended by this process's inserts; words
+    first written by other processes are picked up on the next load.
+    """
+
+    def __init__(self, max_alternatives: int = 3, min_similarity: float = 0.3):
+        self.max_alternatives = max_alternatives
+        self.min_similarity = min_similarity
+        self._counts = Counter()
+        self._grams = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def load(self, db):
+        if db.get_bind().dialect.name != "sqlite":
+            return
+        rows = db.execute(text("SELECT term, doc FROM patients_fts_vocab")).all()
+        with self._lock:
+            self._counts.clear()
+            self._grams.clear()
+            for word, count in rows:
+                self._add(word, count)
+
+    def _add(self, word, count):
+        if word not in self._counts:
+            for gram in trigrams(word):
+                self._grams[gram].add(word)
+        self._counts[word] += count
+
+    def add(self, words):
+        with self._lock:
+            for word in words:
+                self._add(word, 1)
+
+    def __contains__(self, word):
+        return word in self._counts
+
+    def alternatives(self, word: str):
+        """The word if it is known, else the closest known words, most common first.
+
+        Words one edit away are preferred (typical spelling and transcription slips); longer
+        distances fall back to trigram similarity. An unknown word with no close match is
+        returned as is.
+        """
+        with self._lock:
+            if word in self._counts:
+                return [word]
+            close = sorted((w for w in edits(word) if w in self._counts), key=lambda w: -self._counts[w])
+            if not close:
+                grams = trigrams(word)
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self._grams.get(gram, ()))
+                scored = [
+                    (count / (len(grams) + len(trigrams(other)) - count), self._counts[other], other)
+                    for other, count in shared.items()
+                ]
+                close = [other for score, _, other in sorted(scored, reverse=True) if score >= self.min_similarity]
+        return close[:self.max_alternatives] or [word]
+
+vocabulary = NameVocabulary()
+
+# Candidate lookups, each bounded by `limit`
+def _phone_candidates(db, query: str, limit: int):
+    key = phone_key(query)
+    column = models.Patient.phone_key
+    # Stored numbers that end with the query, or that the query ends with (country code given)
+    return db.query(models.Patient).filter(or_(
+        and_(column >= key, column < key + ":"),
+        column.in_([key[:n] for n in range(PHONE_MATCH_MIN_DIGITS, len(key))])
+    )).limit(limit).all()
+
+def _email_candidates(db, query: str, limit: int):
+    return db.query(models.Patient).filter(models.Patient.email.in_({query, query.lower()})).limit(limit).all()
+
+def _fts_ids(db, match: str, limit: int):
+    return [row[0] for row in db.execute(
+        text("SELECT rowid FROM patients_fts WHERE patients_fts MATCH :match LIMIT :limit"),
+        {"match": match, "limit": limit}
+    )]
+
+def _prefix_candidates(db, query: str, limit: int):
+    # Exact names and names starting with the query, e.g. the first name and first surname
+    column = models.Patient.name_normalized
+    return db.query(models.Patient).filter(column >= query, column < query + "\uffff").limit(limit).all()
+
+def _name_candidates(db, query: str, limit: int):
+    words = query.split()
+    # As given, then surnames first ("perez garcia jose") as the other rotations of the words
+    for i in range(len(words)):
+        patients = _prefix_candidates(db, " ".join(words[i:] + words[:i]), limit)
+        if patients:
+            return patients
+    if db.get_bind().dialect.name == "postgresql":
+        column = models.Patient.name_normalized
+        patients = db.query(models.Patient).filter(*[column.contains(word) for word in words]).limit(limit).all()
+        if not patients:
+            patients = db.query(models.Patient).filter(column.op("%")(query)).order_by(
+                column.op("<->")(query)
+            ).limit(limit).all()
+        return patients
+    # Words in any order, the last one possibly cut short (a word nobody has cannot match)
+    ids = []
+    if all(word in vocabulary for word in words[:-1]):
+        ids = _fts_ids(db, " ".join(f'"{word}"' for word in words) + "*", limit)
+    if not ids:
+        # Misspelled words: the best correction of each in the given order, then any of the
+        # close corrections in any order
+        alternatives = [vocabulary.alternatives(word) for word in words]
+        patients = _prefix_candidates(db, " ".join(a[0] for a in alternatives), limit)
+        if patients:
+            return patients
+        # The word as given is kept in case another process just added it
+        ids = _fts_ids(db, " AND ".join(
+            "(" + " OR ".join(f'"{alternative}"' for alternative in {word, *a}) + ")"
+            for word, a in zip(words, alternatives)
+        ), limit)
+    return db.query(models.Patient).filter(models.Patient.id.in_(ids)).all() if ids else []
+
+def search(db, query: str, limit: int = 10):
+    """[(patient, kind, score)] best first."""
+    query = query.strip()
+    kind = classify(query)
+    if kind == "phone":
+        results = [(p, "phone", 1.0) for p in _phone_candidates(db, query, PATIENT_SEARCH_CANDIDATES)]
+    elif kind == "email":
+        results = [(p, "email", 1.0) for p in _email_candidates(db, query, PATIENT_SEARCH_CANDIDATES)]
+    else:
+        normalized = normalize_name(query)
+        results = [
+            (p, "name", name_score(normalized, p.name_normalized or ""))
+            for p in _name_candidates(db, normalized, PATIENT_SEARCH_CANDIDATES)
+        ] if normalized else []
+    results.sort(key=lambda r: (KINDS.index(r[1]), -r[2], r[0].id))
+    return results[:limit]
+
+# Index maintenance
+def index_names(db, patients):
+    """Adds (id, name_normalized) pairs to the name index; the caller commits."""
+    patients = list(patients)
+    if patients and db.get_bind().dialect.name == "sqlite":
+        db.execute(text("INSERT INTO patients_fts(rowid, name_normalized) VALUES (:id, :name)"), [
+            {"id": patient_id, "name": name} for patient_id, name in patients
+        ])
+    vocabulary.add(word for _, name in patients for word in name.split())
+
+def backfill(connection, batch_size: int = 10000):
+    """Fills the search keys of rows written before the columns existed; returns how many."""
+    table = models.Patient.__table__
+    statement = update(table).where(table.c.id == bindparam("row_id")).values(
+        name_normalized=bindparam("new_name"), phone_key=bindparam("new_phone")
+    )
+    total = 0
+    while True:
+        rows = connection.execute(
+            select(table.c.id, table.c.full_name, table.c.phone).where(table.c.name_normalized.is_(None)).limit(batch_size)
+        ).all()
+        if not rows:
+            return total
+        connection.execute(statement, [
+            {"row_id": row.id, "new_name": normalize_name(row.full_name), "new_phone": phone_key(row.phone)} for row in rows
+        ])
+        total += len(rows)
+
+def ensure_index(connection):
+    """Backfills the search keys and creates the name index on databases from before it existed."""
+    backfilled = backfill(connection)
+    if connection.dialect.name == "sqlite":
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'"
+        ).first()
+        models.create_patient_name_index(connection)
+        if backfilled or not exists:
+            connection.exec_driver_sql("INSERT INTO patients_fts(patients_fts) VALUES ('rebuild')")
+    else:
+        models.create_patient_name_index(connection)
@@ -0,0 +1,262 @@
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, object_session
+from database import database, models
+import outbox
+import tenancy
+from booking_index import to_key, from_key
+from config import REMINDER_LOOKAHEAD_HOURS, REMINDER_GRACE_MINUTES
+
+logger = logging.getLogger(__name__)
+
+# Reminder kinds, largest offset first
+KINDS = [("24h", timedelta(hours=24)), ("2h", timedelta(hours=2))]
+RETRY_DELAY = timedelta(minutes=1)
+
+def reminder_message(appointment, kind: str):
+    when = "mañana" if kind == "24h" else "hoy"
+    return (
+        f"Hola, soy BettyIA, asistente de {appointment.doctor.title} {appointment.doctor.full_name}. "
+        f"Le recuerdo su cita de {appointment.appointment_type.name} programada {when} a las "
+        f"{appointment.start_time:%H:%M} en {appointment.office.name} ({appointment.office.address}). "
+        "¿Desea confirmar o reprogramar?"
+    )
+
+# Senders. send() runs inside the transaction that claims the reminder, which the scheduler
+# commits afterwards; raising rolls the claim back so the reminder is retried.
+class ReminderSender:
+    def send(self, appointment, kind: str):
+        raise NotImplementedError
+
+class LogSender(ReminderSender):
+    def send(self, appointment, kind: str):
+        logger.info("Reminder %s for appointment %s: %s", kind, appointment.id, reminder_message(appointment, kind))
+
+class OutboxSender(ReminderSender):
+    """Queues the reminder as a WhatsApp message to the patient in the outbox."""
+
+    def send(self, appointment, kind: str):
+        # Nothing to send, but still claimed: a retry could not fix a missing row
+        if not outbox.has_references(appointment) or not appointment.patient.phone:
+            logger.warning("Reminder %s for appointment %s has no recipient", kind, appointment.id)
+            return
+        db = object_session(appointment)
+        outbox.enqueue(db, "whatsapp", appointment.patient.phone, reminder_message(appointment, kind), appointment.id)
+
+class StubSender(ReminderSender):
+    """Collects (appointment_id, kind, message) instead of sending, for tests."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, appointment, kind: str):
+        self.sent.append((appointment.id, kind, reminder_message(appointment, kind)))
+
+class ReminderScheduler:
+    """Min-heap of the reminders due within the look-ahead window.
+
+    Heap entries are (fire_key, key, kind_index, start_key), where key is (clinic,
+    appointment_id) and the clinic "" is the default database: ids repeat across clinic
+    databases (tenancy.py), and every clinic's appointments are loaded. `_starts` maps each
+    scheduled appointment to its current start key, so entries of a rescheduled or cancelled
+    appointment are dropped when popped instead of being searched for. Each send is claimed
+    in the appointment's database's reminders_sent first, which keeps restarts and multiple
+    workers from sending twice.
+    """
+
+    def __init__(self, sender: ReminderSender, lookahead: timedelta, grace: timedelta):
+        self.sender = sender
+        self.lookahead = lookahead
+        self.grace = grace
+        self.horizon = None
+        self._heap = []
+        self._starts = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _push(self, key, start_time, now, until):
+        start_key = to_key(start_time)
+        pushed = False
+        for kind_index, (_, offset) in enumerate(KINDS):
+            fire_at = start_time - offset
+            if now - self.grace <= fire_at <= until:
+                heapq.heappush(self._heap, (to_key(fire_at), key, kind_index, start_key))
+                pushed = True
+        if pushed:
+            self._starts[key] = start_key
+
+    def _load_window(self, db, clinic, now, since, until):
+        # Reminders of one database whose fire time falls in (since, until]
+        rows = db.query(models.Appointment.id, models.Appointment.start_time).filter(
+            models.Appointment.start_time > since + KINDS[-1][1],
+            models.Appointment.start_time <= until + KINDS[0][1]
+        ).yield_per(10000)
+        entries = [
+            (to_key(start_time - offset), (clinic, appointment_id), kind_index, to_key(start_time))
+            for appointment_id, start_time in rows
+            for kind_index, (_, offset) in enumerate(KINDS)
+            if since < start_time - offset <= until and start_time - offset >= now - self.grace
+        ]
+        with self._condition:
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+                self._starts[entry[1]] = entry[3]
+
+    def _load_all(self, db, now, since, until):
+        # The default database through `db`, then each clinic database, open or not (through
+        # tenancy.background_session, so none is kept open); the horizon moves once all are loaded
+        self._load_window(db, "", now, since, until)
+        for name in sorted(tenancy.tenants.names):
+            try:
+                with tenancy.background_session(name) as clinic_db:
+                    if clinic_db is not None:
+                        self._load_window(clinic_db, name, now, since, until)
+            except Exception:
+                logger.exception("Loading the reminders of clinic %s failed", name)
+        with self._condition:
+            self.horizon = until
+            self._condition.notify()
+
+    def load(self, db, now=None):
+        """Loads the window from `db` (the default database) and from every clinic database."""
+        now = now or datetime.now()
+        with self._condition:
+            self._heap = []
+            self._starts = {}
+        self._load_all(db, now, now - self.grace - timedelta(microseconds=1), now + self.lookahead)
+
+    def schedule(self, appointment_id: int, start_time: datetime, now=None, tenant: str = None):
+        if self.horizon is None:
+            return
+        now = now or datetime.now()
+        with self._condition:
+            self._push((tenant or "", appointment_id), start_time.replace(tzinfo=None), now, self.horizon)
+            self._condition.notify()
+
+    def cancel(self, appointment_id: int, tenant: str = None):
+        with self._condition:
+            self._starts.pop((tenant or "", appointment_id), None)
+
+    def _pop_due(self, now):
+        now_key = to_key(now)
+        due = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now_key:
+                _, key, kind_index, start_key = heapq.heappop(self._heap)
+                if self._starts.get(key) != start_key:
+                    continue
+                due.append((key, kind_index, start_key))
+                if kind_index == len(KINDS) - 1:
+                    del self._starts[key]
+        return due
+
+    def dispatch_due(self, now=None):
+        now = now or datetime.now()
+        due = self._pop_due(now)
+        sent = 0
+        # One session per database
+        for clinic in sorted({clinic for (clinic, _), _, _ in due}):
+            entries = [(key, kind_index, start_key) for key, kind_index, start_key in due if key[0] == clinic]
+            done = 0
+            try:
+                with tenancy.background_session(clinic or None) as db:
+                    for key, kind_index, start_key in entries:
+                        # No database, no appointment: dropped like a deleted one
+                        result = self._dispatch(db, key, KINDS[kind_index][0], now) if db is not None else None
+                        if result:
+                            sent += 1
+                        elif result is False:
+                            self._retry(key, kind_index, start_key, now)
+                        done += 1
+            except Exception:
+                # What the failing database did not get to is retried
+                logger.exception("Reminders of clinic %s failed", clinic)
+                for key, kind_index, start_key in entries[done:]:
+                    self._retry(key, kind_index, start_key, now)
+        return sent
+
+    def _retry(self, key, kind_index, start_key, now):
+        with self._condition:
+            heapq.heappush(self._heap, (to_key(now + RETRY_DELAY), key, kind_index, start_key))
+            self._starts.setdefault(key, start_key)
+
+    # True when sent, None when already claimed (or the appointment is gone), False to retry.
+    # The claim and what the sender queues commit together, so a crash loses neither alone.
+    def _dispatch(self, db, key, kind, now):
+        clinic, appointment_id = key
+        appointment = db.query(models.Appointment).options(
+            joinedload(models.Appointment.doctor), joinedload(models.Appointment.office),
+            joinedload(models.Appointment.appointment_type), joinedload(models.Appointment.patient)
+        ).filter(models.Appointment.id == appointment_id).first()
+        if appointment is None:
+            db.rollback()
+            return None
+        try:
+            # Flushed first, so a reminder claimed elsewhere fails here, before it is sent
+            db.add(models.ReminderSent(appointment_id=appointment_id, kind=kind, sent_at=now))
+            db.flush()
+        except IntegrityError:
+            db.rollback()
+            return None
+        try:
+            self.sender.send(appointment, kind)
+            db.commit()
+        except Exception:
+            # Nothing is claimed, so the retry (or another worker) can send it
+            logger.exception("Reminder %s for appointment %s failed", kind, appointment_id)
+            db.rollback()
+            return False
+        outbox.dispatcher.notify(clinic or None)
+        return True
+
+    def _next_wait(self, now):
+        refill_at = self.horizon - self.lookahead / 2
+        wait_until = min(from_key(self._heap[0][0]), refill_at) if self._heap else refill_at
+        return max(0.0, (wait_until - now).total_seconds())
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+                self._condition.wait(self._next_wait(datetime.now()))
+                if self._stopping:
+                    return
+            now = datetime.now()
+            try:
+                if now >= self.horizon - self.lookahead / 2:
+                    db = database.SessionLocal()
+                    try:
+                        self._load_all(db, now, self.horizon, now + self.lookahead)
+                    finally:
+                        db.close()
+                self.dispatch_due(now)
+            except Exception:
+                logger.exception("Reminder scheduler iteration failed")
+                with self._condition:
+                    self._condition.wait(1)
+
+    def start(self):
+        with self._condition:
+            self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+scheduler = ReminderScheduler(
+    OutboxSender(), timedelta(hours=REMINDER_LOOKAHEAD_HOURS), timedelta(minutes=REMINDER_GRACE_MINUTES)
+)
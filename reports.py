@@ -0,0 +1,244 @@
+import argparse
+import json
+import math
+import multiprocessing
+import time as clock
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import bindparam, text, DateTime
+from sqlalchemy.exc import IntegrityError
+from database import database, models
+import availability
+import tenancy
+from cache import TTLCache
+from config import (
+    REPORT_CACHE_SIZE, REPORT_CACHE_TTL_SECONDS, REPORT_BATCH_SIZE, REPORT_NO_SHOW_LOOKBACK_DAYS,
+    REPORT_NO_SHOW_MIN_APPOINTMENTS, REPORT_NO_SHOW_RATE, REPORT_NO_SHOW_LIMIT, REPORT_WORKERS
+)
+
+# Weekly doctor reports: utilization per office and appointment type, booking lead times,
+# no-shows, and the patients who miss appointments most often. The doctor's appointments
+# are read with one raw SQL query, fetched in batches straight into NumPy columns (no ORM
+# objects, no per-row datetime parsing), and every figure is an array operation over those
+# columns. A finished week's report only changes when its appointments do: an outcome
+# recorded late, or an appointment booked or imported into the past, and every such write
+# drops it (invalidate), so it is stored in weekly_reports, which the batch job fills ahead
+# of time:
+#     python -m reports --weeks 4 --workers 8
+# In front of the table is a per-process LRU; the current week is recomputed once its entry
+# expires. numpy is imported on first use, keeping it off the app's startup path.
+
+WEEK = timedelta(days=7)
+COLUMNS = ("start_time", "end_time", "created_at", "status", "office_id", "appointment_type_id", "patient_id")
+DATETIME_COLUMNS = ("start_time", "end_time", "created_at")
+QUERY = text(
+    f"SELECT {', '.join(COLUMNS)} FROM appointments "
+    "WHERE doctor_id = :doctor_id AND start_time >= :start AND start_time < :end"
+).bindparams(bindparam("start", type_=DateTime), bindparam("end", type_=DateTime))
+# Lead time buckets as (lower bound in hours, label)
+LEAD_TIME_BUCKETS = ((0, "<1d"), (24, "1-3d"), (72, "3-7d"), (168, "1-2w"), (336, "2-4w"), (672, "4w+"))
+
+reports = TTLCache(REPORT_CACHE_SIZE, REPORT_CACHE_TTL_SECONDS)
+
+def week_of(day: date):
+    """The Monday starting `day`'s week."""
+    return day - timedelta(days=day.weekday())
+
+def _column(name, values):
+    import numpy as np
+    if name in DATETIME_COLUMNS:
+        # ISO strings (SQLite) or datetimes (PostgreSQL); NULL is NaT
+        return np.array(values, dtype="datetime64[us]")
+    if name == "status":
+        return np.array(values, dtype=object)
+    # Ids, -1 for NULL
+    return np.nan_to_num(np.array(values, dtype=np.float64), nan=-1).astype(np.int64)
+
+def load(db, doctor_id: int, start: datetime, end: datetime, batch_size: int = REPORT_BATCH_SIZE):
+    """{column: array} of the doctor's appointments starting in [start, end)."""
+    import numpy as np
+    result = db.execute(QUERY, {"doctor_id": doctor_id, "start": start, "end": end})
+    batches = {name: [] for name in COLUMNS}
+    while rows := result.fetchmany(batch_size):
+        for name, values in zip(COLUMNS, zip(*rows)):
+            batches[name].append(_column(name, values))
+    return {name: np.concatenate(arrays) if arrays else _column(name, ()) for name, arrays in batches.items()}
+
+def _breakdown(key, ids, minutes, no_show, scheduled):
+    """Utilization rows grouped by the `ids` array."""
+    import numpy as np
+    groups, inverse = np.unique(ids, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(groups))
+    booked = np.bincount(inverse, weights=minutes, minlength=len(groups))
+    misses = np.bincount(inverse, weights=no_show, minlength=len(groups))
+    return [
+        {key: int(group) if group >= 0 else None, "appointment_count": int(count), "booked_minutes": int(total),
+         "no_shows": int(missed), "share": round(total / scheduled, 4) if scheduled else 0.0}
+        for group, count, total, missed in zip(groups.tolist(), counts.tolist(), booked.tolist(), misses.tolist())
+    ]
+
+def _lead_times(starts, created):
+    import numpy as np
+    known = ~np.isnat(created)
+    # Hours between booking and appointment; rows imported after the fact count as 0
+    hours = np.maximum((starts[known] - created[known]) / np.timedelta64(1, "h"), 0)
+    bounds = np.array([bound for bound, _ in LEAD_TIME_BUCKETS[1:]], dtype=np.float64)
+    counts = np.bincount(np.searchsorted(bounds, hours, side="right"), minlength=len(LEAD_TIME_BUCKETS))
+    lead_times = {"count": int(hours.size), "buckets": {label: int(n) for (_, label), n in zip(LEAD_TIME_BUCKETS, counts)}}
+    if hours.size:
+        p50, p90 = np.percentile(hours, [50, 90])
+        lead_times.update(mean_hours=round(float(hours.mean()), 2), p50_hours=round(float(p50), 2),
+                          p90_hours=round(float(p90), 2))
+    return lead_times
+
+def _no_show_patients(patient_ids, no_show, attended):
+    import numpy as np
+    resolved = (no_show | attended) & (patient_ids >= 0)
+    patients, inverse = np.unique(patient_ids[resolved], return_inverse=True)
+    totals = np.bincount(inverse, minlength=len(patients))
+    misses = np.bincount(inverse, weights=no_show[resolved], minlength=len(patients))
+    rates = misses / np.maximum(totals, 1)
+    flagged = np.flatnonzero((totals >= REPORT_NO_SHOW_MIN_APPOINTMENTS) & (rates >= REPORT_NO_SHOW_RATE))
+    # Highest rate first, then most missed
+    flagged = flagged[np.lexsort((patients[flagged], -misses[flagged], -rates[flagged]))][:REPORT_NO_SHOW_LIMIT]
+    return [{"patient_id": int(patients[i]), "appointments": int(totals[i]), "no_shows": int(misses[i]),
+             "rate": round(float(rates[i]), 4)} for i in flagged]
+
+def compute(columns, schedules, doctor_id: int, week_start: date, now: datetime):
+    """The report of the week starting on `week_start` from load()ed columns ending with that week."""
+    import numpy as np
+    start = datetime.combine(week_start, time.min)
+    end = start + WEEK
+    starts = columns["start_time"]
+    in_week = (starts >= np.datetime64(start)) & (starts < np.datetime64(end))
+    no_show = columns["status"] == models.AppointmentStatus.NO_SHOW.name
+    attended = columns["status"] == models.AppointmentStatus.ATTENDED.name
+    minutes = (columns["end_time"][in_week] - starts[in_week]) / np.timedelta64(1, "m")
+    week_no_show = no_show[in_week].astype(np.float64)
+
+    scheduled = sum((window_end - window_start).total_seconds() // 60
+                    for window_start, window_end in availability.working_windows(schedules, start, end))
+    booked = float(minutes.sum())
+    no_shows, attended_count = int(no_show[in_week].sum()), int(attended[in_week].sum())
+    return {
+        "doctor_id": doctor_id, "week_start": week_start.isoformat(), "generated_at": now.isoformat(),
+        "appointment_count": int(in_week.sum()), "scheduled_minutes": int(scheduled), "booked_minutes": int(booked),
+        "utilization": round(booked / scheduled, 4) if scheduled else 0.0,
+        "attended": attended_count, "no_shows": no_shows,
+        "no_show_rate": round(no_shows / (no_shows + attended_count), 4) if no_shows + attended_count else None,
+        "offices": _breakdown("office_id", columns["office_id"][in_week], minutes, week_no_show, scheduled),
+        "appointment_types": _breakdown(
+            "appointment_type_id", columns["appointment_type_id"][in_week], minutes, week_no_show, scheduled
+        ),
+        "lead_times": _lead_times(starts[in_week], columns["created_at"][in_week]),
+        # Over the whole lookback, which load() was given
+        "no_show_patients": _no_show_patients(columns["patient_id"], no_show, attended),
+    }
+
+def generate(db, doctor_id: int, week_start: date, now: datetime = None):
+    now = now or datetime.now()
+    end = datetime.combine(week_start, time.min) + WEEK
+    columns = load(db, doctor_id, end - timedelta(days=REPORT_NO_SHOW_LOOKBACK_DAYS), end)
+    schedules = db.query(models.Schedule).filter(models.Schedule.doctor_id == doctor_id).all()
+    return compute(columns, schedules, doctor_id, week_start, now)
+
+def weekly(db, doctor_id: int, week_start: date, now: datetime = None):
+    """JSON body of the doctor's report for the week starting on Monday `week_start`."""
+    now = now or datetime.now()
+    key = (tenancy.name(), doctor_id, week_start)
+    body = reports.get(key)
+    if body is not None:
+        return body
+    finished = week_start + WEEK <= now.date()
+    if finished:
+        row = db.query(models.WeeklyReport.body).filter(
+            models.WeeklyReport.doctor_id == doctor_id, models.WeeklyReport.week_start == week_start
+        ).first()
+        body = row.body if row else None
+    if body is None:
+        body = json.dumps(generate(db, doctor_id, week_start, now))
+        if finished:
+            db.add(models.WeeklyReport(doctor_id=doctor_id, week_start=week_start, generated_at=now, body=body))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Stored meanwhile by another replica or batch worker
+                db.rollback()
+    reports.set(key, body)
+    return body
+
+def invalidate(db, doctor_id: int, start_time: datetime):
+    """Drops the reports that count the appointment starting at `start_time`; the caller commits.
+
+    That is its own week's and, through the no-show history, the weeks of the lookback after it.
+    """
+    _invalidate_week(db, doctor_id, week_of(start_time.date()))
+
+def invalidate_many(db, appointments):
+    """invalidate() for (doctor_id, start_time) pairs, once per doctor and week."""
+    for doctor_id, week_start in {(doctor_id, week_of(start_time.date())) for doctor_id, start_time in appointments}:
+        _invalidate_week(db, doctor_id, week_start)
+
+def _invalidate_week(db, doctor_id: int, first: date):
+    last = week_of(first + timedelta(days=REPORT_NO_SHOW_LOOKBACK_DAYS + 6))
+    # Only finished weeks are stored, so booking ahead skips the DELETE
+    if first + WEEK <= date.today():
+        db.query(models.WeeklyReport).filter(
+            models.WeeklyReport.doctor_id == doctor_id,
+            models.WeeklyReport.week_start >= first, models.WeeklyReport.week_start <= last
+        ).delete(synchronize_session=False)
+    week = first
+    while week <= last:
+        reports.pop((tenancy.name(), doctor_id, week))
+        week += WEEK
+
+def _generate(job):
+    """Batch job worker: stores the reports of some doctors; returns how many it went through."""
+    tenant, doctor_ids, weeks = job
+    db = tenancy.open_session(tenant)
+    try:
+        for doctor_id in doctor_ids:
+            for week_start in weeks:
+                weekly(db, doctor_id, week_start)
+    finally:
+        db.close()
+    return len(doctor_ids) * len(weeks)
+
+def main():
+    from database.bootstrap import init_schema
+
+    parser = argparse.ArgumentParser(description="Store the weekly reports of every doctor for finished weeks.")
+    parser.add_argument("--week", type=date.fromisoformat, help="any day of the last week to report (default: last week)")
+    parser.add_argument("--weeks", type=int, default=1, help="number of weeks, going back from --week")
+    parser.add_argument("--doctor", type=int, action="append", help="only these doctors")
+    parser.add_argument("--tenant", help="clinic database (tenancy.py) instead of the default one")
+    parser.add_argument("--workers", type=int, default=REPORT_WORKERS)
+    args = parser.parse_args()
+
+    last = week_of(args.week or date.today() - WEEK)
+    weeks = [last - WEEK * i for i in range(args.weeks)]
+    if args.tenant:
+        db = tenancy.tenants.get(args.tenant).SessionLocal()
+    else:
+        init_schema(database.engine)
+        db = database.SessionLocal()
+    try:
+        doctor_ids = args.doctor or [doctor_id for (doctor_id,) in db.query(models.Doctor.id).order_by(models.Doctor.id)]
+    finally:
+        db.close()
+
+    started = clock.perf_counter()
+    # Small chunks, so a few doctors with long histories do not leave the other workers idle
+    size = max(1, math.ceil(len(doctor_ids) / (args.workers * 4)))
+    jobs = [(args.tenant, doctor_ids[i:i + size], weeks) for i in range(0, len(doctor_ids), size)]
+    if args.workers > 1 and len(jobs) > 1:
+        # Spawned, not forked: the parent's engine connections must not be shared
+        with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            done = sum(executor.map(_generate, jobs))
+    else:
+        done = sum(map(_generate, jobs))
+    print(f"{done} reports for {len(doctor_ids)} doctors, weeks {weeks[-1]} to {weeks[0]}, "
+          f"in {clock.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
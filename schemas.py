@@ -1,7 +1,7 @@
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
-from datetime import time
-from database.models import DayOfWeek
+from pydantic import BaseModel, EmailStr, Field
+from typing import Dict, List, Optional
+from datetime import date, time
+from database.models import DayOfWeek, AppointmentStatus
 
 # User Schemas
 class UserCreate(BaseModel):
@@ -15,6 +15,15 @@ class User(BaseModel):
     class Config:
         from_attributes = True
 
+class Login(BaseModel):
+    username: str
+    password: str
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    expires_in: int
+
 from datetime import datetime
 
 # Appointment Schemas
@@ -31,10 +40,37 @@ class AppointmentCreate(AppointmentBase):
 
 class Appointment(AppointmentBase):
     id: int
+    status: Optional[AppointmentStatus] = None
+    created_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
+class AppointmentStatusUpdate(BaseModel):
+    status: AppointmentStatus
+
+# Recurring series: start_time/end_time are the first occurrence; give either count or until
+class Recurrence(BaseModel):
+    frequency: str = "weekly"  # "daily" or "weekly"
+    interval: int = 1
+    count: Optional[int] = None
+    until: Optional[date] = None
+
+class AppointmentSeriesCreate(AppointmentCreate):
+    recurrence: Recurrence
+    # False books the free occurrences and reports the rest
+    all_or_nothing: bool = True
+
+class SeriesOccurrence(BaseModel):
+    start_time: datetime
+    end_time: datetime
+    status: str
+    appointment_id: Optional[int] = None
+
+class AppointmentSeries(BaseModel):
+    booked: int
+    occurrences: List[SeriesOccurrence]
+
 # Patient Schemas
 class PatientBase(BaseModel):
     full_name: str
@@ -50,6 +86,13 @@ class Patient(PatientBase):
     class Config:
         from_attributes = True
 
+class PatientMatch(Patient):
+    match: str  # "phone", "email" or "name"
+    score: float
+
+class PatientSearch(BaseModel):
+    results: List[PatientMatch]
+
 # Office Schemas
 class OfficeBase(BaseModel):
     name: str
@@ -84,7 +127,7 @@ class Schedule(ScheduleBase):
 # AppointmentType Schemas
 class AppointmentTypeBase(BaseModel):
     name: str
-    duration_minutes: int
+    duration_minutes: int = Field(gt=0)
 
 class AppointmentTypeCreate(AppointmentTypeBase):
     pass
@@ -116,3 +159,158 @@ class Doctor(DoctorBase):
 
     class Config:
         from_attributes = True
+
+# Availability Schemas
+class Slot(BaseModel):
+    start_time: datetime
+    end_time: datetime
+
+class Availability(BaseModel):
+    doctor_id: int
+    office_id: int
+    appointment_type_id: int
+    slots: List[Slot] = []
+
+class DoctorSlot(Slot):
+    doctor_id: int
+    doctor_name: str
+    office_id: int
+    appointment_type_id: int
+
+class EarliestAvailability(BaseModel):
+    slots: List[DoctorSlot] = []
+
+class DateWindow(BaseModel):
+    start_time: datetime
+    end_time: datetime
+
+class DateWindows(BaseModel):
+    q: str
+    windows: List[DateWindow] = []
+
+# Bulk import Schemas
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportResult(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[ImportRowError] = []
+
+# Page Schemas
+class AppointmentPage(BaseModel):
+    items: List[Appointment]
+    next_cursor: Optional[str] = None
+
+# Change feed (changes.py): appointment is None once deleted
+class AppointmentChange(BaseModel):
+    seq: int
+    action: str
+    appointment_id: int
+    appointment: Optional[Appointment] = None
+
+class AppointmentChanges(BaseModel):
+    changes: List[AppointmentChange]
+    sync_token: str
+    more: bool = False
+
+class PatientPage(BaseModel):
+    items: List[Patient]
+    next_cursor: Optional[str] = None
+
+# Tenancy Schemas
+class ClinicSummary(BaseModel):
+    doctors: int
+    patients: int
+    appointment_count: int
+    booked_minutes: int
+
+class TenantSummary(BaseModel):
+    start_date: date
+    end_date: date
+    clinics: Dict[str, ClinicSummary]
+    total: ClinicSummary
+
+# Report Schemas
+class UtilizationRow(BaseModel):
+    appointment_count: int
+    booked_minutes: int
+    no_shows: int
+    # Of the doctor's scheduled minutes that week
+    share: float
+
+class OfficeUtilization(UtilizationRow):
+    office_id: Optional[int] = None
+
+class TypeUtilization(UtilizationRow):
+    appointment_type_id: Optional[int] = None
+
+class LeadTimes(BaseModel):
+    count: int
+    mean_hours: Optional[float] = None
+    p50_hours: Optional[float] = None
+    p90_hours: Optional[float] = None
+    # Appointments per lead time bucket, e.g. "1-3d"
+    buckets: Dict[str, int] = {}
+
+class NoShowPatient(BaseModel):
+    patient_id: int
+    appointments: int
+    no_shows: int
+    rate: float
+
+class WeeklyReport(BaseModel):
+    doctor_id: int
+    week_start: date
+    generated_at: datetime
+    appointment_count: int
+    scheduled_minutes: int
+    booked_minutes: int
+    utilization: float
+    attended: int
+    no_shows: int
+    no_show_rate: Optional[float] = None
+    offices: List[OfficeUtilization]
+    appointment_types: List[TypeUtilization]
+    lead_times: LeadTimes
+    no_show_patients: List[NoShowPatient]
+
+# Audit Schemas
+class AuditEntry(BaseModel):
+    id: int
+    at: datetime
+    actor: str
+    tenant: Optional[str] = None
+    action: str
+    entity: str
+    record_id: int
+    method: Optional[str] = None
+    path: Optional[str] = None
+    client: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class AuditPage(BaseModel):
+    items: List[AuditEntry]
+    next_cursor: Optional[str] = None
+
+# Occupancy Schemas
+class OfficeOccupancy(BaseModel):
+    office_id: int
+    booked_minutes: int
+    appointment_count: int
+    by_type: Dict[int, int] = {}
+
+class DayOccupancy(BaseModel):
+    day: date
+    scheduled_minutes: int
+    booked_minutes: int
+    free_minutes: int
+    appointment_count: int
+    offices: List[OfficeOccupancy] = []
+
+class Occupancy(BaseModel):
+    doctor_id: int
+    days: List[DayOccupancy] = []
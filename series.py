@@ -0,0 +1,76 @@
+from datetime import datetime, time, timedelta
+from booking_index import to_key, MICROSECOND
+
+# Recurring appointment series ("every Tuesday 10:00 for 12 weeks"). A rule expands into
+# int64 key arrays (booking_index.to_key) that are checked against the doctor's booked
+# intervals and working windows in one vectorized pass; both are fetched once for the whole
+# span of the series. crud.create_appointment_series does the locking and the inserts.
+# numpy is imported on first use, keeping it off the app's startup path.
+
+BOOKED = "booked"
+CONFLICT = "conflict"
+OUTSIDE_SCHEDULE = "outside_schedule"
+OVERLAPS_SERIES = "overlaps_series"
+# Free occurrences of an all-or-nothing series that was rejected because of the others
+NOT_BOOKED = "not_booked"
+
+STEPS = {"daily": timedelta(days=1), "weekly": timedelta(weeks=1)}
+
+def step(frequency: str, interval: int):
+    return STEPS[frequency] * interval // MICROSECOND
+
+def occurrence_count(start_time: datetime, frequency: str, interval: int, count: int = None, until=None):
+    """Number of occurrences: `count`, or every one starting on or before the `until` date."""
+    if count is not None:
+        return count
+    span = to_key(datetime.combine(until, time.max)) - to_key(start_time)
+    return max(0, span // step(frequency, interval) + 1)
+
+def expand(start_time: datetime, end_time: datetime, frequency: str, interval: int, count: int):
+    """(starts, ends) key arrays of the occurrences, the first one being start_time-end_time."""
+    import numpy as np
+    starts = to_key(start_time) + np.arange(count, dtype=np.int64) * step(frequency, interval)
+    return starts, starts + (to_key(end_time) - to_key(start_time))
+
+def _keys(intervals):
+    import numpy as np
+    intervals = sorted(intervals)
+    starts = np.array([to_key(start) for start, _ in intervals], dtype=np.int64)
+    ends = np.array([to_key(end) for _, end in intervals], dtype=np.int64)
+    return starts, ends
+
+def _overlaps(starts, ends, other_starts, other_ends):
+    import numpy as np
+    # The intervals starting before each occurrence ends overlap it if the latest of their
+    # ends is after the occurrence starts (the same max-end prefix as the booking index)
+    if not len(other_starts):
+        return np.zeros(len(starts), dtype=bool)
+    max_ends = np.maximum.accumulate(other_ends)
+    before = np.searchsorted(other_starts, ends, side="left")
+    return (before > 0) & (max_ends[np.maximum(before - 1, 0)] > starts)
+
+def _covered(starts, ends, window_starts, window_ends):
+    import numpy as np
+    # Windows are sorted and disjoint, so only the last one starting at or before the
+    # occurrence can contain it
+    if not len(window_starts):
+        return np.zeros(len(starts), dtype=bool)
+    last = np.searchsorted(window_starts, starts, side="right") - 1
+    return (last >= 0) & (window_ends[np.maximum(last, 0)] >= ends)
+
+def check(starts, ends, booked, windows):
+    """Status per occurrence: BOOKED if it is free, otherwise why it cannot be booked.
+
+    `booked` and `windows` are (start, end) datetimes covering the span of the series.
+    """
+    import numpy as np
+    overlaps_series = np.zeros(len(starts), dtype=bool)
+    overlaps_series[1:] = starts[1:] < ends[:-1]
+    return np.select(
+        [~_covered(starts, ends, *_keys(windows)), _overlaps(starts, ends, *_keys(booked)), overlaps_series],
+        [OUTSIDE_SCHEDULE, CONFLICT, OVERLAPS_SERIES], BOOKED
+    ).tolist()
+
+def rejected(statuses):
+    """Outcomes of an all-or-nothing series that was not booked."""
+    return [(NOT_BOOKED if status == BOOKED else status, None) for status in statuses]
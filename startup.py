@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Startup work that requests can be served without: warming the in-memory indexes and
+# calibrating bcrypt. main's lifespan runs it inline by default; with FAST_START it runs in a
+# background thread while the replica already takes traffic. Requests that arrive earlier are
+# still correct, only slower: crud checks conflicts in SQL until the booking index is ready,
+# and patient search keeps the words as typed until the vocabulary is loaded.
+
+class Warmup:
+    def __init__(self):
+        self.timings = {}
+        self.error = None
+        self._done = threading.Event()
+        self._done.set()
+        self._thread = None
+
+    @property
+    def warm(self):
+        return self._done.is_set() and self.error is None
+
+    def _run(self, steps):
+        try:
+            for name, step in steps:
+                started = time.perf_counter()
+                step()
+                self.timings[name] = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as exc:
+            self.error = repr(exc)
+            raise
+        finally:
+            self._done.set()
+
+    def _background(self, steps):
+        try:
+            self._run(steps)
+        except Exception:
+            # Reported by /readyz, which then fails so the replica gets replaced
+            logger.exception("startup warmup failed")
+
+    def run(self, steps):
+        """Runs the (name, callable) steps in order in the calling thread."""
+        self.timings, self.error = {}, None
+        self._done.clear()
+        self._run(steps)
+
+    def start(self, steps):
+        """Runs the steps in a background thread."""
+        self.timings, self.error = {}, None
+        self._done.clear()
+        self._thread = threading.Thread(target=self._background, args=(steps,), name="startup-warmup", daemon=True)
+        self._thread.start()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        return {"warm": self.warm, "error": self.error, "steps_ms": dict(self.timings)}
+
+warmup = Warmup()
@@ -0,0 +1,285 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from database import database, bootstrap
+import booking_index
+import cache
+from config import (
+    TENANTS, TENANT_DATABASE_URL, TENANT_ENGINE_CACHE_SIZE, TENANT_IDLE_SECONDS,
+    DOCTOR_CACHE_SIZE, DOCTOR_CACHE_TTL_SECONDS, ADMIN_USERNAME, ADMIN_PASSWORD, ADMIN_PASSWORD_HASH, ADMIN_BOOTSTRAP,
+    FAST_START
+)
+
+logger = logging.getLogger(__name__)
+
+# Per-clinic databases. With TENANTS set, each clinic's doctors, patients, users and
+# appointments live in their own database (TENANT_DATABASE_URL with the clinic's name: a
+# SQLite file each, or a PostgreSQL schema through search_path), so one clinic's writes never
+# wait on another's lock. Requests name the clinic with the X-Clinic header or a
+# /clinics/{tenant} path prefix; without either they use the default database, which keeps
+# the audit log and the idempotency keys. The admin user is created in every database. Engines
+# are opened on a clinic's first request and closed least recently used first, beyond
+# TENANT_ENGINE_CACHE_SIZE open or after TENANT_IDLE_SECONDS unused; background workers
+# read clinics through background_session, which never counts as a use. The in-memory state kept per doctor (the booking index and
+# the doctor profile cache) is per clinic too, as ids repeat across databases.
+
+HEADER = b"x-clinic"
+PREFIX = "/clinics/"
+NAME = re.compile(r"[a-z0-9][a-z0-9_-]{0,62}")
+
+class UnknownTenant(Exception):
+    pass
+
+class Tenant:
+    """A clinic's engine and the per-process state kept for its rows."""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        # Conflict checks use SQL until the background load is done, as at startup
+        self.index = booking_index.BookingIndex()
+        self.doctor_profiles = cache.TTLCache(DOCTOR_CACHE_SIZE, DOCTOR_CACHE_TTL_SECONDS)
+        self.last_used = time.monotonic()
+
+    def load_index(self):
+        db = self.SessionLocal()
+        try:
+            self.index.load(db)
+        except Exception:
+            logger.exception("Loading the booking index of clinic %s failed", self.name)
+        finally:
+            db.close()
+
+class TenantRegistry:
+    def __init__(self, names, url_template: str, capacity: int, idle_seconds: float):
+        self.names = frozenset(names)
+        self.url_template = url_template
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        self.opened = 0
+        self.closed = 0
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.names)
+
+    def url(self, name: str):
+        return self.url_template.format(tenant=name)
+
+    def _sqlite_path(self, name):
+        url = make_url(self.url(name))
+        path = url.database
+        return path if url.get_backend_name() == "sqlite" and path and path != ":memory:" else None
+
+    def make_engine(self, name):
+        path = self._sqlite_path(name)
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return database.make_engine(self.url(name))
+
+    def _connect(self, name):
+        engine = self.make_engine(name)
+        # As for the default database, FAST_START leaves the schema to python -m database.bootstrap
+        if not FAST_START:
+            bootstrap.init_schema(engine)
+        tenant = Tenant(name, engine)
+        if ADMIN_BOOTSTRAP:
+            # Users are per clinic, so the admin signs in to each clinic with its own token
+            db = tenant.SessionLocal()
+            try:
+                bootstrap.ensure_admin(db, ADMIN_USERNAME, ADMIN_PASSWORD, ADMIN_PASSWORD_HASH)
+            except IntegrityError:
+                # Created by a racing first request
+                db.rollback()
+            finally:
+                db.close()
+        return tenant
+
+    def touch(self, name: str):
+        """The clinic if its engine is open, else None; never blocks on the database."""
+        with self._lock:
+            tenant = self._open.get(name)
+            if tenant is not None:
+                self._open.move_to_end(name)
+                tenant.last_used = time.monotonic()
+            return tenant
+
+    def peek(self, name: str):
+        """The clinic if its engine is open, else None; unlike touch() it does not count as a use."""
+        with self._lock:
+            return self._open.get(name)
+
+    def open_names(self):
+        with self._lock:
+            return sorted(self._open)
+
+    @contextmanager
+    def background_session(self, name: str):
+        """A session for background workers, which must neither keep a clinic open nor reopen it.
+
+        On the clinic's engine if it is open, else on a throwaway engine without the schema
+        bootstrap, index load or cache slot of get(). None if the clinic's SQLite file does not exist.
+        """
+        if name not in self.names:
+            raise UnknownTenant(name)
+        tenant = self.peek(name)
+        if tenant is None and self._sqlite_path(name) and not os.path.exists(self._sqlite_path(name)):
+            yield None
+            return
+        engine = tenant.engine if tenant else database.make_engine(self.url(name))
+        db = Session(bind=engine, autoflush=False)
+        try:
+            yield db
+        finally:
+            db.close()
+            if tenant is None:
+                engine.dispose()
+
+    def get(self, name: str):
+        if name not in self.names:
+            raise UnknownTenant(name)
+        tenant = self.touch(name)
+        if tenant is not None:
+            return tenant
+        # Connected outside the lock, creating the schema can take a while; of two racing
+        # first requests the first to finish wins
+        tenant = self._connect(name)
+        with self._lock:
+            winner = self._open.setdefault(name, tenant)
+            closing = self._expired(keep=name) if winner is tenant else []
+        if winner is not tenant:
+            tenant.engine.dispose()
+            return winner
+        self.opened += 1
+        threading.Thread(target=tenant.load_index, name=f"tenant-index-{name}", daemon=True).start()
+        self._close(closing)
+        return tenant
+
+    def _expired(self, keep):
+        """Pops the engines to close: the least recently used past capacity, and idle ones."""
+        now = time.monotonic()
+        expired = [name for name, tenant in self._open.items()
+                   if name != keep and now - tenant.last_used > self.idle_seconds]
+        names = list(self._open)
+        expired += [name for name in names[:max(0, len(names) - self.capacity)] if name != keep and name not in expired]
+        return [self._open.pop(name) for name in expired]
+
+    def _close(self, tenants):
+        # Sessions still using an engine keep their connection until they close it
+        for tenant in tenants:
+            tenant.engine.dispose()
+            self.closed += 1
+
+    def map(self, fn, max_workers: int = 8):
+        """{clinic: fn(session)} for every clinic, querying several databases at a time."""
+        def run(name):
+            db = self.get(name).SessionLocal()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+
+        names = sorted(self.names)
+        if not names:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(names))) as executor:
+            return dict(zip(names, executor.map(run, names)))
+
+    def close_all(self):
+        with self._lock:
+            tenants, self._open = list(self._open.values()), OrderedDict()
+        self._close(tenants)
+
+    def stats(self):
+        with self._lock:
+            open_tenants = {name: {"index_ready": tenant.index.ready} for name, tenant in self._open.items()}
+        return {"tenants": len(self.names), "open": open_tenants, "capacity": self.capacity,
+                "opened": self.opened, "closed": self.closed}
+
+tenants = TenantRegistry(TENANTS, TENANT_DATABASE_URL, TENANT_ENGINE_CACHE_SIZE, TENANT_IDLE_SECONDS)
+current = ContextVar("tenant", default=None)
+
+def name():
+    tenant = current.get()
+    return tenant.name if tenant else None
+
+def session():
+    """A session on the current request's clinic database, else on the default one."""
+    tenant = current.get()
+    return (tenant.SessionLocal if tenant else database.SessionLocal)()
+
+def open_session(name: str = None):
+    """A session on the named clinic's database, or on the default one; for background workers."""
+    return (tenants.get(name).SessionLocal if name else database.SessionLocal)()
+
+@contextmanager
+def background_session(name: str = None):
+    """tenants.background_session for a clinic, else a session on the default database."""
+    if name:
+        with tenants.background_session(name) as db:
+            yield db
+        return
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def index():
+    tenant = current.get()
+    return tenant.index if tenant else booking_index.index
+
+def doctor_profiles():
+    tenant = current.get()
+    return tenant.doctor_profiles if tenant else cache.doctor_profiles
+
+def _requested(scope):
+    """(tenant name or None, scope routed without the /clinics/{tenant} prefix)."""
+    path = scope["path"]
+    if path.startswith(PREFIX):
+        name, _, rest = path[len(PREFIX):].partition("/")
+        prefix = PREFIX + name
+        scope = dict(scope, path="/" + rest, raw_path=("/" + rest).encode(),
+                     root_path=scope.get("root_path", "") + prefix)
+        return name, scope
+    header = dict(scope["headers"]).get(HEADER)
+    return (header.decode("latin-1") if header else None), scope
+
+class TenantMiddleware:
+    """Routes each request to its clinic's database."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tenants.enabled:
+            return await self.app(scope, receive, send)
+        name, scope = _requested(scope)
+        if name is None:
+            return await self.app(scope, receive, send)
+        try:
+            if not NAME.fullmatch(name):
+                raise UnknownTenant(name)
+            # Opening an engine creates the schema, off the event loop
+            tenant = tenants.touch(name) or await run_in_threadpool(tenants.get, name)
+        except UnknownTenant:
+            return await JSONResponse(status_code=404, content={"detail": "Unknown clinic"})(scope, receive, send)
+        token = current.set(tenant)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current.reset(token)
@@ -1,21 +1,31 @@
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime, timedelta
+import json
+import time
+from datetime import date, datetime, timedelta
 
 from main import app, get_db
-from database import database, models
+from database import database, models, bootstrap
+import crud, schemas, tokens, async_routes, hashing, reminders, outbox, instrumentation, occupancy, idempotency, series, audit
+import tenancy, reports, auth
 from database.database import Base
-from config import ADMIN_USERNAME, ADMIN_SECRET
+from config import ADMIN_USERNAME, ADMIN_PASSWORD, ADMIN_SECRET
 from schemas import DayOfWeek
+from booking_index import BookingIndex, DoctorIntervalIndex
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 
-engine = create_engine(
+engine = instrumentation.instrument_engine(create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+))
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Operator header, for the admin endpoints and for creating panel users
+ADMIN = {"admin-secret": ADMIN_SECRET}
 
 @pytest.fixture()
 def client():
@@ -32,6 +42,11 @@ def client():
     app.dependency_overrides[get_db] = override_get_db
 
     with TestClient(app) as test_client:
+        # Signed in as the admin for the panel routes; test_token_auth covers the login itself
+        db = TestingSessionLocal()
+        admin = crud.get_user_by_username(db, ADMIN_USERNAME)
+        db.close()
+        test_client.headers["Authorization"] = f"Bearer {tokens.authority.issue(admin.id, admin.username)[0]}"
         yield test_client
 
     Base.metadata.drop_all(bind=engine)
@@ -59,9 +74,71 @@ def test_admin_endpoint_protected(client):
     assert response.status_code == 200
     assert response.json() == {"message": "Welcome, admin!"}
 
+def test_token_auth(client):
+    anonymous = {"Authorization": ""}
+    assert client.get("/patients", headers=anonymous).status_code == 401
+    assert client.post("/token", json={"username": ADMIN_USERNAME, "password": "wrong"}).status_code == 401
+    # Panel accounts are created by an operator, not self-registered
+    assert client.post("/users/", json={"username": "intruder", "password": "password"}).status_code == 403
+
+    response = client.post("/token", json={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD})
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    verified = len(tokens.authority.verified)
+    assert client.get("/patients", headers=headers).status_code == 200
+    assert client.get("/patients", headers=headers).status_code == 200
+    assert len(tokens.authority.verified) == verified + 1
+
+    # Tampered, expired and revoked tokens are all refused
+    token = headers["Authorization"][7:]
+    assert client.get("/patients", headers={"Authorization": f"Bearer {token[:-2]}xx"}).status_code == 401
+    expired, _ = tokens.authority.issue(1, ADMIN_USERNAME, ttl=-1)
+    assert client.get("/patients", headers={"Authorization": f"Bearer {expired}"}).status_code == 401
+    assert client.post("/token/revoke", headers=headers).status_code == 204
+    assert client.get("/patients", headers=headers).status_code == 401
+
+def test_health_probes(client):
+    assert client.get("/healthz").json() == {"status": "ok"}
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["warm"] and body["database"] and "booking_index" in body["steps_ms"]
+
+def test_admin_bootstrap_with_precomputed_hash(client):
+    db = TestingSessionLocal()
+    assert bootstrap.ensure_admin(db, "ops", None, password_hash="$2b$12$precomputed") is True
+    assert bootstrap.ensure_admin(db, "ops", None, password_hash="$2b$12$precomputed") is False
+    assert crud.get_user_by_username(db, "ops").hashed_password == "$2b$12$precomputed"
+    db.close()
+
+def test_booking_index_keeps_writes_made_while_loading():
+    index = BookingIndex()
+
+    def rows():
+        yield 1, 1, datetime(2030, 1, 1, 9), datetime(2030, 1, 1, 10)
+        # Booked by a request after the load's query ran (FAST_START serves during the warmup)
+        index.add_interval(1, 2, datetime(2030, 1, 1, 10), datetime(2030, 1, 1, 11))
+
+    class Query:
+        def order_by(self, *columns):
+            return self
+
+        def yield_per(self, count):
+            return rows()
+
+    class Db:
+        def query(self, *columns):
+            return Query()
+
+    index.load(Db())
+    assert index.ready
+    assert index.booked(1, datetime(2030, 1, 1), datetime(2030, 1, 2)) == [
+        (datetime(2030, 1, 1, 9), datetime(2030, 1, 1, 10)), (datetime(2030, 1, 1, 10), datetime(2030, 1, 1, 11))
+    ]
+
 def test_create_doctor(client):
     # First create a user
-    user_response = client.post("/users/", json={"username": "testdoctor", "password": "password"})
+    user_response = client.post("/users/", json={"username": "testdoctor", "password": "password"}, headers=ADMIN)
     assert user_response.status_code == 200
     user_id = user_response.json()["id"]
 
@@ -87,7 +164,7 @@ def test_create_patient(client):
 
 def test_create_appointment(client):
     # Create a user and doctor
-    user_response = client.post("/users/", json={"username": "testdoctor", "password": "password"})
+    user_response = client.post("/users/", json={"username": "testdoctor", "password": "password"}, headers=ADMIN)
     user_id = user_response.json()["id"]
     doctor_response = client.post("/doctors/", json={
         "full_name": "Dr. Test", "title": "Testologist", "email": "dr.test@example.com",
@@ -124,7 +201,7 @@ def test_create_appointment(client):
 
 def test_doctor_availability(client):
     # Create a user and doctor
-    user_response = client.post("/users/", json={"username": "testdoctor", "password": "password"})
+    user_response = client.post("/users/", json={"username": "testdoctor", "password": "password"}, headers=ADMIN)
     user_id = user_response.json()["id"]
     doctor_response = client.post("/doctors/", json={
         "full_name": "Dr. Test", "title": "Testologist", "email": "dr.test@example.com",
@@ -184,3 +261,897 @@ def test_doctor_availability(client):
         "patient_id": patient_id, "office_id": office_id, "appointment_type_id": appointment_type_id
     })
     assert response.status_code == 200
+
+def setup_doctor(client, duration_minutes=30):
+    user_id = client.post("/users/", json={"username": "testdoctor", "password": "password"}, headers=ADMIN).json()["id"]
+    doctor_id = client.post("/doctors/", json={
+        "full_name": "Dr. Test", "title": "Testologist", "email": "dr.test@example.com",
+        "phone": "1234567890", "whatsapp_number": "1234567890", "user_id": user_id
+    }).json()["id"]
+    patient_id = client.post("/patients/", json={
+        "full_name": "Test Patient", "email": "patient@example.com", "phone": "0987654321"
+    }).json()["id"]
+    office_id = client.post(f"/doctors/{doctor_id}/offices/", json={
+        "name": "Test Office", "address": "123 Test St"
+    }).json()["id"]
+    appointment_type_id = client.post(f"/doctors/{doctor_id}/appointment_types/", json={
+        "name": "Test Appointment", "duration_minutes": duration_minutes
+    }).json()["id"]
+    return {
+        "doctor_id": doctor_id, "patient_id": patient_id, "office_id": office_id,
+        "appointment_type_id": appointment_type_id
+    }
+
+def test_doctor_free_slots(client):
+    ids = setup_doctor(client)
+    doctor_id = ids["doctor_id"]
+    client.post(f"/doctors/{doctor_id}/schedules/", json={
+        "day_of_week": "MONDAY", "start_time": "09:00:00", "end_time": "12:00:00"
+    })
+    monday = datetime(2030, 1, 7)
+    client.post("/appointments/", json={
+        **ids, "start_time": monday.replace(hour=10).isoformat(),
+        "end_time": monday.replace(hour=10, minute=30).isoformat()
+    })
+
+    response = client.get(f"/doctors/{doctor_id}/availability", params={
+        "start_date": "2030-01-06", "end_date": "2030-01-08",
+        "office_id": ids["office_id"], "appointment_type_id": ids["appointment_type_id"]
+    })
+    assert response.status_code == 200
+    starts = [slot["start_time"] for slot in response.json()["slots"]]
+    assert starts == [
+        "2030-01-07T09:00:00", "2030-01-07T09:30:00", "2030-01-07T10:30:00",
+        "2030-01-07T11:00:00", "2030-01-07T11:30:00"
+    ]
+
+    response = client.get(f"/doctors/{doctor_id}/availability", params={
+        "start_date": "2030-01-08", "end_date": "2030-01-06",
+        "office_id": ids["office_id"], "appointment_type_id": ids["appointment_type_id"]
+    })
+    assert response.status_code == 400
+
+    assert client.post(f"/doctors/{doctor_id}/appointment_types/", json={
+        "name": "Instant", "duration_minutes": 0
+    }).status_code == 422
+    # A zero-minute type stored before durations were validated has no slots
+    db = TestingSessionLocal()
+    legacy = models.AppointmentType(name="Legacy", duration_minutes=0, doctor_id=doctor_id)
+    db.add(legacy)
+    db.commit()
+    legacy_id = legacy.id
+    db.close()
+    response = client.get(f"/doctors/{doctor_id}/availability", params={
+        "start_date": "2030-01-06", "end_date": "2030-01-08",
+        "office_id": ids["office_id"], "appointment_type_id": legacy_id
+    })
+    assert response.status_code == 200 and response.json()["slots"] == []
+
+def test_interval_index_conflicts():
+    doctor_index = DoctorIntervalIndex()
+    for appointment_id, (start, end) in enumerate([(10, 20), (30, 40), (0, 5), (12, 50)]):
+        doctor_index.add(appointment_id, start, end)
+
+    assert list(doctor_index.starts) == [0, 10, 12, 30]
+    assert doctor_index.has_conflict(45, 48)  # only the overlapping legacy row reaches here
+    assert not doctor_index.has_conflict(5, 10)
+    assert not doctor_index.has_conflict(50, 60)
+    assert doctor_index.overlapping(18, 31) == [(10, 20), (12, 50), (30, 40)]
+
+def test_concurrent_bookings_never_overlap(client):
+    ids = setup_doctor(client)
+    base_time = datetime(2030, 1, 7, 9)
+    requests = [
+        schemas.AppointmentCreate(
+            **ids, start_time=base_time + timedelta(minutes=15 * (i % 12)),
+            end_time=base_time + timedelta(minutes=15 * (i % 12) + 30)
+        )
+        for i in range(1000)
+    ]
+
+    def book(i):
+        db = TestingSessionLocal()
+        try:
+            # Odd requests skip the per-doctor lock to exercise the compare-and-insert on its own
+            create = crud.create_appointment if i % 2 else crud.insert_appointment
+            return create(db, requests[i]) is not None
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        booked = sum(pool.map(book, range(len(requests))))
+
+    db = TestingSessionLocal()
+    rows = db.query(models.Appointment).order_by(models.Appointment.start_time).all()
+    db.close()
+    assert booked == len(rows) > 0
+    for previous, current in zip(rows, rows[1:]):
+        assert previous.end_time <= current.start_time
+
+def test_async_routes(client):
+    async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+    AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    async_app = FastAPI()
+    async_app.include_router(async_routes.router)
+    async_app.dependency_overrides[async_routes.get_async_db] = override_get_async_db
+
+    with TestClient(async_app) as async_client:
+        ids = setup_doctor(async_client)
+        doctor = async_client.get(f"/doctors/{ids['doctor_id']}").json()
+        assert [office["id"] for office in doctor["offices"]] == [ids["office_id"]]
+
+        start_time = datetime(2030, 1, 7, 9)
+        appointment = {
+            **ids, "start_time": start_time.isoformat(),
+            "end_time": (start_time + timedelta(minutes=30)).isoformat()
+        }
+        assert async_client.post("/appointments/", json=appointment).status_code == 200
+        response = async_client.post("/appointments/", json=appointment)
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Doctor is not available at this time"}
+
+        # Patient records need a panel token here too
+        assert async_client.get(f"/patients/{ids['patient_id']}").status_code == 401
+        response = async_client.get(f"/patients/{ids['patient_id']}", headers={"Authorization": client.headers["Authorization"]})
+        assert response.status_code == 200
+
+        # Patients created here are in the name index, and "search" is not taken for an id
+        response = async_client.get("/patients/search", params={"q": "Test Patiemt"},
+                                    headers={"Authorization": client.headers["Authorization"]})
+        assert [p["id"] for p in response.json()["results"]] == [ids["patient_id"]]
+
+        # Async bookings wait on the sync writers' per-doctor lock, without blocking the event loop
+        later = {**appointment, "start_time": "2030-01-07T10:00:00", "end_time": "2030-01-07T10:30:00"}
+        with ThreadPoolExecutor(1) as executor:
+            with crud.doctor_locks(crud.doctor_key(ids["doctor_id"])):
+                booking = executor.submit(async_client.post, "/appointments/", json=later)
+                assert async_client.get(f"/doctors/{ids['doctor_id']}").status_code == 200
+                time.sleep(0.2)
+                assert not booking.done()
+                # A sync writer holding the lock books the same slot first
+                db = TestingSessionLocal()
+                assert crud.insert_appointment(db, schemas.AppointmentCreate(**later)) is not None
+                db.close()
+            assert booking.result().status_code == 400
+
+def test_async_routes_guarded_like_sync_routes():
+    # The async handlers shadow the sync ones, so each must take the same auth dependencies
+    guards = {auth.current_user, auth.require_admin}
+    sync_routes = {(route.path, method): route for route in app.routes if hasattr(route, "dependant") for method in route.methods}
+    for route in async_routes.router.routes:
+        for method in route.methods:
+            sync_route = sync_routes[(route.path, method)]
+            assert {d.call for d in route.dependant.dependencies} & guards == \
+                {d.call for d in sync_route.dependant.dependencies} & guards, (method, route.path)
+
+def test_hashing_pool_backpressure(client, monkeypatch):
+    assert client.get("/admin/metrics/hashing").status_code == 403
+
+    monkeypatch.setattr(hashing.pool, "queue_limit", 0)
+    response = client.post("/users/", json={"username": "busy", "password": "password"}, headers=ADMIN)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    metrics = client.get("/admin/metrics/hashing", headers={"admin-secret": ADMIN_SECRET}).json()
+    assert metrics["rejected"] >= 1
+    assert metrics["queue_depth"] == 0
+    assert metrics["rounds"] >= 4
+
+def test_doctor_profile_cache_invalidation(client):
+    ids = setup_doctor(client)
+    doctor_id = ids["doctor_id"]
+    assert [o["id"] for o in client.get(f"/doctors/{doctor_id}").json()["offices"]] == [ids["office_id"]]
+
+    client.post(f"/doctors/{doctor_id}/schedules/", json={
+        "day_of_week": "MONDAY", "start_time": "09:00:00", "end_time": "12:00:00"
+    })
+    client.post(f"/doctors/{doctor_id}/offices/", json={"name": "Second Office", "address": "456 Test St"})
+    doctor = client.get(f"/doctors/{doctor_id}").json()
+    assert len(doctor["offices"]) == 2
+    assert [s["day_of_week"] for s in doctor["schedule"]] == ["MONDAY"]
+    assert client.get("/doctors/999").status_code == 404
+
+def test_bulk_import_patients(client):
+    client.post("/patients/", json={"full_name": "Existing", "email": "existing@example.com", "phone": "1"})
+    body = "\n".join([
+        '{"full_name": "Ana", "email": "ana@example.com", "phone": "1"}',
+        '{"full_name": "Ana again", "email": "ana@example.com", "phone": "2"}',
+        '{"full_name": "Existing", "email": "existing@example.com", "phone": "3"}',
+        '{"full_name": "No email", "phone": "4"}',
+        'not json',
+        '{"full_name": "Luis", "email": "luis@example.com", "phone": "5"}',
+    ])
+    response = client.post("/import/patients/", content=body, headers={"content-type": "application/x-ndjson", **ADMIN})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["inserted"] == 2
+    assert [e["row"] for e in result["errors"]] == [2, 3, 4, 5]
+    assert client.get("/patients/3").json()["full_name"] == "Luis"
+
+    # Imports take the admin secret, not a panel token
+    for path in ("/import/patients/", "/import/appointments/", "/doctors/1/schedules/import/"):
+        assert client.post(path, content=body, headers={"content-type": "application/x-ndjson"}).status_code == 403
+
+def test_bulk_import_appointments_csv(client):
+    ids = setup_doctor(client)
+    client.post("/appointments/", json={**ids, "start_time": "2030-01-07T09:00:00", "end_time": "2030-01-07T09:30:00"})
+    rows = [
+        ("2030-01-07T09:15:00", "2030-01-07T09:45:00"),  # overlaps the stored appointment
+        ("2030-01-07T10:00:00", "2030-01-07T10:30:00"),
+        ("2030-01-07T10:15:00", "2030-01-07T10:45:00"),  # overlaps the previous row
+        ("2030-01-07T10:30:00", "2030-01-07T11:00:00"),
+    ]
+    header = "start_time,end_time,doctor_id,patient_id,office_id,appointment_type_id"
+    body = "\n".join([header] + [
+        f"{start},{end},{ids['doctor_id']},{ids['patient_id']},{ids['office_id']},{ids['appointment_type_id']}"
+        for start, end in rows
+    ])
+    response = client.post("/import/appointments/", content=body, headers={"content-type": "text/csv", **ADMIN})
+    assert response.json()["inserted"] == 2
+    assert [e["row"] for e in response.json()["errors"]] == [1, 3]
+
+    response = client.post("/appointments/", json={**ids, "start_time": "2030-01-07T10:40:00", "end_time": "2030-01-07T10:50:00"})
+    assert response.status_code == 400
+
+    # Committed by another process, so not in this process's index: the SQL re-check catches it
+    db = TestingSessionLocal()
+    db.add(models.Appointment(**ids, start_time=datetime(2030, 1, 7, 12), end_time=datetime(2030, 1, 7, 12, 30)))
+    db.commit()
+    db.close()
+    body = "\n".join([header] + [
+        f"{start},{end},{ids['doctor_id']},{ids['patient_id']},{ids['office_id']},{ids['appointment_type_id']}"
+        for start, end in (("2030-01-07T12:15:00", "2030-01-07T12:45:00"), ("2030-01-07T13:00:00", "2030-01-07T13:30:00"))
+    ])
+    response = client.post("/import/appointments/", content=body, headers={"content-type": "text/csv", **ADMIN})
+    assert response.json()["inserted"] == 1 and [e["row"] for e in response.json()["errors"]] == [1]
+    db = TestingSessionLocal()
+    assert db.query(models.Appointment).filter(models.Appointment.start_time >= datetime(2030, 1, 7, 12)).count() == 2
+    db.close()
+
+def test_keyset_paginated_lists(client):
+    ids = setup_doctor(client)
+    base_time = datetime(2030, 1, 7, 9)
+    for i in range(5):
+        start_time = base_time + timedelta(hours=i)
+        client.post("/appointments/", json={
+            **ids, "start_time": start_time.isoformat(), "end_time": (start_time + timedelta(minutes=30)).isoformat()
+        })
+
+    starts, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get(f"/doctors/{ids['doctor_id']}/appointments", params=params).json()
+        starts += [item["start_time"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert starts == [(base_time + timedelta(hours=i)).isoformat() for i in range(5)]
+
+    response = client.get(f"/patients/{ids['patient_id']}/appointments", params={
+        "format": "ndjson", "start_time": (base_time + timedelta(hours=3)).isoformat()
+    })
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line)["start_time"] for line in response.text.splitlines()] == [
+        (base_time + timedelta(hours=i)).isoformat() for i in (3, 4)
+    ]
+
+    client.post("/patients/", json={"full_name": "Test Other", "email": "other@example.com", "phone": "1"})
+    names = [p["full_name"] for p in client.get("/patients", params={"name": "Test"}).json()["items"]]
+    assert names == ["Test Other", "Test Patient"]
+    assert client.get("/patients", params={"cursor": "garbage"}).status_code == 400
+    # A well-formed cursor with values of the wrong types, [1, 2]
+    assert client.get("/patients", params={"cursor": "WzEsIDJd"}).status_code == 400
+    assert client.get(f"/doctors/{ids['doctor_id']}/appointments", params={"cursor": "WzEsIDJd"}).status_code == 400
+
+def test_reminders_sent_once(client, monkeypatch):
+    sender = reminders.StubSender()
+    monkeypatch.setattr(reminders.scheduler, "sender", sender)
+    ids = setup_doctor(client)
+    start_time = (datetime.now() + timedelta(hours=3)).replace(microsecond=0)
+    appointment_id = client.post("/appointments/", json={
+        **ids, "start_time": start_time.isoformat(), "end_time": (start_time + timedelta(minutes=30)).isoformat()
+    }).json()["id"]
+
+    # The 24h reminder is long past; only the 2h one is queued
+    assert reminders.scheduler.dispatch_due(start_time - timedelta(hours=2, minutes=1)) == 0
+    assert reminders.scheduler.dispatch_due(start_time - timedelta(hours=2)) == 1
+    assert [(a, kind) for a, kind, _ in sender.sent] == [(appointment_id, "2h")]
+    assert "Test Appointment" in sender.sent[0][2] and "Test Office" in sender.sent[0][2]
+
+    # A restart reloads the window but the reminder is already claimed
+    db = TestingSessionLocal()
+    reminders.scheduler.load(db, now=start_time - timedelta(hours=2, minutes=5))
+    db.close()
+    assert reminders.scheduler.dispatch_due(start_time - timedelta(hours=2)) == 0
+    assert len(sender.sent) == 1
+
+def test_reminder_claim_commits_with_its_message(client):
+    ids = setup_doctor(client)
+    other_patient_id = client.post("/patients/", json={
+        "full_name": "Gone Patient", "email": "gone@example.com", "phone": "555"
+    }).json()["id"]
+    start_time = (datetime.now() + timedelta(hours=3)).replace(microsecond=0)
+    for offset, patient_id in ((0, ids["patient_id"]), (30, other_patient_id)):
+        appointment_start = start_time + timedelta(minutes=offset)
+        client.post("/appointments/", json={**ids, "patient_id": patient_id, "start_time": appointment_start.isoformat(),
+                                            "end_time": (appointment_start + timedelta(minutes=30)).isoformat()})
+    db = TestingSessionLocal()
+    db.query(models.Patient).filter(models.Patient.id == other_patient_id).delete()
+    db.commit()
+
+    # The reminder without a patient is claimed and dropped, not retried every minute
+    now = start_time - timedelta(hours=2) + timedelta(minutes=30)
+    assert reminders.scheduler.dispatch_due(now) == 2
+    assert reminders.scheduler.dispatch_due(now + reminders.RETRY_DELAY) == 0
+    assert db.query(models.ReminderSent).count() == 2
+    reminders_queued = db.query(models.OutboxMessage).filter(models.OutboxMessage.body.contains("Le recuerdo")).all()
+    assert [message.recipient for message in reminders_queued] == ["0987654321"]
+    db.close()
+
+def test_outbox_confirmation_retried(client, monkeypatch):
+    provider = outbox.FakeProvider(failures=1)
+    monkeypatch.setitem(outbox.dispatcher.providers, "whatsapp", provider)
+    monkeypatch.setattr(outbox.dispatcher, "backoff", 0.05)
+    ids = setup_doctor(client)
+    start_time = (datetime.now() + timedelta(days=3)).replace(microsecond=0)
+    appointment_id = client.post("/appointments/", json={
+        **ids, "start_time": start_time.isoformat(), "end_time": (start_time + timedelta(minutes=30)).isoformat()
+    }).json()["id"]
+
+    # The first attempt fails; the background workers retry it after the backoff
+    db = TestingSessionLocal()
+    query = db.query(models.OutboxMessage).filter(
+        models.OutboxMessage.appointment_id == appointment_id, models.OutboxMessage.channel == "whatsapp"
+    )
+    deadline = time.monotonic() + 5
+    while query.one().status != "sent" and time.monotonic() < deadline:
+        db.rollback()
+        time.sleep(0.02)
+    message = query.one()
+    db.close()
+    assert (message.status, message.attempts) == ("sent", 2)
+    assert len(provider.sent) == 1 and "Test Office" in provider.sent[0][2]
+
+    stats = client.get("/admin/metrics/outbox", headers={"admin-secret": ADMIN_SECRET}).json()
+    assert stats["channels"]["whatsapp"]["retried"] >= 1
+
+def test_token_bucket_limits_batches():
+    bucket = outbox.TokenBucket(rate=10)
+    assert bucket.reserve(50) == 10
+    assert bucket.reserve(5) == 0 and bucket.wait_time() > 0
+    bucket.refund(3)
+    assert bucket.reserve(5) == 3
+
+def test_schema_bootstrap_adds_missing_indexes(tmp_path):
+    from sqlalchemy import inspect, text
+    from database.database import sqlite_engine
+    from database.bootstrap import init_schema
+
+    # A database created before the composite appointment indexes existed
+    engine = sqlite_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_appointments_doctor_id_start_time_end_time"))
+        connection.execute(text("DROP TABLE outbox_messages"))
+
+    init_schema(engine)
+    init_schema(engine)
+    inspector = inspect(engine)
+    assert "outbox_messages" in inspector.get_table_names()
+    assert "ix_appointments_doctor_id_start_time_end_time" in {i["name"] for i in inspector.get_indexes("appointments")}
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+    engine.dispose()
+
+def test_patient_search_bootstrap_on_old_database(tmp_path):
+    from sqlalchemy import text
+    from database.database import sqlite_engine
+    from database.bootstrap import init_schema
+    import patient_search
+
+    # Patients written before the search columns and the name index existed
+    engine = sqlite_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE patients (id INTEGER PRIMARY KEY, full_name VARCHAR, email VARCHAR, phone VARCHAR)"))
+        connection.execute(text("INSERT INTO patients VALUES (1, 'Ramón Núñez', 'ramon@example.com', '+52 (55) 1234-5678')"))
+
+    init_schema(engine)
+    init_schema(engine)
+    db = sessionmaker(bind=engine)()
+    assert [(p.id, kind) for p, kind, _ in patient_search.search(db, "ramon nunez")] == [(1, "name")]
+    assert [p.id for p, _, _ in patient_search.search(db, "55 1234 5678")] == [1]
+    db.close()
+    engine.dispose()
+
+def test_metrics_endpoint(client):
+    ids = setup_doctor(client)
+    client.get(f"/doctors/{ids['doctor_id']}")
+    assert client.get("/metrics").status_code == 403
+
+    response = client.get("/metrics", headers={"admin-secret": ADMIN_SECRET})
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    route = 'method="GET",route="/doctors/{doctor_id}"'
+    assert any(line.startswith(f'bettyia_request_duration_seconds_bucket{{{route},le="+Inf"}}') for line in lines)
+    queries = next(line for line in lines if line.startswith(f"bettyia_request_queries_total{{{route}}}"))
+    assert float(queries.split()[-1]) >= 1
+    assert any(line.startswith("bettyia_request_slowest_query_seconds{") and "SELECT" in line for line in lines)
+
+def test_failed_statements_leave_no_timing_state():
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+    instrumented = instrumentation.instrument_engine(create_engine("sqlite://"))
+    with instrumented.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing"))
+        assert connection.execute(text("SELECT 1")).scalar() == 1
+        assert connection.info == {}
+
+def test_slow_request_profiler(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation.profiler, "directory", str(tmp_path))
+    monkeypatch.setattr(instrumentation.profiler, "threshold_ms", 0)
+    monkeypatch.setattr(instrumentation.profiler, "interval", 0.0005)
+    instrumentation.profiler.start()
+    try:
+        ids = setup_doctor(client)
+        for _ in range(20):
+            client.get(f"/doctors/{ids['doctor_id']}/appointments")
+    finally:
+        instrumentation.profiler.stop()
+    dumps = list(tmp_path.glob("*.folded"))
+    assert dumps
+    stack, count = dumps[0].read_text().splitlines()[0].rsplit(" ", 1)
+    assert ";" in stack and int(count) >= 1
+
+def test_daily_occupancy(client):
+    ids = setup_doctor(client)
+    doctor_id = ids["doctor_id"]
+    client.post(f"/doctors/{doctor_id}/schedules/", json={
+        "day_of_week": "MONDAY", "start_time": "09:00:00", "end_time": "12:00:00"
+    })
+    monday = datetime(2030, 1, 7)
+    for hour, minutes in ((9, 30), (10, 60)):
+        start_time = monday.replace(hour=hour)
+        assert client.post("/appointments/", json={
+            **ids, "start_time": start_time.isoformat(),
+            "end_time": (start_time + timedelta(minutes=minutes)).isoformat()
+        }).status_code == 200
+
+    response = client.get(f"/doctors/{doctor_id}/occupancy", params={
+        "start_date": "2030-01-07", "end_date": "2030-01-08"
+    })
+    assert response.status_code == 200
+    monday_occupancy, tuesday_occupancy = response.json()["days"]
+    assert monday_occupancy == {
+        "day": "2030-01-07", "scheduled_minutes": 180, "booked_minutes": 90, "free_minutes": 90,
+        "appointment_count": 2, "offices": [{
+            "office_id": ids["office_id"], "booked_minutes": 90, "appointment_count": 2,
+            "by_type": {str(ids["appointment_type_id"]): 2}
+        }]
+    }
+    assert tuesday_occupancy["booked_minutes"] == 0 and tuesday_occupancy["scheduled_minutes"] == 0
+
+    # A rebuild from the appointments table gives the same summary
+    db = TestingSessionLocal()
+    assert occupancy.rebuild(db) == 1
+    db.close()
+    assert client.get(f"/doctors/{doctor_id}/occupancy", params={
+        "start_date": "2030-01-07", "end_date": "2030-01-08"
+    }).json()["days"] == [monday_occupancy, tuesday_occupancy]
+
+def test_earliest_availability_across_doctors(client):
+    first = setup_doctor(client)
+    user_id = client.post("/users/", json={"username": "second", "password": "password"}, headers=ADMIN).json()["id"]
+    second_id = client.post("/doctors/", json={
+        "full_name": "Dr. Second", "title": "MD", "email": "second@example.com",
+        "phone": "1", "whatsapp_number": "1", "user_id": user_id
+    }).json()["id"]
+    second_office = client.post(f"/doctors/{second_id}/offices/", json={"name": "North", "address": "9 Other Ave"}).json()["id"]
+    # A zero-minute type of the same name, stored before durations were validated, is skipped
+    # rather than chosen as the doctor's type
+    db = TestingSessionLocal()
+    db.add(models.AppointmentType(name="Test Appointment", duration_minutes=0, doctor_id=second_id))
+    db.commit()
+    db.close()
+    client.post(f"/doctors/{second_id}/appointment_types/", json={"name": "test appointment", "duration_minutes": 30})
+    client.post(f"/doctors/{first['doctor_id']}/schedules/", json={
+        "day_of_week": "MONDAY", "start_time": "09:00:00", "end_time": "10:00:00"
+    })
+    client.post(f"/doctors/{second_id}/schedules/", json={
+        "day_of_week": "MONDAY", "start_time": "09:30:00", "end_time": "11:00:00"
+    })
+    monday = datetime(2030, 1, 7)
+    client.post("/appointments/", json={
+        **first, "start_time": monday.replace(hour=9).isoformat(), "end_time": monday.replace(hour=9, minute=30).isoformat()
+    })
+
+    response = client.get("/availability/earliest", params={
+        "appointment_type": "Test Appointment", "start_time": monday.isoformat(), "limit": 3
+    })
+    assert response.status_code == 200
+    assert [(s["doctor_id"], s["start_time"]) for s in response.json()["slots"]] == [
+        (first["doctor_id"], "2030-01-07T09:30:00"), (second_id, "2030-01-07T09:30:00"),
+        (second_id, "2030-01-07T10:00:00"),
+    ]
+    response = client.get("/availability/earliest", params={
+        "appointment_type": "Test Appointment", "address": "other", "start_time": monday.isoformat(), "limit": 1
+    })
+    assert [(s["doctor_id"], s["office_id"]) for s in response.json()["slots"]] == [(second_id, second_office)]
+
+def test_patient_search(client):
+    for name, email, phone in [
+        ("José Pérez García", "jose@example.com", "+52 55 1234 5678"),
+        ("Josefina Pérez", "josefina@example.com", "55 8765 4321"),
+        ("María López", "maria@example.com", "(33) 5555-0000"),
+    ]:
+        assert client.post("/patients/", json={"full_name": name, "email": email, "phone": phone}).status_code == 200
+
+    def search(q):
+        response = client.get("/patients/search", params={"q": q})
+        assert response.status_code == 200
+        return [(r["full_name"], r["match"]) for r in response.json()["results"]]
+
+    # Any phone format, with or without the country code
+    assert search("5512345678") == [("José Pérez García", "phone")]
+    assert search("+52 1 55 8765-4321") == search("525587654321") == [("Josefina Pérez", "phone")]
+    assert search("MARIA@example.com") == [("María López", "email")]
+    # Accent-insensitive, in any word order, the last word possibly cut short, and with typos
+    assert search("jose perez") == [("José Pérez García", "name")]
+    assert search("perez jos") == [("Josefina Pérez", "name"), ("José Pérez García", "name")]
+    assert search("Maria Lopes") == [("María López", "name")]
+    assert search("xyz") == []
+
+def test_earliest_slots_is_lazy():
+    from availability import earliest_slots
+    pulled = []
+
+    def generator(key, step):
+        for i in range(1000):
+            pulled.append(key)
+            start = datetime(2030, 1, 1) + timedelta(minutes=step * i)
+            yield start, start + timedelta(minutes=step)
+
+    slots = earliest_slots([(1, generator(1, 30)), (2, generator(2, 45))], 4)
+    assert [(start.minute, key) for start, _, key in slots] == [(0, 1), (0, 2), (30, 1), (45, 2)]
+    assert len(pulled) <= 6
+
+def test_date_windows(client):
+    # Wednesday 14 October 2026, 9:15
+    def windows(q, now="2026-10-14T09:15:00"):
+        response = client.get("/availability/windows", params={"q": q, "now": now})
+        assert response.status_code == 200
+        return [(w["start_time"][5:16], w["end_time"][5:16]) for w in response.json()["windows"]]
+
+    assert windows("¿Puedo el jueves en la tarde?") == [("10-15T14:00", "10-15T19:00")]
+    assert windows("mañana a las 10:30") == [("10-15T10:30", "10-15T11:30")]
+    assert windows("mañana en la mañana") == [("10-15T07:00", "10-15T12:00")]
+    assert windows("el jueves o el viernes a las 4") == [("10-15T16:00", "10-15T17:00"), ("10-16T16:00", "10-16T17:00")]
+    assert windows("el 15 de marzo después de las 5") == [("03-15T17:00", "03-16T00:00")]
+    # Today's morning is mostly gone and what is left starts now; a passed part of the day is tomorrow's
+    assert windows("hoy en la mañana") == [("10-14T09:15", "10-14T12:00")]
+    assert windows("en la mañana", now="2026-10-14T13:00:00") == [("10-15T07:00", "10-15T12:00")]
+    assert windows("el próximo miércoles entre las 10 y las 12") == [("10-21T10:00", "10-21T12:00")]
+    assert windows("el 15/03") == windows("el día 15/03") == [("03-15T00:00", "03-16T00:00")]
+    assert windows("el 29/02") == []
+    assert windows("el 10.30") == [("10-14T10:30", "10-14T11:30")]
+    assert windows("tengo 3 hijos") == []
+
+def test_date_phrases_are_memoized():
+    import date_phrases
+    date_phrases.parse.cache_clear()
+    now = datetime(2026, 10, 14, 9, 15)
+    first = date_phrases.windows("El JUEVES en la tarde!", now)
+    assert date_phrases.parse.cache_info().hits == 0
+    # Same phrase once normalized; only the resolution depends on the date
+    assert date_phrases.windows("el jueves  en la tarde", now) == first
+    assert date_phrases.windows("el jueves en la tarde", now + timedelta(days=7)) != first
+    assert date_phrases.parse.cache_info().hits == 2
+
+def test_appointment_series(client):
+    ids = setup_doctor(client)
+    client.post(f"/doctors/{ids['doctor_id']}/schedules/", json={
+        "day_of_week": "TUESDAY", "start_time": "09:00:00", "end_time": "12:00:00"
+    })
+    tuesday = datetime(2030, 1, 1, 10)
+    # Occupies the third Tuesday
+    client.post("/appointments/", json={
+        **ids, "start_time": (tuesday + timedelta(weeks=2)).isoformat(),
+        "end_time": (tuesday + timedelta(weeks=2, minutes=30)).isoformat()
+    })
+    series_in = {
+        **ids, "start_time": tuesday.isoformat(), "end_time": (tuesday + timedelta(minutes=30)).isoformat(),
+        "recurrence": {"frequency": "weekly", "count": 4}
+    }
+
+    response = client.post("/appointments/series/", json=series_in)
+    assert response.status_code == 400
+    statuses = [o["status"] for o in response.json()["detail"]["occurrences"]]
+    assert statuses == ["not_booked", "not_booked", "conflict", "not_booked"]
+    assert len(client.get(f"/doctors/{ids['doctor_id']}/appointments").json()["items"]) == 1
+
+    response = client.post("/appointments/series/", json={**series_in, "all_or_nothing": False})
+    assert response.status_code == 200
+    assert response.json()["booked"] == 3
+    assert [o["status"] for o in response.json()["occurrences"]] == ["booked", "booked", "conflict", "booked"]
+    assert response.json()["occurrences"][3]["start_time"] == "2030-01-22T10:00:00"
+    assert len(client.get(f"/doctors/{ids['doctor_id']}/appointments").json()["items"]) == 4
+
+def test_series_check_is_vectorized():
+    starts, ends = series.expand(datetime(2030, 1, 1, 9), datetime(2030, 1, 1, 10), "daily", 1, 4)
+    windows = [(datetime(2030, 1, d, 8), datetime(2030, 1, d, 12)) for d in (1, 2, 4)]
+    booked = [(datetime(2030, 1, 2, 9, 30), datetime(2030, 1, 2, 9, 45))]
+    assert series.check(starts, ends, booked, windows) == ["booked", "conflict", "outside_schedule", "booked"]
+    starts, ends = series.expand(datetime(2030, 1, 1, 9), datetime(2030, 1, 2, 10), "daily", 1, 2)
+    assert series.check(starts, ends, [], [(datetime(2030, 1, 1), datetime(2030, 1, 4))]) == ["booked", "overlaps_series"]
+    assert series.occurrence_count(datetime(2030, 1, 1, 10), "weekly", 2, until=date(2030, 1, 29)) == 3
+
+@pytest.mark.parametrize("store", ["memory", "database"])
+def test_idempotent_post_replay(client, monkeypatch, store):
+    monkeypatch.setattr(idempotency, "store", idempotency.make_store(store))
+    patient = {"full_name": "Retry Patient", "email": "retry@example.com", "phone": "1"}
+    headers = {"Idempotency-Key": "call-123"}
+    first = client.post("/patients/", json=patient, headers=headers)
+    assert first.status_code == 200
+
+    # A replay never reaches the handler
+    with monkeypatch.context() as m:
+        m.setattr(crud, "get_patient_by_email", None)
+        replay = client.post("/patients/", json=patient, headers=headers)
+    assert replay.status_code == 200 and replay.json() == first.json()
+    assert replay.headers["idempotent-replayed"] == "true"
+
+    assert client.post("/patients/", json=patient | {"phone": "2"}, headers=headers).status_code == 422
+    # Without a key the duplicate is rejected by the handler as before
+    assert client.post("/patients/", json=patient).status_code == 400
+
+def test_idempotency_key_in_flight():
+    store = idempotency.MemoryStore(10, 60, 60)
+    assert store.begin("k") is None
+    assert store.begin("k") is idempotency.PENDING
+    store.release("k")
+    assert store.begin("k") is None
+    store.complete("k", idempotency.StoredResponse("f", 200, [], b"{}"))
+    assert store.begin("k").status == 200
+
+def test_audit_trail(client):
+    patient_id = client.post("/patients/", json={
+        "full_name": "Audited Patient", "email": "audited@example.com", "phone": "5550001111"
+    }).json()["id"]
+    assert client.get(f"/patients/{patient_id}").status_code == 200
+    client.get(f"/patients/{patient_id}", headers={"Authorization": ""})
+
+    response = client.get("/admin/audit", params={"entity": "patients", "record_id": patient_id},
+                          headers={"admin-secret": ADMIN_SECRET})
+    assert response.status_code == 200
+    entries = [(e["actor"], e["action"], e["method"], e["path"]) for e in response.json()["items"]]
+    # The unauthenticated read was refused before the row was loaded
+    assert entries == [
+        ("user:admin", "create", "POST", "/patients/"),
+        ("user:admin", "read", "GET", f"/patients/{patient_id}"),
+    ]
+    assert client.get("/admin/audit", params={"actor": "nobody"}, headers={"admin-secret": ADMIN_SECRET}).json()["items"] == []
+    assert client.get("/admin/audit").status_code == 403
+
+def test_audit_buffer_is_bounded():
+    log = audit.AuditLog(capacity=3, batch_size=2, interval=60)
+    for record_id in range(5):
+        log.record(audit.READ, "patients", record_id, audit.SYSTEM)
+    stats = log.stats()
+    assert (stats["buffered"], stats["dropped"]) == (3, 2)
+    assert [entry[5] for entry in log._buffer] == [2, 3, 4]
+
+def test_tenant_routing(client, tmp_path, monkeypatch):
+    registry = tenancy.TenantRegistry(["north", "south"], f"sqlite:///{tmp_path}/{{tenant}}.db", 1, 600)
+    monkeypatch.setattr(tenancy, "tenants", registry)
+    monkeypatch.delitem(app.dependency_overrides, get_db)
+
+    for clinic in ("north", "south"):
+        response = client.post(f"/clinics/{clinic}/doctors/", json={
+            "full_name": f"Dr. {clinic}", "title": "GP", "email": "dr@example.com", "phone": "1234567890",
+            "whatsapp_number": "1234567890", "user_id": 1
+        })
+        assert response.status_code == 200 and response.json()["id"] == 1
+    assert client.get("/doctors/1", headers={"X-Clinic": "north"}).json()["full_name"] == "Dr. north"
+    assert client.get("/clinics/south/doctors/1").json()["full_name"] == "Dr. south"
+    assert client.get("/doctors/1").status_code == 404
+    assert client.get("/clinics/west/doctors/1").status_code == 404
+
+    # Users and tokens belong to one clinic
+    assert client.get("/clinics/north/patients").status_code == 401
+    db = registry.get("north").SessionLocal()
+    user = crud.create_user(db, schemas.UserCreate(username="clerk", password="pw"))
+    db.close()
+    token = client.post("/clinics/north/token", json={"username": "clerk", "password": "pw"}).json()["access_token"]
+    assert client.get("/clinics/north/patients", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+    assert client.get("/clinics/south/patients", headers={"Authorization": f"Bearer {token}"}).status_code == 401
+
+    # The admin is bootstrapped in each clinic and signs in there
+    admin_token = client.post("/clinics/south/token", json={
+        "username": ADMIN_USERNAME, "password": ADMIN_PASSWORD
+    }).json()["access_token"]
+    assert client.get("/clinics/south/patients", headers={"Authorization": f"Bearer {admin_token}"}).status_code == 200
+
+    # One engine open at a time: every switch closes the other clinic's
+    assert list(registry.stats()["open"]) == ["south"] and registry.closed >= 2
+
+    response = client.get("/admin/tenants/summary", params={"start_date": "2026-01-01", "end_date": "2026-12-31"},
+                          headers={"admin-secret": ADMIN_SECRET})
+    assert response.status_code == 200
+    assert response.json()["total"]["doctors"] == 2
+    assert {name: clinic["doctors"] for name, clinic in response.json()["clinics"].items()} == {"north": 1, "south": 1}
+
+def test_tenant_outbox_and_reminders(client, tmp_path, monkeypatch):
+    registry = tenancy.TenantRegistry(["north"], f"sqlite:///{tmp_path}/{{tenant}}.db", 2, 600)
+    monkeypatch.setattr(tenancy, "tenants", registry)
+    monkeypatch.delitem(app.dependency_overrides, get_db)
+    provider = outbox.FakeProvider()
+    monkeypatch.setitem(outbox.dispatcher.providers, "whatsapp", provider)
+    db = registry.get("north").SessionLocal()
+    crud.create_user(db, schemas.UserCreate(username="clerk", password="pw"))
+    db.close()
+    token = client.post("/clinics/north/token", json={"username": "clerk", "password": "pw"}).json()["access_token"]
+    client.headers.update({"X-Clinic": "north", "Authorization": f"Bearer {token}"})
+    ids = setup_doctor(client)
+    start_time = (datetime.now() + timedelta(hours=3)).replace(microsecond=0)
+    appointment_id = client.post("/appointments/", json={
+        **ids, "start_time": start_time.isoformat(), "end_time": (start_time + timedelta(minutes=30)).isoformat()
+    }).json()["id"]
+
+    # The reminder is scheduled and claimed in the clinic's database
+    assert reminders.scheduler.dispatch_due(start_time - timedelta(hours=2)) == 1
+    db = registry.get("north").SessionLocal()
+    assert [(r.appointment_id, r.kind) for r in db.query(models.ReminderSent)] == [(appointment_id, "2h")]
+
+    # The workers deliver the clinic's confirmation and reminder
+    query = db.query(models.OutboxMessage).filter(models.OutboxMessage.channel == "whatsapp")
+    deadline = time.monotonic() + 5
+    while any(m.status != "sent" for m in query) and time.monotonic() < deadline:
+        db.rollback()
+        time.sleep(0.02)
+    assert [m.status for m in query] == ["sent", "sent"] and len(provider.sent) == 2
+    db.close()
+
+def test_background_workers_leave_clinics_closed(client, tmp_path, monkeypatch):
+    registry = tenancy.TenantRegistry(["north", "south", "west"], f"sqlite:///{tmp_path}/{{tenant}}.db", 1, 600)
+    monkeypatch.setattr(tenancy, "tenants", registry)
+    provider = outbox.FakeProvider()
+    monkeypatch.setitem(outbox.dispatcher.providers, "whatsapp", provider)
+    start_time = (datetime.now() + timedelta(hours=3)).replace(microsecond=0)
+    db = registry.get("north").SessionLocal()
+    db.add(models.Appointment(doctor_id=1, patient_id=1, office_id=1, appointment_type_id=1,
+                              start_time=start_time, end_time=start_time + timedelta(minutes=30)))
+    outbox.enqueue(db, "whatsapp", "555", "Hola")
+    db.commit()
+    db.close()
+    last_used = registry.get("south").last_used
+    assert registry.open_names() == ["south"]
+
+    # North is read through a throwaway engine, west (never created) is skipped
+    db = TestingSessionLocal()
+    reminders.scheduler.load(db)
+    db.close()
+    assert ("north", 1) in reminders.scheduler._starts
+    outbox.dispatcher.notify("north")
+    deadline = time.monotonic() + 5
+    while not provider.sent and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert [body for _, _, body in provider.sent] == ["Hola"]
+    assert (registry.opened, registry.open_names()) == (2, ["south"])
+    assert registry.peek("south").last_used == last_used and not (tmp_path / "west.db").exists()
+
+def test_weekly_report(client):
+    ids = setup_doctor(client)
+    doctor_id = ids["doctor_id"]
+    client.post(f"/doctors/{doctor_id}/schedules/", json={
+        "day_of_week": "MONDAY", "start_time": "09:00:00", "end_time": "12:00:00"
+    })
+    monday = datetime(2026, 9, 7)
+    appointment_ids = [client.post("/appointments/", json={
+        **ids, "start_time": monday.replace(hour=hour, minute=minute).isoformat(),
+        "end_time": (monday.replace(hour=hour, minute=minute) + timedelta(minutes=length)).isoformat()
+    }).json()["id"] for hour, minute, length in ((9, 0, 30), (10, 0, 60), (11, 0, 30))]
+    for appointment_id, status in zip(appointment_ids, ("ATTENDED", "NO_SHOW", "NO_SHOW")):
+        response = client.put(f"/appointments/{appointment_id}/status", json={"status": status})
+        assert response.status_code == 200 and response.json()["status"] == status
+    future_id = client.post("/appointments/", json={
+        **ids, "start_time": "2030-01-07T09:00:00", "end_time": "2030-01-07T09:30:00"
+    }).json()["id"]
+    assert client.put(f"/appointments/{future_id}/status", json={"status": "NO_SHOW"}).status_code == 400
+    db = TestingSessionLocal()
+    db.query(models.Appointment).filter(models.Appointment.id.in_(appointment_ids)).update(
+        {"created_at": monday - timedelta(days=2)}, synchronize_session=False
+    )
+    db.commit()
+    db.close()
+
+    report = client.get(f"/doctors/{doctor_id}/reports/weekly", params={"week": "2026-09-09"}).json()
+    assert report["week_start"] == "2026-09-07"
+    assert (report["appointment_count"], report["scheduled_minutes"], report["booked_minutes"]) == (3, 180, 120)
+    assert (report["utilization"], report["attended"], report["no_shows"], report["no_show_rate"]) == (0.6667, 1, 2, 0.6667)
+    assert report["offices"] == [{"office_id": ids["office_id"], "appointment_count": 3, "booked_minutes": 120,
+                                  "no_shows": 2, "share": 0.6667}]
+    assert report["lead_times"]["count"] == 3 and report["lead_times"]["buckets"]["1-3d"] == 3
+    assert report["no_show_patients"] == [{"patient_id": ids["patient_id"], "appointments": 3, "no_shows": 2, "rate": 0.6667}]
+    assert client.get(f"/doctors/{doctor_id}/reports/weekly", params={"week": "2026-09-09"}, headers={"Authorization": ""}).status_code == 401
+
+    # The finished week is stored, and dropped when an outcome changes
+    db = TestingSessionLocal()
+    assert db.query(models.WeeklyReport).count() == 1
+    db.close()
+    client.put(f"/appointments/{appointment_ids[1]}/status", json={"status": "ATTENDED"})
+    report = client.get(f"/doctors/{doctor_id}/reports/weekly", params={"week": "2026-09-07"}).json()
+    assert (report["attended"], report["no_shows"]) == (2, 1)
+    assert report["no_show_patients"][0]["rate"] == 0.3333
+
+    # So is an appointment booked, or imported, into the finished week after the report
+    client.post("/appointments/", json={**ids, "start_time": "2026-09-07T11:30:00", "end_time": "2026-09-07T12:00:00"})
+    assert reports.reports.get((None, doctor_id, date(2026, 9, 7))) is None
+    assert client.get(f"/doctors/{doctor_id}/reports/weekly", params={"week": "2026-09-07"}).json()["appointment_count"] == 4
+    body = "\n".join([
+        "start_time,end_time,doctor_id,patient_id,office_id,appointment_type_id",
+        f"2026-09-07T09:30:00,2026-09-07T10:00:00,{doctor_id},{ids['patient_id']},{ids['office_id']},{ids['appointment_type_id']}"
+    ])
+    assert client.post("/import/appointments/", content=body, headers={"content-type": "text/csv", **ADMIN}).json()["inserted"] == 1
+    assert client.get(f"/doctors/{doctor_id}/reports/weekly", params={"week": "2026-09-07"}).json()["appointment_count"] == 5
+
+def test_agenda_exports_and_change_feed(client):
+    ids = setup_doctor(client)
+    doctor_id = ids["doctor_id"]
+    client.post(f"/doctors/{doctor_id}/schedules/", json={
+        "day_of_week": "MONDAY", "start_time": "09:00:00", "end_time": "12:00:00"
+    })
+    monday = datetime(2026, 9, 7)
+    first_id, second_id = [client.post("/appointments/", json={
+        **ids, "start_time": monday.replace(hour=hour).isoformat(), "end_time": monday.replace(hour=hour, minute=30).isoformat()
+    }).json()["id"] for hour in (9, 10)]
+
+    response = client.get(f"/doctors/{doctor_id}/calendar.ics")
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/calendar")
+    body = response.text
+    assert body.startswith("BEGIN:VCALENDAR\r\n") and body.endswith("END:VCALENDAR\r\n")
+    assert body.count("BEGIN:VEVENT") == 2 and f"UID:appointment-{first_id}@bettyia" in body
+    assert "DTSTART:20260907T090000\r\n" in body and "LOCATION:Test Office\\, 123 Test St\r\n" in body
+    assert all(len(line.encode()) <= 75 for line in body.split("\r\n"))
+    etag, token = response.headers["etag"], response.headers["x-sync-token"]
+    assert client.get(f"/doctors/{doctor_id}/calendar.ics", headers={"If-None-Match": etag}).status_code == 304
+    # Every exported appointment and patient is an audited read
+    for entity, record_id in (("appointments", first_id), ("appointments", second_id), ("patients", ids["patient_id"])):
+        entries = client.get("/admin/audit", params={"entity": entity, "record_id": record_id, "actor": "user:admin"},
+                             headers=ADMIN).json()["items"]
+        assert ("read", f"/doctors/{doctor_id}/calendar.ics") in [(e["action"], e["path"]) for e in entries]
+
+    response = client.get(f"/doctors/{doctor_id}/appointments/fhir", params={"end_time": monday.replace(hour=10).isoformat()})
+    assert response.status_code == 200 and response.headers["content-type"] == "application/fhir+json"
+    bundle = response.json()
+    assert (bundle["resourceType"], bundle["type"], len(bundle["entry"])) == ("Bundle", "searchset", 1)
+    resource = bundle["entry"][0]["resource"]
+    assert (resource["id"], resource["status"], resource["minutesDuration"]) == (str(first_id), "booked", 30)
+    assert {p["actor"]["reference"] for p in resource["participant"]} == {
+        f"Practitioner/{doctor_id}", f"Patient/{ids['patient_id']}", f"Location/{ids['office_id']}"
+    }
+    assert response.headers["etag"] != etag
+
+    # A change moves the ETag on, and the feed has only what changed after the export's token
+    client.put(f"/appointments/{second_id}/status", json={"status": "NO_SHOW"})
+    response = client.get(f"/doctors/{doctor_id}/calendar.ics", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    # The missed appointment is no longer a confirmed event
+    assert response.text.count("STATUS:CONFIRMED\r\n") == 1
+    assert response.text.count("STATUS:CANCELLED\r\nCOMMENT:No asistió\r\n") == 1
+    feed = client.get(f"/doctors/{doctor_id}/appointments/changes", params={"since": token}).json()
+    assert [(c["appointment_id"], c["action"], c["appointment"]["status"]) for c in feed["changes"]] == [
+        (second_id, "upsert", "NO_SHOW")
+    ]
+    assert feed["more"] is False
+    assert client.get(f"/doctors/{doctor_id}/appointments/changes", params={"since": feed["sync_token"]}).json()["changes"] == []
+    full = client.get(f"/doctors/{doctor_id}/appointments/changes", params={"limit": 1}).json()
+    assert [c["appointment_id"] for c in full["changes"]] == [first_id] and full["more"] is True
+    assert client.get(f"/doctors/{doctor_id}/appointments/changes", params={"since": "nope"}).status_code == 400
+    assert client.get(f"/doctors/{doctor_id}/calendar.ics", headers={"Authorization": ""}).status_code == 401
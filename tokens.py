@@ -0,0 +1,87 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from typing import NamedTuple, Optional
+from cache import TTLCache
+from config import TOKEN_SECRET, TOKEN_TTL_SECONDS, TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SECONDS
+
+# Signed access tokens for the doctor panel. The password is checked with bcrypt once, at
+# login (POST /token); every later request only checks the token's HMAC-SHA256 signature and
+# expiry, or finds it in a small LRU of recently verified tokens. Tokens are
+# base64url(claims JSON) "." base64url(signature). Revocation (logout) is a set of token ids
+# kept until the tokens would have expired anyway; it and the LRU are per process.
+
+class InvalidToken(Exception):
+    pass
+
+class Claims(NamedTuple):
+    user_id: int
+    username: str
+    expires_at: int
+    token_id: str
+    # The clinic database the user is in (tenancy.py), None for the default one
+    tenant: Optional[str] = None
+
+def _encode(data: bytes):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _decode(value: str):
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+class TokenAuthority:
+    def __init__(self, secret: bytes, ttl: float, cache_size: int, cache_ttl: float):
+        self.secret = secret
+        self.ttl = ttl
+        self.verified = TTLCache(cache_size, cache_ttl)
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    def _sign(self, payload: str):
+        return _encode(hmac.new(self.secret, payload.encode(), hashlib.sha256).digest())
+
+    def issue(self, user_id: int, username: str, ttl: float = None, tenant: str = None):
+        expires_at = int(time.time() + (self.ttl if ttl is None else ttl))
+        claims = {"sub": user_id, "name": username, "exp": expires_at, "jti": secrets.token_urlsafe(12)}
+        if tenant is not None:
+            claims["tnt"] = tenant
+        payload = _encode(json.dumps(claims, separators=(",", ":")).encode())
+        return f"{payload}.{self._sign(payload)}", expires_at
+
+    def _check_signature(self, token: str):
+        payload, _, signature = token.partition(".")
+        if not signature or not hmac.compare_digest(signature, self._sign(payload)):
+            raise InvalidToken("bad signature")
+        try:
+            data = json.loads(_decode(payload))
+            return Claims(int(data["sub"]), data["name"], int(data["exp"]), data["jti"], data.get("tnt"))
+        except (ValueError, KeyError, TypeError):
+            raise InvalidToken("malformed token")
+
+    def verify(self, token: str):
+        claims = self.verified.get(token)
+        if claims is None:
+            claims = self._check_signature(token)
+            self.verified.set(token, claims)
+        # Checked on cache hits too, so expiry and revocation take effect immediately
+        if claims.expires_at <= time.time():
+            raise InvalidToken("expired")
+        if claims.token_id in self._revoked:
+            raise InvalidToken("revoked")
+        return claims
+
+    def revoke(self, claims: Claims):
+        now = time.time()
+        with self._lock:
+            self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+            self._revoked[claims.token_id] = claims.expires_at
+
+# Without TOKEN_SECRET every process signs with its own random key, so tokens only work on
+# the replica that issued them
+authority = TokenAuthority(
+    TOKEN_SECRET.encode() if TOKEN_SECRET else secrets.token_bytes(32),
+    TOKEN_TTL_SECONDS, TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SECONDS
+)